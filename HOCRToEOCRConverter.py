@@ -13,19 +13,120 @@
 # limitations under the License.
 
 
-import re
-from os import listdir
-from os.path import isfile, join
-
+import json
+import queue
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as PoolTimeoutError
+from os import PathLike, scandir
+from os.path import basename, join
+
+import eocr_arrow
+import eocr_buffer
+import eocr_formats
 import eocr_helper
+import eocr_index
+import eocr_structure
+import eocr_validate
+import eocr_writer
 import hocr_helper
 from datetime import datetime
 
+# The ways .hocr files can be converted in parallel (see HOCRToEOCRConverter.start())
+parallel_modes = ('thread', 'process')
+
+# What to do with a page that fails to convert (see HOCRToEOCRConverter)
+error_policies = ('fail', 'skip', 'empty')
+
+# The size (in inches) of the empty page put in place of a page whose size is not known (US letter)
+empty_page_inches = (8.5, 11)
+
+_worker_state = threading.local()
+
+
+class PageFailure(object):
+    """
+    A page (or a whole .hocr file) that failed to convert.
+
+    :param source: The name of the .hocr file
+    :param page: The 0-based number of the page in the .hocr file, or None if the whole file failed (it could not
+                 be read or parsed, it timed out, or its worker died)
+    :param error: The name of the exception (e.g. 'ZeroDivisionError' or 'TimeoutError')
+    :param message: The exception's message
+    :param location: Where the exception was raised, as 'file:line in function', if known
+    :param action: The error policy that was applied: 'fail', 'skip' or 'empty'
+    """
+    def __init__(self, source, page, error, message, location = None, action = 'fail'):
+        self.source = source
+        self.page = page
+        self.error = error
+        self.message = message
+        self.location = location
+        self.action = action
+
+    @classmethod
+    def from_exception(cls, exception, source, page, action):
+        frames = traceback.extract_tb(exception.__traceback__)
+        location = f'{basename(frames[-1].filename)}:{frames[-1].lineno} in {frames[-1].name}' if frames else None
+        return cls(source, page, type(exception).__name__, str(exception), location, action)
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+    def __str__(self):
+        page = f' page {self.page}' if self.page is not None else ''
+        return f'{self.source}{page}: {self.error}: {self.message}'
+
 
 class HOCRToEOCRConverter(object):
-    def __init__(self):
-        self.zuva_document = eocr_helper.new_document()
+    def __init__(self, memory_budget = None, spill_directory = None, layers = True, on_error = 'fail',
+                 page_timeout = None, header_lines = False):
+        """
+        :param memory_budget: Optional number of bytes of converted characters to keep in memory. Past it, the
+                              converted pages are moved to a temporary file (in spill_directory) and read back
+                              when exporting.
+        :param spill_directory: Optional folder of the temporary file
+        :param layers: Whether to fill the font sizes, font styles, headers and footers of the eOCR document. The
+                       layers do not change the characters of the document.
+        :param on_error: What to do with a page that fails to convert (e.g. a malformed bbox): 'fail' raises the
+                         error, 'skip' leaves the page out of the document, and 'empty' puts an empty page (of the
+                         same size, if known) in its place. A .hocr file that cannot be parsed fails as a whole (as
+                         one page). The failures are kept in failures (see get_failure_report()).
+        :param page_timeout: Optional number of seconds after which a .hocr file that is still being converted by
+                             a pool of workers (see start()) fails with a TimeoutError
+        :param header_lines: Whether to also convert the lines hOCR marks as headers and footers (see
+                             hocr_helper.line_classes), which are skipped otherwise. This adds their text to the
+                             document (and to its headers and footers, with layers).
+        """
+        if on_error not in error_policies:
+            raise Exception(f'Unknown on_error {on_error!r} (use {", ".join(error_policies)})')
+
+        self.zuva_document = eocr_buffer.DocumentView(spill_directory = spill_directory)
+        self.memory_budget = memory_budget
+        self.layers = layers
+        self.on_error = on_error
+        self.page_timeout = page_timeout
+        self.header_lines = header_lines
+        self.failures = []
+        self.hocr_folder = None
+        self.hocr_manifest = None
+        self.hocr_archive = None
+        self._page = None
+
+    def reset(self):
+        """
+        Clears the converted document and the input settings, so that the converter can be reused for another
+        document. The document storage and the parser are kept.
+        """
+        self.zuva_document.clear()
         self.hocr_folder = None
+        self.hocr_manifest = None
+        self.hocr_archive = None
+        self._page = None
+        self.failures = []
 
     def consoleout(self, msg):
         """
@@ -37,15 +138,50 @@ class HOCRToEOCRConverter(object):
 
     def get_hocr_files(self):
         """
-        Gets all of the files in the hocr_folder that end with .hocr.
+        Gets all of the files in the hocr_folder that end with .hocr (or .hocr.gz), in natural (page) order.
+        """
+        hocr_files = [(hocr_helper.natural_sort_key(entry.name), entry.name)
+                      for entry in scandir(self.hocr_folder)
+                      if hocr_helper.is_hocr_file(entry.name)
+                      and entry.is_file()]
+
+        hocr_files.sort()
+
+        return [f for _, f in hocr_files]
+
+    def set_hocr_manifest(self, manifest):
+        """
+        Sets the ordered list of .hocr files to convert, so that the hocr_folder does not need to be scanned.
+
+        :param manifest: A JSON or newline separated manifest file (see hocr_helper.read_manifest),
+                         or an iterable of .hocr file paths in page order
+        """
+        if isinstance(manifest, (str, PathLike)):
+            manifest = hocr_helper.read_manifest(manifest)
+
+        self.hocr_manifest = list(manifest)
+
+    def set_hocr_archive(self, archive):
         """
-        hocr_files = [f for f in listdir(self.hocr_folder)
-                      if isfile(join(self.hocr_folder, f))
-                      and f.endswith('.hocr')]
+        Sets a zip or tar (optionally compressed) archive of the .hocr files to convert. The files are read from
+        the archive in natural (page) order, without being extracted to disk.
 
-        hocr_files.sort(key = lambda f:int(re.sub('\D', '', f)))
+        :param archive: The file path of the archive, or a binary file object
+        """
+        self.hocr_archive = archive
 
-        return hocr_files
+    def get_hocr_sources(self):
+        """
+        Gets the file paths of the .hocr files to convert, in page order: the manifest if one is set,
+        otherwise the .hocr files in the hocr_folder.
+        """
+        if self.hocr_manifest is not None:
+            return self.hocr_manifest
+
+        if self.hocr_folder is None:
+            raise Exception(f'hocr_folder is not set.')
+
+        return [join(self.hocr_folder, f) for f in self.get_hocr_files()]
 
     def set_document_md5(self, md5):
         """
@@ -60,7 +196,7 @@ class HOCRToEOCRConverter(object):
         """
         Adds the characters list to the converted output.
 
-        :param chars: An array of eOCR characters
+        :param chars: An array of eOCR characters, or an eocr_buffer.CharacterBuffer
         """
         self.zuva_document.characters.extend(chars)
 
@@ -71,29 +207,50 @@ class HOCRToEOCRConverter(object):
         :param range_start: The character index of where the page starts
         :param page: The page boundingbox
         """
-        page_bbox = hocr_helper.get_boundingbox(page)
+        self.zuva_document.pages.append(self._new_page(range_start, len(self.zuva_document.characters), page))
+
+    def add_page_block(self, block):
+        """
+        Adds a converted page (see iter_pages()) to the eOCR document.
+
+        :param block: The eocr_buffer.PageBlock
+        """
+        self.add_document_characters(block.characters)
+        self.zuva_document.pages.append(block.page)
+
+        for name, items in block.layers.items():
+            getattr(self.zuva_document, name).extend(items)
+
+        if block.structure is not None:
+            self.zuva_document.structure.extend(block.structure, block.offset)
+            self.zuva_document.structure.add('pages', block.page.range.start, block.page.range.end)
 
-        new_page = eocr_helper.new_page(range_start = range_start,
-                                           range_end = len(self.zuva_document.characters),
-                                           width = page_bbox.get('right'),
-                                           height = page_bbox.get('bottom'))
+        if self.memory_budget is not None and self.zuva_document.characters.buffer.nbytes>self.memory_budget:
+            self.zuva_document.characters.spill()
+
+    def _new_page(self, range_start, range_end, page):
+        page_bbox = hocr_helper.get_boundingbox(page)
 
-        self.zuva_document.pages.append(new_page)
+        return eocr_helper.new_page(range_start = range_start,
+                                    range_end = range_end,
+                                    width = page_bbox.get('right'),
+                                    height = page_bbox.get('bottom'))
 
     def _add_character_space(self, current_bbox, next_bbox):
         """
-        Adds a new eOCR character (space) on the same line as the previous character.
+        Adds a new eOCR character (space) on the same line as the previous character. It ends where the next word
+        starts (which is how eocr_formats tells it from a line space), so when the words overlap, the space is
+        empty, at the start of the next word.
 
         :param current_bbox: The current boundingbox of the hocr word that was parsed.
         :param next_bbox: The next boundingbox of the hocr word that was just parsed.
         """
-        char = eocr_helper.new_character(char = " ",
-                                            left_x1 = current_bbox.get('right'),
-                                            top_y1 = current_bbox.get('top'),
-                                            right_x2 = next_bbox.get('left'),
-                                            bottom_y2 = current_bbox.get('bottom'),
-                                            confidence = 0)
-        self.add_document_characters([char])
+        self._page.add_word(text = " ",
+                            confidence = 0,
+                            lefts = [min(current_bbox.get('right'), next_bbox.get('left'))],
+                            top = current_bbox.get('top'),
+                            rights = [next_bbox.get('left')],
+                            bottom = current_bbox.get('bottom'))
 
     def _add_line_space(self, bbox):
         """
@@ -102,13 +259,12 @@ class HOCRToEOCRConverter(object):
 
         :param bbox: The current boundingbox of the hocr word that was parsed.
         """
-        char = eocr_helper.new_character(char = " ",
-                                            left_x1 = bbox.get('right'),
-                                            top_y1 = bbox.get('top'),
-                                            right_x2 = bbox.get('right'),
-                                            bottom_y2 = bbox.get('bottom'),
-                                            confidence = 0)
-        self.add_document_characters([char])
+        self._page.add_word(text = " ",
+                            confidence = 0,
+                            lefts = [bbox.get('right')],
+                            top = bbox.get('top'),
+                            rights = [bbox.get('right')],
+                            bottom = bbox.get('bottom'))
 
     def _add_paragraph_space(self, bbox):
         """
@@ -122,85 +278,536 @@ class HOCRToEOCRConverter(object):
 
     def _load_hocr_word_as_zuva_characters(self, hocr_word):
         """
-        Loads the hocr-word as eOCR characters.
+        Loads the hocr-word into the current page. Its text is encoded later on, together with the rest of the page.
 
         :param hocr_word: The hocr "ocrx_word" entry
-        :return: Does not return anything. This loads the eOCR characters array in the final results.
+        :return: Does not return anything. This loads the character boxes of the current page.
         """
-        zuva_chars = []
-        chars = list(hocr_word.text)
+        text = hocr_word.text
+        count = len(text)
         confidence = hocr_helper.get_confidence(hocr_word)
         bbox = hocr_helper.get_boundingbox(hocr_word)
-        gap = hocr_helper.get_boundingbox_gap(bbox, len(chars))
+        gap = hocr_helper.get_boundingbox_gap(bbox, count)
         left = bbox.get('left')
-        top = bbox.get('top')
-        bottom = bbox.get('bottom')
+        bbox_right = bbox.get('right')
+        lefts = []
+        rights = []
 
-        for i, c in enumerate(chars):
-            if left + gap>bbox.get('right'):
-                right = bbox.get('right')
+        for i in range(count):
+            if left + gap>bbox_right:
+                right = bbox_right
             else:
                 right = left + gap
 
-            if i == len(chars) - 1:
-                right = bbox.get('right')
+            if i == count - 1:
+                right = bbox_right
 
-            new_character = eocr_helper.new_character(char = c,
-                                                         left_x1 = left,
-                                                         top_y1 = top,
-                                                         right_x2 = right,
-                                                         bottom_y2 = bottom,
-                                                         confidence = confidence)
-
-            zuva_chars.append(new_character)
+            lefts.append(left)
+            rights.append(right)
             left = right
 
-        self.add_document_characters(zuva_chars)
+        self._page.add_word(text = text,
+                            confidence = confidence,
+                            lefts = lefts,
+                            top = bbox.get('top'),
+                            rights = rights,
+                            bottom = bbox.get('bottom'))
 
-    def start(self):
-        if self.hocr_folder is None:
-            raise Exception(f'hocr_folder is not set.')
+    def _get_line_font_size(self, line):
+        """
+        Returns the font size (in points) of a line's words that do not have their own: the line's x_size (the
+        height of its characters in pixels) at the page's DPI.
+        """
+        line_size = hocr_helper.get_line_size(line)
+        return round(line_size * 72 / eocr_helper.page_dpi_y) if line_size else None
+
+    def _add_word_layers(self, hocr_word, word_start, line_size):
+        """
+        Adds the font size and styles of a word that was just loaded into the current page.
+
+        :param hocr_word: The hocr "ocrx_word" entry
+        :param word_start: The character position (in the page) of the word's first character
+        :param line_size: The font size of the word's line (see _get_line_font_size())
+        """
+        word_end = self._page.position
+        font_size = hocr_helper.get_font_size(hocr_word)
+        bold, italic = hocr_helper.get_styles(hocr_word)
+
+        self._page.font_sizes.add(word_start, word_end, font_size or line_size)
+        self._page.bold.add(word_start, word_end, True if bold else None)
+        self._page.italic.add(word_start, word_end, True if italic else None)
 
+    def _add_line_layers(self, line, line_start):
+        """
+        Adds a line (before its line space) to the headers or footers of the current page, if it is one.
+        """
+        line_end = self._page.position
+        line_class = line.get('class')
+
+        self._page.headers.add(line_start, line_end, True if 'ocr_header' in line_class else None)
+        self._page.footers.add(line_start, line_end, True if 'ocr_footer' in line_class else None)
+
+    def _check_ready(self):
         if not self.zuva_document.md5:
             raise Exception(f'source_hash must be provided (use set_document_md5())')
 
-        for hocr_filename in self.get_hocr_files():
-            hocr = join(self.hocr_folder, hocr_filename)
+    def convert_hocr_file(self, hocr):
+        """
+        Converts the pages of a single .hocr file and adds them to the eOCR document.
 
-            soup = hocr_helper.to_bs4(hocr)
+        :param hocr: The file path of the .hocr
+        """
+        hocr_filename = basename(hocr)
+        self._add_pages(self._convert_file(hocr, hocr_filename, len(self.zuva_document.characters)), hocr_filename)
 
-            for page in hocr_helper.get_pages(soup):
-                start = len(self.zuva_document.characters)
+    def convert_hocr_content(self, content, hocr_filename = 'hocr'):
+        """
+        Converts the pages of .hocr content that is already in memory and adds them to the eOCR document.
 
-                for paragraph in hocr_helper.get_paragraphs(page):
-                    for line in hocr_helper.get_lines(paragraph):
-                        words = hocr_helper.get_words(line)
+        :param content: The .hocr content (str or bytes)
+        :param hocr_filename: The name used to refer to the content in the console output
+        """
+        self.convert_hocr_soup(hocr_helper.content_to_bs4(content), hocr_filename)
 
-                        for i, word in enumerate(words):
-                            self._load_hocr_word_as_zuva_characters(word)
+    def convert_hocr_soup(self, soup, hocr_filename):
+        """
+        Converts the pages of parsed .hocr and adds them to the eOCR document.
 
-                            # If this isn't the last word in the line, add a space after it.
-                            if i != len(words) - 1:
-                                next_bbox = hocr_helper.get_boundingbox(words[i + 1])
-                                current_bbox = hocr_helper.get_boundingbox(word)
-                                self._add_character_space(current_bbox, next_bbox)
+        :param soup: The .hocr as BeautifulSoup
+        :param hocr_filename: The name used to refer to the .hocr in the console output
+        """
+        self._add_pages(self._convert_pages(soup, hocr_filename, len(self.zuva_document.characters)), hocr_filename)
 
-                        line_bbox = hocr_helper.get_boundingbox(line)
-                        self._add_line_space(line_bbox)
+    def _add_pages(self, blocks, hocr_filename):
+        for block in blocks:
+            self.add_page_block(block)
 
-                    paragraph_bbox = hocr_helper.get_boundingbox(paragraph)
-                    self._add_paragraph_space(paragraph_bbox)
+            self.consoleout(f'{hocr_filename} converted! (EOCR now contains {len(self.zuva_document.pages)} '
+                            f'page(s) and {len(self.zuva_document.characters)} character(s))')
 
-                self.add_document_page(start, page)
+    def _handle_failure(self, exception, source, page, offset, hocr_page = None):
+        """
+        Records a page (or a whole .hocr file, when page is None) that failed to convert, and applies on_error.
+
+        :param offset: The character index of where the page would have started
+        :param hocr_page: The hocr "ocr_page" entry, if it was parsed
+        :return: The empty eocr_buffer.PageBlock to put in the page's place, or None to leave it out
+        """
+        failure = PageFailure.from_exception(exception, source, page, self.on_error)
+        self.failures.append(failure)
+
+        if self.on_error == 'fail':
+            raise exception
+
+        self.consoleout(f'{failure} ({"left out" if self.on_error == "skip" else "replaced by an empty page"})')
+
+        if self.on_error == 'skip':
+            return None
+
+        return new_empty_page_block(source, offset, hocr_page)
+
+    def get_failure_report(self) -> dict:
+        """
+        Returns the pages that failed to convert, with the on_error policy that was applied to them.
+        """
+        return {'on_error': self.on_error,
+                'failed': len(self.failures),
+                'failures': [failure.to_dict() for failure in self.failures]}
 
-                self.consoleout(f'{hocr_filename} converted! (EOCR now contains {len(self.zuva_document.pages)} '
-                                f'page(s) and {len(self.zuva_document.characters)} character(s))')
+    def write_failure_report(self, report_file):
+        """
+        Writes get_failure_report() as a JSON file.
+        """
+        with open(report_file, 'w') as report:
+            json.dump(self.get_failure_report(), report, indent = 2)
+
+    def _convert_file(self, hocr, hocr_filename, offset):
+        """
+        Parses and converts the pages of a .hocr, without adding them to the eOCR document. A file that cannot be
+        parsed is handled according to on_error.
+
+        :param hocr: The file path of the .hocr, or its content (bytes)
+        :param offset: The character index of where the first page starts
+        :return: Yields an eocr_buffer.PageBlock for each page
+        """
+        try:
+            soup = parse_hocr(hocr)
+        except Exception as e:
+            block = self._handle_failure(e, hocr_filename, None, offset)
+            if block is not None:
+                yield block
+            return
+
+        yield from self._convert_pages(soup, hocr_filename, offset)
 
-    def export(self, output_file):
-        content = eocr_helper.get_eocr_file_content(self.zuva_document)
+    def _convert_pages(self, soup, hocr_filename, offset):
+        """
+        Converts the pages of parsed .hocr, without adding them to the eOCR document. Each page that fails to
+        convert is handled according to on_error.
 
-        with open(output_file, "wb") as output:
-            output.write(content)
+        :param offset: The character index of where the first page starts
+        :return: Yields an eocr_buffer.PageBlock for each page
+        """
+        for number, page in enumerate(hocr_helper.get_pages(soup)):
+            try:
+                block = self._convert_page(page, hocr_filename, offset)
+            except Exception as e:
+                self._page = None
+                block = self._handle_failure(e, hocr_filename, number, offset, page)
+                if block is None:
+                    continue
+
+            yield block
+            offset += len(block.characters)
+
+    def _convert_page(self, page, hocr_filename, offset) -> eocr_buffer.PageBlock:
+        """
+        Converts a hocr "ocr_page" entry.
+
+        :param offset: The character index of where the page starts
+        """
+        line_classes = hocr_helper.line_classes if self.header_lines else 'ocr_line'
+
+        self._page = eocr_buffer.PageBuilder()
+
+        structure = self._page.structure
+
+        for paragraph in hocr_helper.get_paragraphs(page):
+            paragraph_start = paragraph_end = self._page.position
+
+            for line in hocr_helper.get_lines(paragraph, line_classes):
+                words = hocr_helper.get_words(line)
+                line_start = self._page.position
+                line_size = self._get_line_font_size(line) if self.layers else None
+
+                for i, word in enumerate(words):
+                    word_start = self._page.position
+                    self._load_hocr_word_as_zuva_characters(word)
+                    structure.add('words', word_start, self._page.position)
+
+                    if self.layers:
+                        self._add_word_layers(word, word_start, line_size)
+
+                    # If this isn't the last word in the line, add a space after it.
+                    if i != len(words) - 1:
+                        next_bbox = hocr_helper.get_boundingbox(words[i + 1])
+                        current_bbox = hocr_helper.get_boundingbox(word)
+                        self._add_character_space(current_bbox, next_bbox)
+
+                # The line (and paragraph) ends with its last word, before the spaces added after it
+                line_end = paragraph_end = self._page.position if words else line_start
+                structure.add('lines', line_start, line_end)
+
+                if self.layers:
+                    self._add_line_layers(line, line_start)
+
+                line_bbox = hocr_helper.get_boundingbox(line)
+                self._add_line_space(line_bbox)
+
+            structure.add('paragraphs', paragraph_start, paragraph_end)
+
+            paragraph_bbox = hocr_helper.get_boundingbox(paragraph)
+            self._add_paragraph_space(paragraph_bbox)
+
+        characters = self._page.build()
+        layers = self._page.build_layers(offset) if self.layers else None
+        self._page = None
+
+        return eocr_buffer.PageBlock(characters = characters,
+                                     page = self._new_page(offset, offset + len(characters), page),
+                                     offset = offset,
+                                     source = hocr_filename,
+                                     layers = layers,
+                                     structure = structure)
+
+    def iter_pages(self):
+        """
+        Converts the .hocr files and yields each page as soon as it is converted. Unlike start(), the pages are not
+        added to the eOCR document, so the caller decides what is kept (see add_page_block()).
+
+        :return: Yields an eocr_buffer.PageBlock (the page's characters, its eOCR Page and the character index
+                 of where it starts) for each page
+        """
+        offset = len(self.zuva_document.characters)
+
+        for hocr_filename, hocr in self._iter_hocr_inputs():
+            for block in self._convert_file(hocr, hocr_filename, offset):
+                offset = block.end
+                yield block
+
+    def _iter_hocr_inputs(self):
+        """
+        Lists the .hocr files to convert, in page order: the files of the hocr_archive if one is set, otherwise the
+        files of get_hocr_sources().
+
+        :return: Yields a tuple of (the .hocr's file name, its file path or its content as bytes)
+        """
+        if self.hocr_archive is not None:
+            for hocr_filename, content in hocr_helper.iter_archive(self.hocr_archive):
+                yield basename(hocr_filename), content
+            return
+
+        for hocr in self.get_hocr_sources():
+            yield basename(hocr), hocr
+
+    def _iter_converted_files(self, workers, mode):
+        """
+        Converts the .hocr files on a pool of workers, each file on its own, and yields them in page order. At most
+        2 files per worker are converted ahead of the file that is yielded.
+
+        A file that is not converted within page_timeout seconds of the files before it (or whose worker process
+        died) is handled according to on_error. Its worker cannot be interrupted, so the pool is replaced and the
+        files queued on it are converted again. A worker process is terminated, but a worker thread keeps running
+        until its file is done.
+
+        :return: Yields a tuple of (the .hocr's file name, the list of its eocr_buffer.PageBlock, starting at 0)
+        """
+        if mode not in parallel_modes:
+            raise Exception(f'Unknown mode {mode!r} (use {" or ".join(parallel_modes)})')
+
+        if mode == 'thread':
+            executor, function = ThreadPoolExecutor, convert_hocr
+        else:
+            # Worker processes hand their pages back in shared memory rather than pickling the characters
+            executor, function = ProcessPoolExecutor, convert_hocr_shared
+
+        inputs = self._iter_hocr_inputs()
+        pending = deque()
+        # The futures of replaced pools, which may still have handed back pages in shared memory
+        abandoned = []
+        pool = executor(max_workers = workers)
+
+        def submit(hocr_filename, hocr):
+            return hocr_filename, hocr, pool.submit(function, hocr, hocr_filename, self.layers, self.on_error,
+                                                       self.header_lines)
+
+        try:
+            while True:
+                for hocr_filename, hocr in inputs:
+                    pending.append(submit(hocr_filename, hocr))
+                    if len(pending) >= 2 * workers:
+                        break
+
+                if not pending:
+                    return
+
+                hocr_filename, hocr, future = pending.popleft()
+
+                try:
+                    blocks, failures = future.result(timeout = self.page_timeout)
+                except Exception as e:
+                    if isinstance(e, PoolTimeoutError):
+                        e = TimeoutError(f'Not converted within {self.page_timeout} s')
+
+                    broken = isinstance(e, (TimeoutError, BrokenExecutor))
+                    if broken:
+                        terminate_pool(pool)
+                        pool = None
+
+                    block = self._handle_failure(e, hocr_filename, None, 0)
+                    blocks, failures = [block] if block is not None else [], []
+
+                    if broken:
+                        abandoned.extend(item[2] for item in pending if not is_converted(item[2]))
+                        pool = executor(max_workers = workers)
+                        pending = deque(item if is_converted(item[2]) else submit(*item[:2]) for item in pending)
+
+                self.failures.extend(failures)
+
+                if isinstance(blocks, eocr_buffer.SharedPageBlocks):
+                    blocks = blocks.to_page_blocks()
+
+                yield hocr_filename, blocks
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures = True)
+
+            # The files converted ahead of the one yielded last are not used when the conversion stops early (an
+            # error, or a caller that stops iterating)
+            free_shared_results([item[2] for item in pending] + abandoned)
+
+    def start(self, workers = None, mode = 'thread'):
+        """
+        Converts the .hocr files and adds their pages to the eOCR document.
+
+        :param workers: Optional number of workers that parse and convert the .hocr files in parallel. Each file
+                        is converted on its own, and its pages are added to the document in page order by the
+                        calling thread, so the document is only ever changed by one thread.
+        :param mode: 'thread' (a thread pool, for hosts where worker processes are not an option) or 'process'
+        """
+        self._check_ready()
+
+        if not workers:
+            for hocr_filename, hocr in self._iter_hocr_inputs():
+                self._add_pages(self._convert_file(hocr, hocr_filename, len(self.zuva_document.characters)),
+                                hocr_filename)
+            return
+
+        for hocr_filename, blocks in self._iter_converted_files(workers, mode):
+            offset = len(self.zuva_document.characters)
+
+            for block in blocks:
+                block.rebase(offset)
+                self.add_page_block(block)
+
+            self.consoleout(f'{hocr_filename} converted! (EOCR now contains {len(self.zuva_document.pages)} '
+                            f'page(s) and {len(self.zuva_document.characters)} character(s))')
+
+    def start_pipelined(self, expected_pages, page_queue = None, first_page = 0, poll_interval = 0.5,
+                        timeout = None):
+        """
+        Converts the .hocr files while they are still being OCR'd, so that conversion overlaps with the OCR.
+        Files are converted in page order: page-N.hocr is only converted once every page before it has been.
+
+        The .hocr files either come from page_queue (file paths put by the OCR process, with None to signal that
+        no more will come) or, when page_queue is not set, by watching the hocr_folder for new, complete files.
+
+        :param expected_pages: The number of .hocr files that make up the document
+        :param page_queue: Optional queue.Queue of .hocr file paths
+        :param first_page: The page number of the first .hocr file (e.g. 0 for page-0000.hocr)
+        :param poll_interval: The number of seconds between two scans of the hocr_folder
+        :param timeout: The number of seconds to wait for the next page before giving up (None waits forever)
+        """
+        if page_queue is None and self.hocr_folder is None:
+            raise Exception(f'hocr_folder is not set.')
+
+        self._check_ready()
+
+        pending = {}
+        seen = set()
+        next_page = first_page
+        last_page = first_page + expected_pages
+        last_progress = time.monotonic()
+
+        while next_page < last_page:
+            if page_queue is not None:
+                try:
+                    hocr = page_queue.get(timeout = poll_interval)
+                except queue.Empty:
+                    hocr = ''
+
+                if hocr is None:
+                    raise Exception(f'The page queue ended after {next_page - first_page} of '
+                                    f'{expected_pages} page(s)')
+                if hocr:
+                    pending[hocr_helper.get_page_number(basename(hocr))] = hocr
+            else:
+                for entry in scandir(self.hocr_folder):
+                    if not entry.name.endswith('.hocr') or entry.name in seen:
+                        continue
+
+                    if hocr_helper.is_complete(entry.path):
+                        seen.add(entry.name)
+                        pending[hocr_helper.get_page_number(entry.name)] = entry.path
+
+            if next_page in pending:
+                while next_page in pending:
+                    self.convert_hocr_file(pending.pop(next_page))
+                    next_page += 1
+                last_progress = time.monotonic()
+                continue
+
+            if timeout is not None and time.monotonic() - last_progress>timeout:
+                raise Exception(f'Timed out waiting for page {next_page} '
+                                f'({next_page - first_page} of {expected_pages} page(s) converted)')
+
+            if page_queue is None:
+                time.sleep(poll_interval)
+
+    def validate(self) -> list:
+        """
+        Checks the converted document for problems that would make Zuva reject the .eocr (see
+        eocr_validate.validate_document()).
+
+        :return: A list of eocr_validate.ValidationIssue (empty if the document is valid)
+        """
+        return eocr_validate.validate_document(self.zuva_document)
+
+    def export(self, output_file, index_file = None, validate = False, workers = None, structure_file = None):
+        """
+        Writes the eOCR file.
+
+        :param output_file: The file path (including file name) of the resultant .eocr
+        :param index_file: Optional file path of an index (sidecar) file, which allows eocr_index.EOCRReader
+                           to read single pages without decompressing the whole .eocr
+        :param validate: Whether to validate the document first, and raise eocr_validate.ValidationError instead of
+                         writing an invalid .eocr
+        :param workers: Optional number of threads that compress the body in parallel (see eocr_writer.EOCRWriter)
+        :param structure_file: Optional file path of a structure (sidecar) file, which keeps the character offsets
+                               of the words, lines, paragraphs and pages (see eocr_structure.StructureIndex)
+        """
+        if validate:
+            issues = self.validate()
+            if issues:
+                raise eocr_validate.ValidationError(issues)
+
+        with eocr_writer.EOCRWriter(output_file, self.zuva_document.md5, self.zuva_document.version,
+                                    workers = workers) as writer:
+            writer.write_document(self.zuva_document)
+
+        if index_file is not None:
+            with open(output_file, 'rb') as eocr:
+                eocr_index.write_index(eocr.read(), index_file)
+
+        if structure_file is not None:
+            self.zuva_document.structure.write(structure_file)
+
+    def stream_export(self, output_file, index_file = None, structure_file = None):
+        """
+        Converts the .hocr files and writes the eOCR file page by page, so that only one page is in memory at a
+        time. The result is the same as start() followed by export(), but the pages are not kept in zuva_document.
+
+        :param output_file: The file path (including file name) of the resultant .eocr
+        :param index_file: Optional file path of an index (sidecar) file (see export())
+        :param structure_file: Optional file path of a structure (sidecar) file (see export())
+        """
+        self._check_ready()
+        structure = eocr_structure.StructureIndex()
+
+        with eocr_writer.EOCRWriter(output_file, self.zuva_document.md5, self.zuva_document.version) as writer:
+            for block in self.iter_pages():
+                writer.write_page_block(block)
+                structure.extend(block.structure, block.offset)
+                structure.add('pages', block.page.range.start, block.page.range.end)
+
+                self.consoleout(f'{block.source} converted! ({writer.page_count} page(s) and '
+                                f'{writer.character_count} character(s) written)')
+
+        if index_file is not None:
+            with open(output_file, 'rb') as eocr:
+                eocr_index.write_index(eocr.read(), index_file)
+
+        if structure_file is not None:
+            structure.write(structure_file)
+
+    def bundle_export(self, bundle_writer, name):
+        """
+        Adds the eOCR file to a bundle of many documents, instead of writing it to its own file.
+
+        :param bundle_writer: An open eocr_bundle.EOCRBundleWriter
+        :param name: The name of the document in the bundle (e.g. the name the standalone .eocr would have)
+        """
+        bundle_writer.add_document(name, self.zuva_document)
+
+    def export_columns(self, output_file):
+        """
+        Writes the characters (and the page number of each) as columns, for analytics: a Parquet file if the file
+        name ends with .parquet, an Arrow IPC file otherwise. Requires pyarrow.
+
+        :param output_file: The file path of the resultant file
+        """
+        eocr_arrow.write_columns(self.zuva_document, output_file)
+
+    def export_format(self, output_file, output_format = None, granularity = 'page'):
+        """
+        Writes the converted document as hOCR, ALTO XML or text with character offsets (JSON Lines), page by page
+        (see eocr_formats). The character offsets are the same as in the .eocr.
+
+        :param output_file: The file path of the resultant file
+        :param output_format: 'hocr', 'alto' or 'jsonl' (by default, the one of the output file's extension)
+        :param granularity: The records of the jsonl format: 'page', 'line' or 'word'
+        """
+        eocr_formats.write_document(self.zuva_document, output_file, output_format, granularity)
 
     def get_eocr_characters_by_range(self, start, end):
         return [c for c in self.zuva_document.characters[start:end]]
@@ -227,3 +834,105 @@ class HOCRToEOCRConverter(object):
                 return _pg_number
 
         raise Exception(f'Could not find a page with character position {position}')
+
+
+def parse_hocr(hocr):
+    """
+    Parses a .hocr given as a file path, or as its content (bytes).
+
+    :return: The .hocr as BeautifulSoup
+    """
+    return hocr_helper.content_to_bs4(hocr) if isinstance(hocr, bytes) else hocr_helper.to_bs4(hocr)
+
+
+def convert_hocr(hocr, hocr_filename, layers = True, on_error = 'fail', header_lines = False) -> tuple:
+    """
+    Converts a single .hocr on its own (the work done by each worker of HOCRToEOCRConverter.start()). Each worker
+    thread (or process) keeps its own converter, so workers share nothing.
+
+    :param hocr: The file path of the .hocr, or its content (bytes)
+    :param hocr_filename: The name used to refer to the .hocr
+    :param layers: See HOCRToEOCRConverter
+    :param on_error: See HOCRToEOCRConverter
+    :param header_lines: See HOCRToEOCRConverter
+    :return: A tuple of (a list of eocr_buffer.PageBlock, the first one starting at character 0, and a list of the
+             PageFailure of the pages that failed)
+    """
+    converter = getattr(_worker_state, 'converter', None)
+    if converter is None or converter.layers != layers:
+        converter = _worker_state.converter = HOCRToEOCRConverter(layers = layers)
+
+    converter.on_error = on_error
+    converter.header_lines = header_lines
+    converter.failures = []
+
+    return list(converter._convert_file(hocr, hocr_filename, 0)), converter.failures
+
+
+def convert_hocr_shared(hocr, hocr_filename, layers = True, on_error = 'fail', header_lines = False) -> tuple:
+    """
+    Converts a single .hocr on its own, like convert_hocr(), and puts the characters of its pages in shared memory
+    (for worker processes, see eocr_buffer.share_page_blocks()).
+
+    :return: A tuple of (eocr_buffer.SharedPageBlocks, a list of PageFailure)
+    """
+    page_blocks, failures = convert_hocr(hocr, hocr_filename, layers, on_error, header_lines)
+    return eocr_buffer.share_page_blocks(page_blocks), failures
+
+
+def new_empty_page_block(source, offset, hocr_page = None) -> eocr_buffer.PageBlock:
+    """
+    Returns an empty page to put in the place of a page that failed to convert (see on_error): of the size of its
+    hocr "ocr_page" entry if it was parsed, of empty_page_inches otherwise.
+
+    :param offset: The character index of where the page would have started
+    """
+    width, height = round(empty_page_inches[0] * eocr_helper.page_dpi_x), \
+        round(empty_page_inches[1] * eocr_helper.page_dpi_y)
+
+    if hocr_page is not None and hocr_page.get('title'):
+        bbox = hocr_helper.get_boundingbox(hocr_page)
+        width, height = bbox.get('right'), bbox.get('bottom')
+
+    return eocr_buffer.PageBlock(characters = eocr_buffer.CharacterBuffer(),
+                                 page = eocr_helper.new_page(range_start = offset,
+                                                             range_end = offset,
+                                                             width = width,
+                                                             height = height),
+                                 offset = offset,
+                                 source = source,
+                                 structure = eocr_structure.StructureIndex())
+
+
+def is_converted(future) -> bool:
+    """
+    Checks whether a future of a pool of workers finished with a result (rather than an error, or being cancelled).
+    """
+    return future.done() and not future.cancelled() and future.exception() is None
+
+
+def free_shared_results(futures):
+    """
+    Frees the shared memory segments of the finished futures (of convert_hocr_shared() or similar) whose pages are
+    not used.
+    """
+    for future in futures:
+        if is_converted(future):
+            page_blocks = future.result()[0]
+            if isinstance(page_blocks, eocr_buffer.SharedPageBlocks):
+                page_blocks.free()
+
+
+def terminate_pool(pool):
+    """
+    Shuts a pool of workers down without waiting for them, and terminates its worker processes (if any).
+    """
+    # Python 3.14 terminates a process pool's workers; before, they are terminated one by one
+    terminate_workers = getattr(pool, 'terminate_workers', None)
+    if terminate_workers is not None:
+        terminate_workers()
+    else:
+        for process in list((getattr(pool, '_processes', None) or {}).values()):
+            process.terminate()
+
+    pool.shutdown(wait = False, cancel_futures = True)
@@ -0,0 +1,342 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Benchmarks of the conversion stages, run against the bundled sample by default:
+#
+#   python3 benchmark.py convert [--hocr-folder out/CANADAGOOS-F1Securiti-2152017/]
+#   python3 benchmark.py text
+#   python3 benchmark.py memory [--memory-budget 1000000]
+#   python3 benchmark.py soak [--documents 200]
+#   python3 benchmark.py bundle [--documents 200]
+#   python3 benchmark.py poll [--documents 200] [--job-duration 2]
+#   python3 benchmark.py parallel [--workers 4] [--copies 10]
+#   python3 benchmark.py ipc [--workers 4] [--copies 10]
+#   python3 benchmark.py schedule [--workers 4] [--copies 10] [--documents 40] [--shard-bytes 1000000]
+
+
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import asyncio
+import pickle
+import shutil
+import tempfile
+import time
+import tracemalloc
+from os.path import join
+
+import eocr_batch
+import eocr_buffer
+import eocr_bundle
+import eocr_helper
+import hocr_helper
+import zuva_client
+import zuva_mock_server
+from HOCRToEOCRConverter import HOCRToEOCRConverter, convert_hocr, convert_hocr_shared, parallel_modes
+
+sample_hocr_folder = 'out/CANADAGOOS-F1Securiti-2152017/'
+sample_md5 = b'benchmark'
+
+
+def measure(function, repeat = 3) -> float:
+    """
+    Returns the best time (in seconds) of running the function repeat times.
+    """
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def report(name, seconds, count = None, unit = None):
+    rate = f' ({count / seconds:,.0f} {unit}/s)' if count else ''
+    print(f'{name:<40} {seconds * 1000:>10.1f} ms{rate}')
+
+
+def new_converter(hocr_folder, **kwargs) -> HOCRToEOCRConverter:
+    converter = HOCRToEOCRConverter(**kwargs)
+    converter.consoleout = lambda msg: None
+    converter.hocr_folder = hocr_folder
+    converter.set_document_md5(sample_md5)
+    return converter
+
+
+def benchmark_convert(args):
+    def convert():
+        new_converter(args.hocr_folder).start()
+
+    converter = new_converter(args.hocr_folder)
+    converter.start()
+    count = len(converter.zuva_document.characters)
+    report('start()', measure(convert, args.repeat), count, 'characters')
+    report('export()', measure(lambda: converter.export(args.output), args.repeat), count, 'characters')
+
+
+def benchmark_memory(args):
+    for memory_budget in (None, args.memory_budget):
+        converter = new_converter(args.hocr_folder, memory_budget = memory_budget)
+        tracemalloc.start()
+        started = time.perf_counter()
+        converter.start()
+        converter.export(args.output)
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        # The characters are only a part of the memory used: the parsed .hocr of the current file is the rest
+        name = f'memory_budget={memory_budget}'
+        print(f'{name:<40} {elapsed * 1000:>10.1f} ms (peak {peak / 1024 / 1024:,.1f} MB traced)')
+
+
+def benchmark_soak(args):
+    pages = []
+    for hocr_filename in new_converter(args.hocr_folder).get_hocr_files():
+        with open(join(args.hocr_folder, hocr_filename), 'rb') as hocr:
+            pages.append(hocr.read())
+
+    def convert(converter, i):
+        converter.set_document_md5(sample_md5)
+        converter.convert_hocr_content(pages[i % len(pages)])
+        converter.export(args.output)
+
+    def new_converters():
+        for i in range(args.documents):
+            convert(new_converter(None), i)
+
+    def reused_converter():
+        converter = new_converter(None)
+        for i in range(args.documents):
+            converter.reset()
+            convert(converter, i)
+
+    for name, function in (('new converter per document', new_converters),
+                           ('reset() converter per document', reused_converter)):
+        report(name, measure(function, args.repeat), args.documents, 'documents')
+
+        # tracemalloc slows the conversion down several times, so the peak is measured in a separate run
+        tracemalloc.start()
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f'{"":<40} (peak {peak / 1024 / 1024:,.1f} MB traced)')
+
+
+def benchmark_bundle(args):
+    # A small (one page) document, which is what bundles are for
+    converter = new_converter(args.hocr_folder)
+    converter.convert_hocr_file(join(args.hocr_folder, converter.get_hocr_files()[0]))
+    content = eocr_helper.get_eocr_file_content(converter.zuva_document)
+    folder = tempfile.mkdtemp()
+
+    def separate_files():
+        for i in range(args.documents):
+            with open(join(folder, f'document-{i}.eocr'), 'wb') as eocr:
+                eocr.write(content)
+
+    def bundle():
+        with eocr_bundle.EOCRBundleWriter(join(folder, 'documents.eocrb')) as writer:
+            for i in range(args.documents):
+                writer.add(f'document-{i}.eocr', content)
+
+    try:
+        report('one .eocr file per document', measure(separate_files, args.repeat), args.documents, 'documents')
+        report('one bundle', measure(bundle, args.repeat), args.documents, 'documents')
+
+        with eocr_bundle.EOCRBundleReader(join(folder, 'documents.eocrb')) as reader:
+            names = reader.names()
+            report('read every member of the bundle', measure(lambda: [reader.read(name) for name in names],
+                                                              args.repeat), args.documents, 'documents')
+    finally:
+        shutil.rmtree(folder)
+
+
+def benchmark_poll(args):
+    async def run():
+        server = zuva_mock_server.MockZuvaServer(job_duration = args.job_duration, max_concurrent = 64)
+        client = zuva_client.ZuvaClient(await server.start(), max_in_flight = 16)
+        poller = zuva_client.JobPoller(client, initial_interval = args.job_duration / 4,
+                                       max_interval = args.job_duration)
+
+        started = time.perf_counter()
+        file_ids = await asyncio.gather(*(client.create_file(b'eocr') for _ in range(args.documents)))
+        for kind in zuva_client.job_kinds:
+            poller.add_all(await client.create_jobs(kind, list(file_ids)))
+        jobs = await poller.wait()
+        elapsed = time.perf_counter() - started
+
+        await client.close()
+        await server.close()
+
+        report(f'{len(jobs)} jobs of {args.job_duration} s (mean)', elapsed, len(jobs), 'jobs')
+        print(f'{"":<40} {client.requests / len(jobs):.1f} requests per job, {server.connections} connection(s), '
+              f'{server.rejected} request(s) answered 429, {sum(job.error is not None for job in jobs)} error(s)')
+
+    asyncio.run(run())
+
+
+def benchmark_parallel(args):
+    converter = new_converter(args.hocr_folder)
+    hocr_files = [join(args.hocr_folder, f) for f in converter.get_hocr_files()]
+
+    # The sample, and a synthetic large document made of copies of its pages
+    for name, manifest in (('sample', hocr_files), (f'sample x {args.copies}', hocr_files * args.copies)):
+        def convert(**kwargs):
+            converter = new_converter(None)
+            converter.set_hocr_manifest(manifest)
+            converter.start(**kwargs)
+            return converter
+
+        count = len(convert().zuva_document.characters)
+        print(f'{name}: {len(manifest)} .hocr file(s), {count:,} characters, {args.workers} worker(s)')
+        report('start() serial', measure(convert, args.repeat), count, 'characters')
+        for mode in parallel_modes:
+            report(f'start() {mode} pool', measure(lambda: convert(workers = args.workers, mode = mode),
+                                                   args.repeat), count, 'characters')
+
+        converter = convert()
+        report('export() serial', measure(lambda: converter.export(args.output), args.repeat), count, 'characters')
+        report('export() compression threads', measure(lambda: converter.export(args.output, workers = args.workers),
+                                                       args.repeat), count, 'characters')
+
+
+def benchmark_ipc(args):
+    converter = new_converter(args.hocr_folder)
+    hocr_files = [join(args.hocr_folder, f) for f in converter.get_hocr_files()]
+    converted = [convert_hocr(hocr, hocr)[0] for hocr in hocr_files]
+    count = sum(len(block.characters) for blocks in converted for block in blocks)
+    pickled = sum(len(pickle.dumps(blocks, pickle.HIGHEST_PROTOCOL)) for blocks in converted)
+    shared = sum(len(pickle.dumps(eocr_buffer.share_page_blocks(blocks).blocks, pickle.HIGHEST_PROTOCOL))
+                 for blocks in converted)
+
+    # The cost of handing the converted pages from a worker process to its parent, without the conversion itself
+    def pickled_transfer():
+        for blocks in converted:
+            pickle.loads(pickle.dumps(blocks, pickle.HIGHEST_PROTOCOL))
+
+    def shared_transfer():
+        for blocks in converted:
+            pickle.loads(pickle.dumps(eocr_buffer.share_page_blocks(blocks), pickle.HIGHEST_PROTOCOL)).to_page_blocks()
+
+    print(f'{len(hocr_files)} .hocr file(s), {count:,} characters: {pickled / 1024:,.0f} KB pickled, '
+          f'{shared / 1024:,.0f} KB pickled with the characters in shared memory')
+    report('pickled pages', measure(pickled_transfer, args.repeat), count, 'characters')
+    report('shared memory pages', measure(shared_transfer, args.repeat), count, 'characters')
+
+    # The same, end to end through a process pool (conversion included), on a larger document
+    manifest = hocr_files * args.copies
+
+    def process_pool(function):
+        with ProcessPoolExecutor(max_workers = args.workers) as pool:
+            for future in [pool.submit(function, hocr, hocr) for hocr in manifest]:
+                blocks, _ = future.result()
+                if isinstance(blocks, eocr_buffer.SharedPageBlocks):
+                    blocks.to_page_blocks()
+
+    report(f'process pool x {args.copies}, pickled', measure(lambda: process_pool(convert_hocr), args.repeat),
+           count * args.copies, 'characters')
+    report(f'process pool x {args.copies}, shared memory', measure(lambda: process_pool(convert_hocr_shared),
+                                                                   args.repeat), count * args.copies, 'characters')
+
+
+def benchmark_schedule(args):
+    converter = new_converter(args.hocr_folder)
+    hocr_files = [join(args.hocr_folder, f) for f in converter.get_hocr_files()]
+    output_folder = tempfile.mkdtemp()
+
+    # Small documents of 1 to 8 pages, then one large document made of copies of the sample, which a FIFO pool
+    # starts last
+    manifests = [hocr_files[:1 + (i * 5) % 8] for i in range(args.documents)] + [hocr_files * args.copies]
+    documents = [eocr_batch.BatchDocument(f'document-{i}', manifest, sample_md5, join(output_folder, f'{i}.eocr'))
+                 for i, manifest in enumerate(manifests)]
+    print(f'{len(documents)} document(s), from {len(manifests[0])} to {len(manifests[-1])} .hocr file(s), '
+          f'{args.workers} worker(s)')
+
+    try:
+        for name, kwargs in (('fifo', {'order': 'fifo'}),
+                             ('largest first', {'order': 'largest'}),
+                             ('largest first, sharded', {'order': 'largest', 'shard_bytes': args.shard_bytes})):
+            result = eocr_batch.convert_batch(documents, workers = args.workers, **kwargs)
+            print(f'{name:<40} makespan {result.makespan * 1000:>10.1f} ms, p50 {result.percentile(50) * 1000:.1f} '
+                  f'ms, p99 {result.percentile(99) * 1000:.1f} ms ({sum(result.shards.values())} task(s))')
+    finally:
+        shutil.rmtree(output_folder)
+
+
+def _get_page_words(hocr_folder) -> list:
+    converter = new_converter(hocr_folder)
+    pages = []
+    for hocr_filename in converter.get_hocr_files():
+        soup = hocr_helper.to_bs4(join(hocr_folder, hocr_filename))
+        for page in hocr_helper.get_pages(soup):
+            pages.append([word.text for word in hocr_helper.get_words(page)])
+    return pages
+
+
+def benchmark_text(args):
+    pages = _get_page_words(args.hocr_folder)
+    count = sum(len(word) for words in pages for word in words)
+
+    def per_character():
+        for words in pages:
+            units = array(eocr_buffer.unicode_typecode)
+            for word in words:
+                for c in list(word):
+                    units.append(ord(c))
+
+    def per_page():
+        for words in pages:
+            eocr_buffer.encode_utf16(''.join(words))
+
+    report('ord() per character', measure(per_character, args.repeat), count, 'characters')
+    report('utf-16-le per page', measure(per_page, args.repeat), count, 'characters')
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Benchmarks the hOCR to eOCR conversion')
+    parser.add_argument('--hocr-folder', default = sample_hocr_folder)
+    parser.add_argument('--repeat', type = int, default = 3)
+    parser.add_argument('--output', default = 'benchmark.eocr')
+    parser.add_argument('--memory-budget', type = int, default = 1000000)
+    parser.add_argument('--documents', type = int, default = 200)
+    parser.add_argument('--job-duration', type = float, default = 2.0)
+    parser.add_argument('--workers', type = int, default = 4)
+    parser.add_argument('--copies', type = int, default = 10)
+    parser.add_argument('--shard-bytes', type = int, default = 1000000)
+    subparsers = parser.add_subparsers(dest = 'benchmark', required = True)
+    subparsers.add_parser('convert', help = 'Times start() and export()').set_defaults(run = benchmark_convert)
+    subparsers.add_parser('text', help = 'Times the text encoding stage').set_defaults(run = benchmark_text)
+    subparsers.add_parser('memory', help = 'Measures peak memory with and without a memory budget') \
+        .set_defaults(run = benchmark_memory)
+    subparsers.add_parser('soak', help = 'Converts many one-page documents, with new or reused converters') \
+        .set_defaults(run = benchmark_soak)
+    subparsers.add_parser('bundle', help = 'Writes many documents as separate .eocr files or as one bundle') \
+        .set_defaults(run = benchmark_bundle)
+    subparsers.add_parser('poll', help = 'Submits and polls jobs against a local mock Zuva API') \
+        .set_defaults(run = benchmark_poll)
+    subparsers.add_parser('ipc', help = 'Hands converted pages between processes pickled or in shared memory') \
+        .set_defaults(run = benchmark_ipc)
+    subparsers.add_parser('parallel', help = 'Converts and exports serially, with a thread pool and a process pool') \
+        .set_defaults(run = benchmark_parallel)
+    subparsers.add_parser('schedule', help = 'Converts a batch of documents in FIFO order, largest first and sharded') \
+        .set_defaults(run = benchmark_schedule)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
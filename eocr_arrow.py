@@ -0,0 +1,167 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Exports the characters of a converted document as columns (Apache Arrow IPC or Parquet), for analytics that scan
+# columns instead of walking Character messages. Requires pyarrow (pip install pyarrow). Existing .eocr files can
+# be exported too:
+#
+#   python3 eocr_arrow.py <input.eocr> <output.arrow|output.parquet>
+
+
+from array import array
+from bisect import bisect_right
+import argparse
+import sys
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+import eocr_buffer
+import eocr_helper
+
+
+def _require_pyarrow():
+    if pyarrow is None:
+        raise Exception('The columnar export requires pyarrow (pip install pyarrow)')
+
+
+def get_schema():
+    """
+    Returns the Arrow schema of the exported characters: the eOCR Character fields (unicode is a UTF-16 code unit,
+    so characters outside of the BMP are two rows) and the 0-based page number of each character.
+    """
+    _require_pyarrow()
+
+    return pyarrow.schema([('unicode', pyarrow.uint16()),
+                           ('error', pyarrow.uint32()),
+                           ('x1', pyarrow.uint32()),
+                           ('y1', pyarrow.uint32()),
+                           ('x2', pyarrow.uint32()),
+                           ('y2', pyarrow.uint32()),
+                           ('page', pyarrow.uint32())])
+
+
+def get_page_column(pages, start, end) -> array:
+    """
+    Returns the page number of each character between start and end.
+
+    :param pages: The eOCR Pages of the document
+    """
+    page_starts = [page.range.start for page in pages]
+    column = array(eocr_buffer.value_typecode)
+    position = start
+
+    while position < end:
+        page_number = max(0, bisect_right(page_starts, position) - 1)
+        page_end = pages[page_number].range.end if pages else end
+        if page_end <= position:
+            # Characters after the last page are counted on the last page
+            page_end = end
+
+        count = min(page_end, end) - position
+        column.extend(array(eocr_buffer.value_typecode, [page_number]) * count)
+        position += count
+
+    return column
+
+
+def _to_arrow_array(values, arrow_type):
+    if sys.byteorder == 'big':
+        # Arrow buffers are little-endian
+        values = array(values.typecode, values)
+        values.byteswap()
+
+    # The array's memory is used as it is (no copy): the array cannot be resized while the Arrow array exists
+    return pyarrow.Array.from_buffers(arrow_type, len(values), [None, pyarrow.py_buffer(values)])
+
+
+def iter_record_batches(zuva_document):
+    """
+    Yields the characters of a document as Arrow record batches, one per CharacterBuffer.
+
+    :param zuva_document: A HOCRToEOCRConverter's zuva_document, or an eOCR Document
+    """
+    _require_pyarrow()
+
+    schema = get_schema()
+    offset = 0
+
+    for buffer in eocr_buffer.iter_document_buffers(zuva_document):
+        if not len(buffer):
+            continue
+
+        values = [getattr(buffer, name) for name in eocr_buffer.columns]
+        values.append(get_page_column(zuva_document.pages, offset, offset + len(buffer)))
+
+        yield pyarrow.RecordBatch.from_arrays([_to_arrow_array(column, field.type)
+                                               for column, field in zip(values, schema)], schema = schema)
+        offset += len(buffer)
+
+
+def to_table(zuva_document):
+    """
+    Returns the characters of a document as an Arrow Table. The table uses the converter's character arrays
+    without copying them, so the converter cannot convert more pages (or be reset()) until the table is released.
+    """
+    return pyarrow.Table.from_batches(list(iter_record_batches(zuva_document)), schema = get_schema())
+
+
+def write_arrow(zuva_document, output_file):
+    """
+    Writes the characters of a document as an Arrow IPC (Feather v2) file.
+    """
+    _require_pyarrow()
+
+    with pyarrow.ipc.new_file(output_file, get_schema()) as writer:
+        for batch in iter_record_batches(zuva_document):
+            writer.write_batch(batch)
+
+
+def write_parquet(zuva_document, output_file):
+    """
+    Writes the characters of a document as a Parquet file.
+    """
+    _require_pyarrow()
+
+    with pyarrow.parquet.ParquetWriter(output_file, get_schema()) as writer:
+        for batch in iter_record_batches(zuva_document):
+            writer.write_batch(batch)
+
+
+def write_columns(zuva_document, output_file):
+    """
+    Writes the characters of a document as a Parquet file (if the file name ends with .parquet) or an Arrow IPC
+    file (otherwise).
+    """
+    if str(output_file).endswith('.parquet'):
+        write_parquet(zuva_document, output_file)
+    else:
+        write_arrow(zuva_document, output_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Exports the characters of an .eocr as Arrow IPC or Parquet')
+    parser.add_argument('eocr_file')
+    parser.add_argument('output_file', help = 'A .parquet file, or an Arrow IPC file (any other extension)')
+    args = parser.parse_args()
+
+    write_columns(eocr_helper.load_eocr(args.eocr_file), args.output_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,370 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Converts a batch of documents on one pool of workers, scheduled by their estimated cost (the size of their .hocr
+# files). The largest work starts first, and documents larger than shard_bytes are split into shards of .hocr
+# files that are converted on several workers and joined in page order. The shards of all the documents are in one
+# queue, which each idle worker takes the next shard from, so no worker sits idle while another works through a
+# large document.
+#
+#   python3 eocr_batch.py <batch.json> [--workers 4] [--mode process] [--order largest] [--shard-bytes 4000000]
+#                         [--on-error fail] [--page-timeout 60]
+#
+# where batch.json is a list of {"name": ..., "hocr": <folder or manifest of .hocr files>, "md5": <hex>,
+# "output_file": ...}.
+
+
+from concurrent.futures import FIRST_COMPLETED, BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from os.path import basename
+import argparse
+import json
+import math
+import os
+import time
+from datetime import datetime
+
+import eocr_buffer
+import hocr_helper
+from HOCRToEOCRConverter import HOCRToEOCRConverter, PageFailure, convert_hocr, error_policies, \
+    free_shared_results, is_converted, new_empty_page_block, parallel_modes, terminate_pool
+
+# The orders the work of a batch can be started in: the largest first, or in the order of the documents
+schedule_orders = ('largest', 'fifo')
+
+# The estimated size of a .hocr.gz once decompressed, as a multiple of its compressed size
+gzip_ratio = 5
+
+
+def estimate_cost(hocr_file) -> int:
+    """
+    Estimates the cost of converting a .hocr file, as its size in bytes (decompressed).
+    """
+    size = os.path.getsize(hocr_file)
+    return size * gzip_ratio if os.fspath(hocr_file).endswith('.gz') else size
+
+
+def split_shards(hocr_files, costs, shard_bytes) -> list:
+    """
+    Splits the .hocr files of a document into shards of consecutive files, each of at most shard_bytes (or of one
+    file, if that file is larger).
+
+    :param costs: The estimated cost of each file (see estimate_cost())
+    :return: A list of lists of file paths, in page order
+    """
+    shards = [[]]
+    shard_cost = 0
+
+    for hocr_file, cost in zip(hocr_files, costs):
+        if shards[-1] and shard_cost + cost > shard_bytes:
+            shards.append([])
+            shard_cost = 0
+
+        shards[-1].append(hocr_file)
+        shard_cost += cost
+
+    return shards
+
+
+class BatchDocument(object):
+    """
+    A document of a batch.
+
+    :param name: The name of the document, unique in the batch
+    :param hocr_files: The file paths of the document's .hocr files, in page order
+    :param md5: The message digest of the source file
+    :param output_file: The file path of the resultant .eocr
+    """
+    def __init__(self, name, hocr_files, md5, output_file):
+        self.name = name
+        self.hocr_files = list(hocr_files)
+        self.md5 = md5
+        self.output_file = output_file
+        self.costs = [estimate_cost(f) for f in self.hocr_files]
+
+    @property
+    def cost(self) -> int:
+        return sum(self.costs)
+
+    def get_shards(self, shard_bytes = None) -> list:
+        """
+        :return: A list of (cost, list of file paths) of the shards of the document
+        """
+        if not shard_bytes:
+            return [(self.cost, self.hocr_files)]
+
+        shards = split_shards(self.hocr_files, self.costs, shard_bytes)
+        costs = dict(zip(self.hocr_files, self.costs))
+        return [(sum(costs[f] for f in shard), shard) for shard in shards]
+
+
+class BatchReport(object):
+    """
+    The timings of a batch: the time from the start of the batch to each document being written, and the time to
+    write them all (the makespan). Also the pages that failed to convert, by document.
+    """
+    def __init__(self):
+        self.latencies = {}
+        self.shards = {}
+        self.failures = {}
+        self.makespan = 0.0
+
+    def percentile(self, p) -> float:
+        """
+        Returns the p-th percentile (nearest rank) of the document latencies, in seconds.
+        """
+        latencies = sorted(self.latencies.values())
+        if not latencies:
+            return 0.0
+
+        return latencies[max(math.ceil(p / 100 * len(latencies)), 1) - 1]
+
+    def to_dict(self) -> dict:
+        return {'documents': len(self.latencies),
+                'shards': sum(self.shards.values()),
+                'makespan': self.makespan,
+                'p50': self.percentile(50),
+                'p99': self.percentile(99),
+                'latencies': self.latencies,
+                'failures': {name: [failure.to_dict() for failure in failures]
+                             for name, failures in self.failures.items() if failures}}
+
+
+def convert_shard(hocr_files, layers = True, on_error = 'fail', header_lines = False) -> tuple:
+    """
+    Converts consecutive .hocr files of a document (the work done by each worker of convert_batch()).
+
+    :param on_error: See HOCRToEOCRConverter
+    :param header_lines: See HOCRToEOCRConverter
+    :return: A tuple of (a list of eocr_buffer.PageBlock, the first one starting at character 0, and a list of the
+             PageFailure of the pages that failed)
+    """
+    page_blocks = []
+    failures = []
+    offset = 0
+
+    for hocr in hocr_files:
+        blocks, file_failures = convert_hocr(hocr, basename(hocr), layers, on_error, header_lines)
+        failures.extend(file_failures)
+
+        for block in blocks:
+            block.rebase(offset)
+            page_blocks.append(block)
+
+        if page_blocks:
+            offset = page_blocks[-1].end
+
+    return page_blocks, failures
+
+
+def convert_shard_shared(hocr_files, layers = True, on_error = 'fail', header_lines = False) -> tuple:
+    """
+    Converts consecutive .hocr files of a document, like convert_shard(), and puts the characters of their pages in
+    shared memory (see eocr_buffer.share_page_blocks()).
+
+    :return: A tuple of (eocr_buffer.SharedPageBlocks, a list of PageFailure)
+    """
+    page_blocks, failures = convert_shard(hocr_files, layers, on_error, header_lines)
+    return eocr_buffer.share_page_blocks(page_blocks), failures
+
+
+def _export_document(document, shards, layers):
+    """
+    Joins the converted shards of a document, in page order, and writes its .eocr.
+    """
+    converter = HOCRToEOCRConverter(layers = layers)
+    converter.set_document_md5(document.md5)
+
+    for page_blocks in shards:
+        offset = len(converter.zuva_document.characters)
+        for block in page_blocks:
+            block.rebase(offset)
+            converter.add_page_block(block)
+
+    converter.export(document.output_file)
+
+
+def convert_batch(documents, workers = None, mode = 'process', order = 'largest', shard_bytes = None,
+                  layers = True, on_error = 'fail', consoleout = None, header_lines = False,
+                  page_timeout = None) -> BatchReport:
+    """
+    Converts a batch of documents on a pool of workers, and writes each one's .eocr as soon as all its shards are
+    converted.
+
+    :param documents: A list of BatchDocument
+    :param workers: The number of workers (defaults to the number of CPUs)
+    :param mode: 'thread' or 'process' (see HOCRToEOCRConverter.start())
+    :param order: 'largest' to start the largest shards first, or 'fifo' to start them in the order of the documents
+    :param shard_bytes: Optional estimated cost (see estimate_cost()) past which a document is split into shards
+    :param layers: See HOCRToEOCRConverter
+    :param on_error: What to do with a page that fails to convert (see HOCRToEOCRConverter)
+    :param consoleout: Optional function that is given a progress message for each document written
+    :param header_lines: See HOCRToEOCRConverter
+    :param page_timeout: Optional number of seconds after which a shard that is still not converted (while no other
+                         shard was converted) fails with a TimeoutError, like a .hocr file in
+                         HOCRToEOCRConverter.start(). Its .hocr files are handled according to on_error, the pool is
+                         replaced, and the shards queued on it are converted again.
+    :return: A BatchReport
+    """
+    if mode not in parallel_modes:
+        raise Exception(f'Unknown mode {mode!r} (use {" or ".join(parallel_modes)})')
+
+    if order not in schedule_orders:
+        raise Exception(f'Unknown order {order!r} (use {" or ".join(schedule_orders)})')
+
+    report = BatchReport()
+    started = time.perf_counter()
+
+    tasks = []
+    for index, document in enumerate(documents):
+        shards = document.get_shards(shard_bytes)
+        report.shards[document.name] = len(shards)
+        report.failures[document.name] = []
+        tasks.extend((cost, document.cost, index, shard, hocr_files)
+                     for shard, (cost, hocr_files) in enumerate(shards))
+
+    if order == 'largest':
+        tasks.sort(key = lambda task: (-task[0], -task[1]))
+
+    results = [[None] * report.shards[document.name] for document in documents]
+    remaining = [len(shards) for shards in results]
+
+    if mode == 'thread':
+        executor, function = ThreadPoolExecutor, convert_shard
+    else:
+        executor, function = ProcessPoolExecutor, convert_shard_shared
+
+    workers = workers or os.cpu_count() or 1
+    pool = executor(max_workers = workers)
+    # The shards being converted, in the order they were submitted
+    futures = {}
+    # The futures of replaced pools, which may still have handed back pages in shared memory
+    abandoned = []
+
+    def submit(index, shard, hocr_files):
+        futures[pool.submit(function, hocr_files, layers, on_error, header_lines)] = (index, shard, hocr_files)
+
+    def replace_pool():
+        nonlocal pool
+        terminate_pool(pool)
+        pool = executor(max_workers = workers)
+
+        for future, task in list(futures.items()):
+            if not is_converted(future):
+                abandoned.append(future)
+                del futures[future]
+                submit(*task)
+
+    def add_shard(index, shard, page_blocks):
+        results[index][shard] = page_blocks
+        remaining[index] -= 1
+
+        if not remaining[index]:
+            document = documents[index]
+            _export_document(document, results[index], layers)
+            results[index] = None
+            report.latencies[document.name] = time.perf_counter() - started
+
+            if consoleout is not None:
+                consoleout(f'{document.name} written to {document.output_file} '
+                           f'({report.shards[document.name]} shard(s))')
+
+    def fail_shard(exception, index, shard, hocr_files):
+        # Like HOCRToEOCRConverter, each .hocr file of the shard fails as a whole
+        failures = [PageFailure.from_exception(exception, basename(hocr), None, on_error) for hocr in hocr_files]
+        report.failures[documents[index].name].extend(failures)
+
+        if on_error == 'fail':
+            raise exception
+
+        if consoleout is not None:
+            for failure in failures:
+                consoleout(f'{failure} ({"left out" if on_error == "skip" else "replaced by an empty page"})')
+
+        add_shard(index, shard, [] if on_error == 'skip' else [new_empty_page_block(failure.source, 0)
+                                                               for failure in failures])
+
+    for _, _, index, shard, hocr_files in tasks:
+        submit(index, shard, hocr_files)
+
+    try:
+        while futures:
+            done, _ = wait(futures, timeout = page_timeout, return_when = FIRST_COMPLETED)
+
+            if not done:
+                # The shard submitted first is still not converted page_timeout seconds after the last one was
+                stuck = next(iter(futures))
+                task = futures.pop(stuck)
+                abandoned.append(stuck)
+                replace_pool()
+                fail_shard(TimeoutError(f'Not converted within {page_timeout} s'), *task)
+                continue
+
+            for future in [future for future in futures if future in done]:
+                index, shard, hocr_files = futures.pop(future)
+
+                if isinstance(future.exception(), BrokenExecutor):
+                    # The worker process died: the shards queued on the pool are converted again on a new one
+                    replace_pool()
+                    fail_shard(future.exception(), index, shard, hocr_files)
+                    break
+
+                page_blocks, failures = future.result()
+                report.failures[documents[index].name].extend(failures)
+
+                if isinstance(page_blocks, eocr_buffer.SharedPageBlocks):
+                    page_blocks = page_blocks.to_page_blocks()
+
+                add_shard(index, shard, page_blocks)
+    finally:
+        pool.shutdown(cancel_futures = True)
+        # The shards converted after an error are not used
+        free_shared_results(list(futures) + abandoned)
+
+    report.makespan = time.perf_counter() - started
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Converts a batch of documents on a pool of workers')
+    parser.add_argument('batch', help = 'A JSON list of {"name", "hocr", "md5", "output_file"}')
+    parser.add_argument('--workers', type = int, help = 'Number of workers (defaults to the number of CPUs)')
+    parser.add_argument('--mode', choices = parallel_modes, default = 'process')
+    parser.add_argument('--order', choices = schedule_orders, default = 'largest')
+    parser.add_argument('--shard-bytes', type = int,
+                        help = 'Split documents whose .hocr files are larger than this into shards')
+    parser.add_argument('--on-error', choices = error_policies, default = 'fail',
+                        help = 'What to do with a page that fails to convert')
+    parser.add_argument('--page-timeout', type = float,
+                        help = 'Fail a shard that is still not converted after this many seconds')
+    parser.add_argument('--report', help = 'Optional file path of a JSON report of the latencies')
+    args = parser.parse_args()
+
+    with open(args.batch) as batch:
+        documents = [BatchDocument(d['name'], hocr_helper.list_hocr_files(d['hocr']), bytes.fromhex(d['md5']),
+                                   d['output_file'])
+                     for d in json.load(batch)]
+
+    report = convert_batch(documents, workers = args.workers, mode = args.mode, order = args.order,
+                           shard_bytes = args.shard_bytes, on_error = args.on_error, page_timeout = args.page_timeout,
+                           consoleout = lambda msg: print(f'[{datetime.now()}] {msg}'))
+    print(f'{len(documents)} document(s) in {report.makespan:.2f} s (p50 {report.percentile(50):.2f} s, '
+          f'p99 {report.percentile(99):.2f} s)')
+
+    if args.report is not None:
+        with open(args.report, 'w') as report_file:
+            json.dump(report.to_dict(), report_file, indent = 2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,854 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from array import array
+from bisect import bisect_right
+from multiprocessing import resource_tracker, shared_memory
+import sys
+import tempfile
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from recognition_results_pb2 import Document, FontStyle
+import eocr_helper
+import eocr_structure
+
+# The array type codes of the character columns
+unicode_typecode = 'H'
+value_typecode = 'I'
+
+# The names of the character columns, in the order of the Character/BoundingBox fields
+columns = ('unicode', 'error', 'x1', 'y1', 'x2', 'y2')
+
+# The optional Document layers the converter fills, in the order of their fields
+layers = ('font_sizes', 'font_styles', 'headers', 'footers')
+
+# The Character and BoundingBox field tags a serialized character is made of
+_character_tag = 0x12
+_box_tag = 0x1a
+_value_tags = {0x08: ('unicode', 'x1'), 0x10: ('error', 'y1'), 0x18: (None, 'x2'), 0x20: (None, 'y2')}
+
+# The number of values (per field) whose wire encoding is pre-computed
+_encoded_unicode_count = 1 << 16
+_encoded_value_count = 1 << 14
+_encoded_fields = None
+
+
+def encode_varint(value) -> bytes:
+    """
+    Encodes an unsigned integer as a protobuf varint.
+    """
+    encoded = bytearray()
+    while value>0x7f:
+        encoded.append(value & 0x7f | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def encode_field(tag, value) -> bytes:
+    """
+    Encodes a varint field with its tag. Like protobuf (proto3), fields that are 0 are not written.
+    """
+    return bytes([tag]) + encode_varint(value) if value else b''
+
+
+def _get_encoded_fields():
+    """
+    Returns the (lazily built) wire encodings of the Character and BoundingBox fields, indexed by value.
+    """
+    global _encoded_fields
+
+    if _encoded_fields is None:
+        lengths = [encode_varint(n) for n in range(_encoded_value_count)]
+        # Character.unicode/BoundingBox.x1 and Character.error/BoundingBox.y1 have the same tags
+        field_1 = [encode_field(0x08, n) for n in range(_encoded_unicode_count)]
+        field_2 = [encode_field(0x10, n) for n in range(_encoded_value_count)]
+        _encoded_fields = (lengths,
+                           field_1,
+                           field_2,
+                           field_1[:_encoded_value_count],
+                           field_2,
+                           [encode_field(0x18, n) for n in range(_encoded_value_count)],
+                           [encode_field(0x20, n) for n in range(_encoded_value_count)])
+
+    return _encoded_fields
+
+
+def encode_utf16(text) -> array:
+    """
+    Encodes text as UTF-16 code units. Characters outside of the BMP become two code units (a surrogate pair).
+
+    :param text: The text to encode
+    :return: An array of UTF-16 code units
+    """
+    units = array(unicode_typecode)
+    units.frombytes(text.encode('utf-16-le'))
+
+    if sys.byteorder == 'big':
+        units.byteswap()
+
+    return units
+
+
+class CharacterBuffer(object):
+    """
+    eOCR characters stored as columns (one array per Character field) instead of Character messages.
+    """
+    def __init__(self, unicode = None, error = None, x1 = None, y1 = None, x2 = None, y2 = None):
+        self.unicode = unicode if unicode is not None else array(unicode_typecode)
+        self.error = error if error is not None else array(value_typecode)
+        self.x1 = x1 if x1 is not None else array(value_typecode)
+        self.y1 = y1 if y1 is not None else array(value_typecode)
+        self.x2 = x2 if x2 is not None else array(value_typecode)
+        self.y2 = y2 if y2 is not None else array(value_typecode)
+
+    def __len__(self):
+        return len(self.unicode)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        The number of bytes used by the columns.
+        """
+        return sum(len(getattr(self, name)) * getattr(self, name).itemsize for name in columns)
+
+    def clear(self):
+        for name in columns:
+            del getattr(self, name)[:]
+
+    def append(self, unicode, error, x1, y1, x2, y2):
+        self.unicode.append(unicode)
+        self.error.append(error)
+        self.x1.append(x1)
+        self.y1.append(y1)
+        self.x2.append(x2)
+        self.y2.append(y2)
+
+    def extend(self, other):
+        """
+        Appends the characters of another CharacterBuffer.
+        """
+        for name in columns:
+            getattr(self, name).extend(getattr(other, name))
+
+    def append_character(self, character):
+        """
+        Appends an eOCR Character message.
+        """
+        bb = character.bounding_box
+        self.append(character.unicode, character.error, bb.x1, bb.y1, bb.x2, bb.y2)
+
+    def get_character(self, i):
+        """
+        Returns the character at index i as an eOCR Character message.
+        """
+        return eocr_helper.new_utf16_character(unicode = self.unicode[i],
+                                               left_x1 = self.x1[i],
+                                               top_y1 = self.y1[i],
+                                               right_x2 = self.x2[i],
+                                               bottom_y2 = self.y2[i],
+                                               confidence = self.error[i])
+
+    def serialize(self, start = 0, end = None) -> bytes:
+        """
+        Encodes the characters between start and end exactly as they appear in a serialized eOCR Document
+        (i.e. as repeated `characters` fields), without creating Character messages.
+        """
+        end = len(self) if end is None else end
+        lengths, unicode_fields, error_fields, x1_fields, y1_fields, x2_fields, y2_fields = _get_encoded_fields()
+        encoded = []
+        append = encoded.append
+
+        for i in range(start, end):
+            try:
+                box = x1_fields[self.x1[i]] + y1_fields[self.y1[i]] + x2_fields[self.x2[i]] + y2_fields[self.y2[i]]
+                character = unicode_fields[self.unicode[i]] + error_fields[self.error[i]] + \
+                    b'\x1a' + lengths[len(box)] + box
+            except IndexError:
+                # A value too large for the pre-computed encodings
+                box = encode_field(0x08, self.x1[i]) + encode_field(0x10, self.y1[i]) + \
+                    encode_field(0x18, self.x2[i]) + encode_field(0x20, self.y2[i])
+                character = encode_field(0x08, self.unicode[i]) + encode_field(0x10, self.error[i]) + \
+                    b'\x1a' + encode_varint(len(box)) + box
+            append(b'\x12' + lengths[len(character)] + character)
+
+        return b''.join(encoded)
+
+    @classmethod
+    def from_serialized(cls, serialized):
+        """
+        Decodes characters as they appear in a serialized eOCR Document (repeated `characters` fields, see
+        serialize()). With numpy, all the fields are decoded at once, without creating Character messages.
+        """
+        buffer = _decode_characters(serialized) if numpy is not None and serialized else None
+        if buffer is not None:
+            return buffer
+
+        buffer = cls()
+        for character in Document.FromString(serialized).characters:
+            buffer.append_character(character)
+        return buffer
+
+    def slice(self, start = 0, end = None):
+        """
+        Returns a copy of the characters between start and end as a new CharacterBuffer.
+        """
+        return CharacterBuffer(**{name: getattr(self, name)[start:end] for name in columns})
+
+    def to_characters(self, start = 0, end = None) -> list:
+        """
+        Returns the characters between start and end as eOCR Character messages.
+        """
+        end = len(self) if end is None else end
+        return [self.get_character(i) for i in range(start, end)]
+
+
+def _decode_characters(serialized):
+    """
+    Decodes serialized characters with numpy (see CharacterBuffer.from_serialized()). Every byte of a character
+    is part of a varint (a tag, a length or a value), so the varints are decoded all at once, and then read as
+    (tag, value) pairs.
+
+    :return: A CharacterBuffer, or None if the characters have fields or values the columns do not (which the
+             protobuf parser then decodes, or reports)
+    """
+    data = numpy.frombuffer(serialized, dtype = numpy.uint8)
+    ends = numpy.flatnonzero(data < 0x80)
+    if not len(ends) or ends[-1] != len(data) - 1 or len(ends) % 2:
+        return None
+
+    starts = numpy.concatenate(([0], ends[:-1] + 1))
+    sizes = ends - starts + 1
+    if sizes.max() > 5:
+        # Past 32 bits
+        return None
+
+    shifts = (numpy.arange(len(data)) - numpy.repeat(starts, sizes)) * 7
+    varints = numpy.add.reduceat((data & 0x7f).astype(numpy.uint64) << shifts.astype(numpy.uint64), starts)
+    tags, values = varints[0::2], varints[1::2]
+    # The position of what follows each value (the next field, or the content of a length-delimited field)
+    value_ends = ends[1::2] + 1
+
+    is_character = tags == _character_tag
+    is_box = tags == _box_tag
+    if not is_character[0] or not numpy.isin(tags, [_character_tag, _box_tag, *_value_tags]).all():
+        return None
+
+    # Each character (and its box, which is its last field) must end where the next character starts
+    character_pairs = numpy.flatnonzero(is_character)
+    character_ends = numpy.append(starts[0::2][character_pairs[1:]], len(data))
+    character_ids = numpy.cumsum(is_character) - 1
+    box_pairs = numpy.flatnonzero(is_box)
+    if (value_ends[character_pairs] + values[character_pairs] != character_ends).any() or \
+            (value_ends[box_pairs] + values[box_pairs] != character_ends[character_ids[box_pairs]]).any():
+        return None
+
+    box_counts = numpy.cumsum(is_box)
+    in_box = (box_counts > box_counts[character_pairs][character_ids]) & ~is_box
+    buffer = CharacterBuffer()
+
+    for tag, names in _value_tags.items():
+        for name, mask in zip(names, (~in_box, in_box)):
+            pairs = numpy.flatnonzero((tags == tag) & mask)
+            if name is None:
+                if len(pairs):
+                    return None
+                continue
+
+            column = getattr(buffer, name)
+            limit = (1 << (8 * column.itemsize)) - 1
+            ids = character_ids[pairs]
+            if (values[pairs] > limit).any() or (len(ids) > 1 and (numpy.diff(ids) <= 0).any()):
+                # A value too large for the column, or a field that is repeated
+                return None
+
+            decoded = numpy.zeros(len(character_pairs), dtype = numpy.dtype(column.typecode))
+            decoded[ids] = values[pairs]
+            column.frombytes(decoded.tobytes())
+
+    return buffer
+
+
+def _column_property(name):
+    """
+    A property that reads and writes one column of the proxied character.
+    """
+    return property(lambda self: getattr(self._buffer, name)[self._index],
+                    lambda self, value: getattr(self._buffer, name).__setitem__(self._index, value))
+
+
+class PageBlock(object):
+    """
+    A converted page.
+
+    :param characters: The page's CharacterBuffer
+    :param page: The eOCR Page, whose range is the position of the characters in the document
+    :param offset: The character index of where the page starts in the document
+    :param source: The name of the .hocr the page was converted from
+    :param layers: Optional dict of the page's layers (see PageBuilder.build_layers())
+    :param structure: Optional eocr_structure.StructureIndex of the page's words, lines and paragraphs, whose
+                      offsets are relative to the start of the page
+    """
+    def __init__(self, characters, page, offset, source = None, layers = None, structure = None):
+        self.characters = characters
+        self.page = page
+        self.offset = offset
+        self.source = source
+        self.layers = layers if layers is not None else {}
+        self.structure = structure
+
+    @property
+    def end(self) -> int:
+        return self.offset + len(self.characters)
+
+    def rebase(self, shift):
+        """
+        Moves the page (its range, offset and layers) by shift characters, e.g. to place a page that was converted
+        on its own at its position in the document. The structure is relative to the page, so it does not move.
+        """
+        self.offset += shift
+        self.page.range.start += shift
+        self.page.range.end += shift
+
+        for items in self.layers.values():
+            for item in items:
+                item.range.start += shift
+                item.range.end += shift
+
+
+class SharedPageBlocks(object):
+    """
+    Converted pages whose characters are in a shared memory segment, so that a worker process can hand them to its
+    parent without pickling the characters: the parent copies the columns out of the segment (see
+    share_page_blocks()). Only the (small) pages and layers are pickled.
+
+    :param name: The name of the shared memory segment
+    :param count: The number of characters in the segment
+    :param blocks: A list of (eOCR Page, layers, number of characters, source, structure), one per page
+    """
+    def __init__(self, name, count, blocks):
+        self.name = name
+        self.count = count
+        self.blocks = blocks
+
+    def to_page_blocks(self) -> list:
+        """
+        Copies the pages out of the shared memory segment, and frees the segment.
+
+        :return: A list of PageBlock, the first one starting at character 0
+        """
+        segment = shared_memory.SharedMemory(name = self.name)
+        page_blocks = []
+
+        try:
+            offset = 0
+            for page, layers, length, source, structure in self.blocks:
+                characters = CharacterBuffer()
+                position = 0
+
+                for name in columns:
+                    column = getattr(characters, name)
+                    start = position + offset * column.itemsize
+                    column.frombytes(segment.buf[start:start + length * column.itemsize])
+                    position += self.count * column.itemsize
+
+                page_blocks.append(PageBlock(characters, page, offset, source, layers, structure))
+                offset += length
+        finally:
+            segment.close()
+            segment.unlink()
+
+        return page_blocks
+
+    def free(self):
+        """
+        Frees the shared memory segment without copying the pages out of it (for pages that are not used).
+        """
+        try:
+            segment = shared_memory.SharedMemory(name = self.name)
+        except FileNotFoundError:
+            return
+
+        segment.close()
+        segment.unlink()
+
+
+def share_page_blocks(page_blocks) -> SharedPageBlocks:
+    """
+    Copies the characters of converted pages into a new shared memory segment, one column after the other (the
+    layout of a CharacterSpill chunk). The segment is freed by SharedPageBlocks.to_page_blocks() (or free()).
+
+    :param page_blocks: A list of PageBlock
+    """
+    count = sum(len(block.characters) for block in page_blocks)
+    size = sum(count * array(typecode).itemsize
+               for typecode in [unicode_typecode] + [value_typecode] * (len(columns) - 1))
+    segment = shared_memory.SharedMemory(create = True, size = max(size, 1))
+
+    # The segment is freed by the process that reads it: the resource tracker of this (worker) process must not
+    # free it when the worker exits
+    resource_tracker.unregister(segment._name, 'shared_memory')
+
+    try:
+        position = 0
+        for name in columns:
+            for block in page_blocks:
+                column = memoryview(getattr(block.characters, name)).cast('B')
+                segment.buf[position:position + len(column)] = column
+                position += len(column)
+    finally:
+        segment.close()
+
+    return SharedPageBlocks(segment.name, count, [(block.page, block.layers, len(block.characters), block.source,
+                                                   block.structure) for block in page_blocks])
+
+
+class BoundingBoxProxy(object):
+    """
+    A BoundingBox-like view of one character's box in a CharacterBuffer.
+    """
+    __slots__ = ('_buffer', '_index')
+
+    def __init__(self, buffer, index):
+        self._buffer = buffer
+        self._index = index
+
+    x1 = _column_property('x1')
+    y1 = _column_property('y1')
+    x2 = _column_property('x2')
+    y2 = _column_property('y2')
+
+    def __repr__(self):
+        return f'BoundingBox(x1={self.x1}, y1={self.y1}, x2={self.x2}, y2={self.y2})'
+
+
+class CharacterProxy(object):
+    """
+    A Character-like view of one character in a CharacterBuffer. It is created on demand and holds no copy of
+    the character, so reading (or setting) its fields reads (or sets) the buffer's columns.
+    """
+    __slots__ = ('_buffer', '_index')
+
+    def __init__(self, buffer, index):
+        self._buffer = buffer
+        self._index = index
+
+    unicode = _column_property('unicode')
+    error = _column_property('error')
+
+    @property
+    def bounding_box(self) -> BoundingBoxProxy:
+        return BoundingBoxProxy(self._buffer, self._index)
+
+    def to_character(self):
+        """
+        Returns a copy of the character as an eOCR Character message.
+        """
+        return self._buffer.get_character(self._index)
+
+    def __eq__(self, other):
+        if isinstance(other, CharacterProxy):
+            other = other.to_character()
+        return self.to_character() == other
+
+    def __repr__(self):
+        return f'Character(unicode={self.unicode}, error={self.error}, bounding_box={self.bounding_box!r})'
+
+
+class CharacterSpill(object):
+    """
+    Characters that were moved out of memory into a temporary file. Each spilled CharacterBuffer is written as
+    one chunk: its columns' raw bytes, one column after the other.
+
+    :param directory: Optional folder of the temporary file
+    """
+    def __init__(self, directory = None):
+        self.file = tempfile.TemporaryFile(dir = directory)
+        self.chunks = []
+        self._chunk_starts = []
+        self._size = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, buffer):
+        """
+        Writes the characters of a CharacterBuffer at the end of the file.
+        """
+        self.file.seek(self._size)
+        for name in columns:
+            self.file.write(getattr(buffer, name).tobytes())
+
+        self.chunks.append((self._size, self._count, len(buffer)))
+        self._chunk_starts.append(self._count)
+        self._size = self.file.tell()
+        self._count += len(buffer)
+
+    def _read_chunk(self, chunk, start, end) -> CharacterBuffer:
+        offset, chunk_start, count = chunk
+        buffer = CharacterBuffer()
+
+        for name in columns:
+            column = getattr(buffer, name)
+            self.file.seek(offset + (start - chunk_start) * column.itemsize)
+            column.frombytes(self.file.read((end - start) * column.itemsize))
+            offset += count * column.itemsize
+
+        return buffer
+
+    def read(self, start, end) -> CharacterBuffer:
+        """
+        Reads the characters between start and end back into memory.
+        """
+        buffer = CharacterBuffer()
+        i = bisect_right(self._chunk_starts, start) - 1
+
+        while start<end:
+            chunk = self.chunks[i]
+            chunk_end = min(end, chunk[1] + chunk[2])
+            buffer.extend(self._read_chunk(chunk, start, chunk_end))
+            start = chunk_end
+            i += 1
+
+        return buffer
+
+    def iter_chunks(self):
+        """
+        Yields the spilled characters, one CharacterBuffer per chunk.
+        """
+        for chunk in self.chunks:
+            yield self._read_chunk(chunk, chunk[1], chunk[1] + chunk[2])
+
+    def close(self):
+        self.file.close()
+
+
+class CharacterSequence(object):
+    """
+    The `characters` of a DocumentView. Indexing returns a CharacterProxy, slicing a list of them.
+
+    The characters are kept in `buffer`, unless they were moved to disk with spill(). Spilled characters are read
+    back when they are accessed; changes to their proxies are not written back to disk.
+    """
+    def __init__(self, buffer, spill_directory = None):
+        self.buffer = buffer
+        self.spill_directory = spill_directory
+        self.spilled = None
+
+    def __len__(self):
+        return self.spilled_count + len(self.buffer)
+
+    @property
+    def spilled_count(self) -> int:
+        return len(self.spilled) if self.spilled is not None else 0
+
+    def spill(self):
+        """
+        Moves the characters that are in memory to the temporary file.
+        """
+        if self.spilled is None:
+            self.spilled = CharacterSpill(self.spill_directory)
+
+        self.spilled.append(self.buffer)
+        self.buffer = CharacterBuffer()
+
+    def _proxies(self, start, end) -> list:
+        spilled_count = self.spilled_count
+        proxies = []
+
+        if start<spilled_count:
+            spilled = self.spilled.read(start, min(end, spilled_count))
+            proxies.extend(CharacterProxy(spilled, i) for i in range(len(spilled)))
+
+        proxies.extend(CharacterProxy(self.buffer, i - spilled_count)
+                       for i in range(max(start, spilled_count), end))
+        return proxies
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, end, step = key.indices(len(self))
+            if step == 1:
+                return self._proxies(start, end)
+            return [self[i] for i in range(start, end, step)]
+
+        if key<0:
+            key += len(self)
+        if not 0<=key<len(self):
+            raise IndexError('character index out of range')
+
+        return self._proxies(key, key + 1)[0]
+
+    def __iter__(self):
+        for buffer in self.iter_buffers():
+            yield from (CharacterProxy(buffer, i) for i in range(len(buffer)))
+
+    def iter_buffers(self):
+        """
+        Yields all the characters as CharacterBuffers: one per spilled chunk, then the ones in memory.
+        """
+        if self.spilled is not None:
+            yield from self.spilled.iter_chunks()
+
+        yield self.buffer
+
+    def clear(self):
+        """
+        Removes all the characters (and the temporary file of spilled characters).
+        """
+        if self.spilled is not None:
+            self.spilled.close()
+            self.spilled = None
+
+        self.buffer.clear()
+
+    def append(self, character):
+        self.buffer.append_character(character)
+
+    def extend(self, characters):
+        """
+        Appends eOCR Characters (or Character proxies), or all the characters of a CharacterBuffer.
+        """
+        if isinstance(characters, CharacterBuffer):
+            self.buffer.extend(characters)
+            return
+
+        for character in characters:
+            self.buffer.append_character(character)
+
+
+class DocumentView(object):
+    """
+    Document-like storage of a converted document. The characters are kept in a CharacterBuffer; the protobuf
+    Document is only built when it is asked for (to_document(), or any Document attribute that the view does not
+    have itself, which is read from a snapshot of the Document).
+
+    :param version: The version of the protobuf schema used
+    :param spill_directory: Optional folder of the temporary file that characters are spilled to
+    """
+    def __init__(self, version: int = eocr_helper.proto_version, spill_directory = None):
+        self.version = version
+        self.md5 = b''
+        self.characters = CharacterSequence(CharacterBuffer(), spill_directory)
+        self.pages = []
+        self.font_sizes = []
+        self.font_styles = []
+        self.headers = []
+        self.footers = []
+        self.structure = eocr_structure.StructureIndex()
+
+    def clear(self):
+        """
+        Empties the document, so that it can be reused for another one.
+        """
+        self.md5 = b''
+        self.characters.clear()
+        del self.pages[:]
+        for name in layers:
+            del getattr(self, name)[:]
+        self.structure.clear()
+
+    def serialize_without_characters(self) -> bytes:
+        """
+        Serializes everything that comes after the characters in a serialized Document (pages, layers, md5).
+        """
+        document = Document(md5 = self.md5)
+        document.pages.extend(self.pages)
+        for name in layers:
+            getattr(document, name).extend(getattr(self, name))
+        return document.SerializeToString()
+
+    def SerializeToString(self) -> bytes:
+        """
+        Serializes the document (the same bytes as the equivalent Document.SerializeToString()).
+        """
+        return Document(version = self.version).SerializeToString() + \
+            b''.join(buffer.serialize() for buffer in self.characters.iter_buffers()) + \
+            self.serialize_without_characters()
+
+    def to_document(self) -> Document:
+        """
+        Builds the protobuf Document.
+        """
+        return Document.FromString(self.SerializeToString())
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.to_document(), name)
+
+
+def iter_document_buffers(zuva_document, batch_size: int = 1 << 20):
+    """
+    Yields the characters of a document as CharacterBuffers: the DocumentView's own buffers (see
+    CharacterSequence.iter_buffers()), or buffers of batch_size characters built from an eOCR Document.
+    """
+    characters = zuva_document.characters
+
+    if isinstance(characters, CharacterSequence):
+        yield from characters.iter_buffers()
+        return
+
+    for start in range(0, len(characters), batch_size):
+        buffer = CharacterBuffer()
+        for character in characters[start:start + batch_size]:
+            buffer.append_character(character)
+        yield buffer
+
+
+def iter_page_buffers(zuva_document):
+    """
+    Yields the characters of a document page by page, with only the current page (and the CharacterBuffer it is
+    read from) in memory.
+
+    :param zuva_document: A HOCRToEOCRConverter's zuva_document, or an eOCR Document
+    :return: Yields a tuple of (the eOCR Page, the page's CharacterBuffer) for each page
+    """
+    pages = iter(zuva_document.pages)
+    page = next(pages, None)
+    current = CharacterBuffer()
+    offset = 0
+
+    for buffer in iter_document_buffers(zuva_document):
+        position = 0
+
+        while page is not None:
+            take = max(0, min(page.range.end - offset - len(current), len(buffer) - position))
+            current.extend(buffer.slice(position, position + take))
+            position += take
+
+            if offset + len(current) < page.range.end:
+                break
+
+            yield page, current
+            offset += len(current)
+            current = CharacterBuffer()
+            page = next(pages, None)
+
+        offset += len(buffer) - position
+
+    while page is not None:
+        # Pages without characters after the last buffer
+        yield page, current
+        current = CharacterBuffer()
+        page = next(pages, None)
+
+
+class RangeLayer(object):
+    """
+    The ranges of one layer of a page (e.g. its font sizes). A range that follows the previous one and has the same
+    value is merged into it, together with the spaces between them, so that there is one range per run of values.
+    """
+    def __init__(self):
+        self.ranges = []
+        self._open = False
+
+    def add(self, start, end, value = True):
+        """
+        :param start: The character position (in the page) of the first character
+        :param end: The character position after the last character
+        :param value: The layer's value for the characters, or None if the layer does not apply to them
+        """
+        if value is None:
+            self._open = False
+        elif self._open and self.ranges[-1][2] == value:
+            self.ranges[-1][1] = end
+        else:
+            self.ranges.append([start, end, value])
+            self._open = True
+
+
+class PageBuilder(object):
+    """
+    Collects the words of a page, then encodes the text of the whole page at once.
+    The geometry is kept per UTF-16 code unit: both halves of a surrogate pair get the box of their character.
+    The optional layers (font sizes, styles, headers and footers) are collected as RangeLayers, and the words, lines
+    and paragraphs in a StructureIndex.
+    """
+    def __init__(self):
+        self.text = []
+        self.characters = CharacterBuffer()
+        self.structure = eocr_structure.StructureIndex()
+        self.font_sizes = RangeLayer()
+        self.bold = RangeLayer()
+        self.italic = RangeLayer()
+        self.headers = RangeLayer()
+        self.footers = RangeLayer()
+
+    @property
+    def position(self) -> int:
+        """
+        The number of characters (UTF-16 code units) added so far.
+        """
+        return len(self.characters.x1)
+
+    def add_word(self, text, confidence, lefts, top, rights, bottom):
+        """
+        Adds a word (or a space) to the page.
+
+        :param text: The text of the word
+        :param confidence: The eOCR error value of the word
+        :param lefts: The x1 pixel location of each character of the text
+        :param top: The y1 pixel location of the word
+        :param rights: The x2 pixel location of each character of the text
+        :param bottom: The y2 pixel location of the word
+        """
+        if text and max(text)>'\uffff':
+            widths = [2 if c>'\uffff' else 1 for c in text]
+            lefts = [left for left, width in zip(lefts, widths) for _ in range(width)]
+            rights = [right for right, width in zip(rights, widths) for _ in range(width)]
+
+        count = len(lefts)
+        self.text.append(text)
+        self.characters.error.extend([confidence] * count)
+        self.characters.x1.extend(lefts)
+        self.characters.y1.extend([top] * count)
+        self.characters.x2.extend(rights)
+        self.characters.y2.extend([bottom] * count)
+
+    def build(self) -> CharacterBuffer:
+        """
+        Encodes the page's text and returns the page's characters.
+        """
+        self.characters.unicode = encode_utf16(''.join(self.text))
+
+        if len(self.characters.unicode) != len(self.characters.x1):
+            raise Exception('The page text does not match its character boxes')
+
+        return self.characters
+
+    def build_layers(self, offset) -> dict:
+        """
+        Returns the page's layers as eOCR messages, by Document field (only the layers that have ranges).
+
+        :param offset: The character index (in the document) of where the page starts
+        """
+        built = {'font_sizes': [eocr_helper.new_font_size(start + offset, end + offset, size)
+                                for start, end, size in self.font_sizes.ranges],
+                 'font_styles': sorted([eocr_helper.new_font_style(start + offset, end + offset, FontStyle.BOLD)
+                                        for start, end, _ in self.bold.ranges] +
+                                       [eocr_helper.new_font_style(start + offset, end + offset, FontStyle.ITALIC)
+                                        for start, end, _ in self.italic.ranges],
+                                       key = lambda style:(style.range.start, style.style)),
+                 'headers': [eocr_helper.new_header(start + offset, end + offset)
+                             for start, end, _ in self.headers.ranges],
+                 'footers': [eocr_helper.new_footer(start + offset, end + offset)
+                             for start, end, _ in self.footers.ranges]}
+
+        return {name: built[name] for name in layers if built[name]}
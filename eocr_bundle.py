@@ -0,0 +1,303 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# An eOCR bundle holds many .eocr files in one container file, so that bulk conversions do not write (and object
+# storage does not have to keep) tens of thousands of small files. The layout is:
+#
+#   bundle_header
+#   the .eocr content of each member, back to back (each byte-identical to the standalone .eocr)
+#   the index: for each member, its offset, length and name
+#   the trailer: the offset of the index, the number of members and trailer_magic
+#
+# The trailer is at a fixed place (the end of the file), so a member is found without scanning the container.
+#
+# Appending to a bundle writes the new members, then the whole index and a new trailer, after the existing trailer:
+# nothing is overwritten, and the new trailer is written last. If the writer is not closed (e.g. the process crashes),
+# the bundle does not end with a trailer, and the last complete one before its end is used instead: the bundle reads
+# as it was before the append.
+
+
+import os
+import struct
+
+import eocr_helper
+
+# The header of an eOCR bundle file
+bundle_header = b'eocrb 1\n'
+
+# The last bytes of an eOCR bundle file
+trailer_magic = b'eocrbend'
+
+# The size of the chunks members are streamed in
+read_size = 64 * 1024
+
+_member_struct = struct.Struct('<QQI')
+_trailer_struct = struct.Struct('<QQ8s')
+
+
+class BundleMember(object):
+    """
+    :param name: The name of the member
+    :param offset: The position of the member's .eocr content in the bundle file
+    :param length: The length of the member's .eocr content
+    """
+    def __init__(self, name, offset, length):
+        self.name = name
+        self.offset = offset
+        self.length = length
+
+
+def _read_members(bundle, trailer_position):
+    """
+    Reads the index of the trailer at trailer_position of an open bundle file.
+
+    :return: A list of BundleMember, in the order they were added, or None if there is no complete trailer and
+             index there
+    """
+    bundle.seek(trailer_position)
+    index_offset, count, magic = _trailer_struct.unpack(bundle.read(_trailer_struct.size))
+    if magic != trailer_magic or not len(bundle_header) <= index_offset <= trailer_position:
+        return None
+
+    bundle.seek(index_offset)
+    index = bundle.read(trailer_position - index_offset)
+
+    members = []
+    position = 0
+    try:
+        for _ in range(count):
+            offset, length, name_length = _member_struct.unpack_from(index, position)
+            position += _member_struct.size
+            name = index[position:position + name_length].decode('utf-8')
+            position += name_length
+
+            if offset < len(bundle_header) or offset + length > index_offset:
+                return None
+            members.append(BundleMember(name, offset, length))
+    except (struct.error, UnicodeDecodeError):
+        return None
+
+    return members if position == len(index) else None
+
+
+def _iter_trailer_positions(bundle, size):
+    """
+    Yields the positions of the possible trailers of an open bundle file (those that end with trailer_magic), from
+    its end backwards.
+    """
+    end = size
+    while end > len(bundle_header):
+        start = max(len(bundle_header), end - read_size)
+        bundle.seek(start)
+        # The chunks overlap, so that a trailer_magic across two chunks is found
+        chunk = bundle.read(min(size, end + len(trailer_magic) - 1) - start)
+
+        found = chunk.rfind(trailer_magic)
+        while found >= 0:
+            if start + found < end:
+                yield start + found + len(trailer_magic) - _trailer_struct.size
+            found = chunk.rfind(trailer_magic, 0, found + len(trailer_magic) - 1)
+
+        end = start
+
+
+def _read_index(bundle) -> tuple:
+    """
+    Reads the index of an open bundle file. When the bundle does not end with a trailer (an append was interrupted),
+    the last complete trailer before its end is used.
+
+    :return: A tuple of (list of BundleMember in the order they were added, the position after the trailer)
+    """
+    bundle.seek(0, os.SEEK_END)
+    size = bundle.tell()
+
+    bundle.seek(0)
+    if bundle.read(len(bundle_header)) != bundle_header or size < len(bundle_header) + _trailer_struct.size:
+        raise Exception(f'{bundle.name} is not an eOCR bundle')
+
+    # Usually the trailer at the end, without scanning for the others
+    members = _read_members(bundle, size - _trailer_struct.size)
+    if members is not None:
+        return members, size
+
+    for trailer_position in _iter_trailer_positions(bundle, size):
+        if len(bundle_header) <= trailer_position < size - _trailer_struct.size:
+            members = _read_members(bundle, trailer_position)
+            if members is not None:
+                return members, trailer_position + _trailer_struct.size
+
+    raise Exception(f'{bundle.name} is not a complete eOCR bundle (it was not closed)')
+
+
+class EOCRBundleWriter(object):
+    """
+    Writes .eocr files into an eOCR bundle. The index is written by close(): until then, a new bundle cannot be read,
+    and a bundle that is appended to reads as it was before.
+
+    :param bundle_file: The file path of the bundle
+    :param append: Whether to add members to an existing bundle (instead of overwriting it)
+    """
+    def __init__(self, bundle_file, append = False):
+        if append and os.path.exists(bundle_file):
+            self._output = open(bundle_file, 'r+b')
+            self.members, end = _read_index(self._output)
+
+            # The new members are written after the current trailer, which stays valid until close() writes the
+            # new one. What an interrupted append wrote after it is dropped.
+            self._output.seek(end)
+            self._output.truncate()
+        else:
+            self._output = open(bundle_file, 'wb')
+            self._output.write(bundle_header)
+            self.members = []
+
+        self._names = {member.name for member in self.members}
+
+    def add(self, name, eocr_content):
+        """
+        Adds a member.
+
+        :param name: The name of the member (e.g. the name of the standalone .eocr file)
+        :param eocr_content: The byte-content of the .eocr (see eocr_helper.get_eocr_file_content())
+        """
+        if name in self._names:
+            raise Exception(f'The bundle already contains {name}')
+
+        self.members.append(BundleMember(name, self._output.tell(), len(eocr_content)))
+        self._names.add(name)
+        self._output.write(eocr_content)
+
+    def add_file(self, eocr_file, name = None):
+        """
+        Adds a standalone .eocr file.
+
+        :param eocr_file: The file path of the .eocr
+        :param name: The name of the member (defaults to the file name)
+        """
+        with open(eocr_file, 'rb') as eocr:
+            self.add(name or os.path.basename(eocr_file), eocr.read())
+
+    def add_document(self, name, zuva_document):
+        """
+        Adds a converted document (an eOCR Document, or a HOCRToEOCRConverter's zuva_document).
+        """
+        self.add(name, eocr_helper.get_eocr_file_content(zuva_document))
+
+    def close(self):
+        if self._output.closed:
+            return
+
+        index_offset = self._output.tell()
+        index = []
+        for member in self.members:
+            name = member.name.encode('utf-8')
+            index.append(_member_struct.pack(member.offset, member.length, len(name)))
+            index.append(name)
+
+        self._output.write(b''.join(index))
+
+        # The members and the index are on disk before the trailer that points to them
+        self._output.flush()
+        os.fsync(self._output.fileno())
+        self._output.write(_trailer_struct.pack(index_offset, len(self.members), trailer_magic))
+        self._output.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class EOCRBundleReader(object):
+    """
+    Reads members out of an eOCR bundle. Only the index and the members that are asked for are read.
+
+    :param bundle_file: The file path of the bundle
+    """
+    def __init__(self, bundle_file):
+        self.bundle = open(bundle_file, 'rb')
+
+        try:
+            self.members = {member.name: member for member in _read_index(self.bundle)[0]}
+        except Exception:
+            self.bundle.close()
+            raise
+
+    def close(self):
+        self.bundle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.members)
+
+    def __contains__(self, name):
+        return name in self.members
+
+    def names(self) -> list:
+        """
+        Returns the names of the members, in the order they were added.
+        """
+        return list(self.members)
+
+    def _get_member(self, name) -> BundleMember:
+        if name not in self.members:
+            raise Exception(f'The bundle does not contain {name}')
+
+        return self.members[name]
+
+    def read(self, name) -> bytes:
+        """
+        Returns the .eocr content of a member (byte-identical to the standalone .eocr).
+        """
+        member = self._get_member(name)
+        self.bundle.seek(member.offset)
+        return self.bundle.read(member.length)
+
+    def iter_chunks(self, name, chunk_size: int = read_size):
+        """
+        Streams the .eocr content of a member.
+
+        :return: Yields the content in chunks of (at most) chunk_size bytes
+        """
+        member = self._get_member(name)
+        position = member.offset
+        end = member.offset + member.length
+
+        while position < end:
+            self.bundle.seek(position)
+            chunk = self.bundle.read(min(chunk_size, end - position))
+            if not chunk:
+                raise Exception(f'The bundle ends inside {name}')
+            position += len(chunk)
+            yield chunk
+
+    def extract(self, name, output_file):
+        """
+        Writes a member as a standalone .eocr file.
+        """
+        with open(output_file, 'wb') as output:
+            for chunk in self.iter_chunks(name):
+                output.write(chunk)
+
+    def read_document_bytes(self, name) -> bytes:
+        """
+        Returns the serialized eOCR Document of a member (see eocr_helper.get_eocr_document_bytes()).
+        """
+        return eocr_helper.get_eocr_document_bytes(self.read(name))
@@ -0,0 +1,447 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Aligns the characters of two versions of a document (e.g. before and after re-OCR), so that character offsets
+# (and spans) stored against the old version can be translated to the new one:
+#
+#   python3 eocr_diff.py <old.eocr> <new.eocr> [--output offsets.eocrmap]
+#
+# The alignment is done in levels, each only on what the previous one did not match: pages that are identical (and
+# unique) in both versions anchor the alignment (as in patience diff), the pages between anchors are paired by the
+# words they have in common, the words of paired pages are diffed (difflib), and finally the characters of the
+# words that differ (Myers' diff).
+
+
+from array import array
+from bisect import bisect_right
+from difflib import SequenceMatcher
+import argparse
+import struct
+
+import eocr_buffer
+import eocr_helper
+
+# The header of an offset map file
+map_header = b'eocrmap 1\n'
+
+# The largest number of edits the character-level diff looks for before giving up on a region (which is then left
+# unmatched)
+max_edits = 256
+
+# The number of pages, beyond the number of pages added or removed, that a page can move when pairing pages
+page_slack = 2
+
+# The widest range of page moves that is searched when pairing pages (past it, pages are paired by position)
+max_page_band = 64
+
+# The fraction of words two pages must have in common for them to be paired
+min_page_similarity = 0.3
+
+# The UTF-16 code unit that separates words
+_space = 0x20
+
+_count_struct = struct.Struct('<Q')
+
+
+class OffsetMap(object):
+    """
+    The characters two versions of a document have in common, as blocks of consecutive characters: old_starts[i]
+    to old_starts[i] + lengths[i] in the old version are new_starts[i] to new_starts[i] + lengths[i] in the new one.
+    The blocks are sorted, and do not overlap.
+    """
+    def __init__(self, old_starts = None, new_starts = None, lengths = None):
+        self.old_starts = old_starts if old_starts is not None else array('Q')
+        self.new_starts = new_starts if new_starts is not None else array('Q')
+        self.lengths = lengths if lengths is not None else array('Q')
+
+    def __len__(self):
+        return len(self.lengths)
+
+    @property
+    def matched(self) -> int:
+        """
+        The number of characters the two versions have in common.
+        """
+        return sum(self.lengths)
+
+    def add(self, old_start, new_start, length):
+        """
+        Adds a block after the last one (merging it into the last one if they are consecutive).
+        """
+        if not length:
+            return
+
+        last = len(self.lengths) - 1
+        if last >= 0 and self.old_starts[last] + self.lengths[last] == old_start \
+                and self.new_starts[last] + self.lengths[last] == new_start:
+            self.lengths[last] += length
+            return
+
+        self.old_starts.append(old_start)
+        self.new_starts.append(new_start)
+        self.lengths.append(length)
+
+    def _find(self, offset) -> tuple:
+        """
+        :return: A tuple of (the index of the last block that starts at or before the offset, whether the offset is
+                 in that block)
+        """
+        i = bisect_right(self.old_starts, offset) - 1
+        return i, i >= 0 and offset < self.old_starts[i] + self.lengths[i]
+
+    def map_offset(self, offset, bias = 'start'):
+        """
+        Translates a character offset of the old version.
+
+        :param offset: The offset in the old version
+        :param bias: Where an offset of a character that is not in the new version goes: 'start' moves it to the
+                     next common character, 'end' to just after the previous common character
+        :return: The offset in the new version, or None if there is no common character in that direction
+        """
+        i, inside = self._find(offset)
+
+        if inside:
+            return self.new_starts[i] + offset - self.old_starts[i]
+        if bias == 'start':
+            return self.new_starts[i + 1] if i + 1 < len(self.lengths) else None
+        return self.new_starts[i] + self.lengths[i] if i >= 0 else None
+
+    def map_span(self, start, end):
+        """
+        Translates a span (start to end, end excluded) of the old version. Characters of the span that are not in
+        the new version are left out, so the span shrinks to the common characters at its ends.
+
+        :return: A tuple of (start, end) in the new version, or None if none of the span's characters are in it
+        """
+        if end <= start:
+            return None
+
+        new_start = self.map_offset(start, 'start')
+        i, inside = self._find(end - 1)
+        if inside:
+            new_end = self.new_starts[i] + end - self.old_starts[i]
+        else:
+            new_end = self.map_offset(end - 1, 'end')
+
+        if new_start is None or new_end is None or new_end <= new_start:
+            return None
+
+        return new_start, new_end
+
+    def map_spans(self, spans) -> list:
+        """
+        Translates many spans (see map_span()).
+
+        :param spans: An iterable of (start, end)
+        :return: A list of (start, end) or None, in the same order as the spans
+        """
+        return [self.map_span(start, end) for start, end in spans]
+
+    def to_bytes(self) -> bytes:
+        """
+        Returns the offset map in its serialized form (see from_bytes()).
+        """
+        return b''.join([map_header, _count_struct.pack(len(self.lengths)),
+                         self.old_starts.tobytes(), self.new_starts.tobytes(), self.lengths.tobytes()])
+
+    @classmethod
+    def from_bytes(cls, content):
+        if not content.startswith(map_header):
+            raise Exception('The content is not an offset map')
+
+        position = len(map_header)
+        count, = _count_struct.unpack_from(content, position)
+        position += _count_struct.size
+
+        columns = []
+        for _ in range(3):
+            column = array('Q')
+            column.frombytes(content[position:position + count * column.itemsize])
+            position += count * column.itemsize
+            columns.append(column)
+
+        return cls(*columns)
+
+    def write(self, map_file):
+        with open(map_file, 'wb') as output:
+            output.write(self.to_bytes())
+
+    @classmethod
+    def read(cls, map_file):
+        with open(map_file, 'rb') as content:
+            return cls.from_bytes(content.read())
+
+
+def get_text(zuva_document):
+    """
+    Returns the UTF-16 code units of all of a document's characters, and the (start, end) range of each page.
+
+    :param zuva_document: A HOCRToEOCRConverter's zuva_document, or an eOCR Document
+    """
+    units = array(eocr_buffer.unicode_typecode)
+    for buffer in eocr_buffer.iter_document_buffers(zuva_document):
+        units.extend(buffer.unicode)
+
+    return units, [(page.range.start, page.range.end) for page in zuva_document.pages]
+
+
+def _myers_blocks(a, b) -> list:
+    """
+    Returns the common characters of a and b (Myers' O(ND) diff), as (a position, b position, length) blocks, or
+    None if a and b differ by more than max_edits.
+    """
+    n, m = len(a), len(b)
+    v = {1: 0}
+    trace = []
+
+    for d in range(min(n + m, max_edits) + 1):
+        trace.append(dict(v))
+
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                x = v[k + 1]
+            else:
+                x = v[k - 1] + 1
+            y = x - k
+
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[k] = x
+
+            if x >= n and y >= m:
+                return _backtrack(trace, n, m)
+
+    return None
+
+
+def _backtrack(trace, x, y) -> list:
+    blocks = []
+
+    for d in range(len(trace) - 1, 0, -1):
+        v = trace[d]
+        k = x - y
+
+        if k == -d or (k != d and v[k - 1] < v[k + 1]):
+            previous_k = k + 1
+            start_x = v[previous_k]
+        else:
+            previous_k = k - 1
+            start_x = v[previous_k] + 1
+
+        if x > start_x:
+            blocks.append((start_x, start_x - k, x - start_x))
+        x = v[previous_k]
+        y = x - previous_k
+
+    if x > 0:
+        blocks.append((0, 0, x))
+
+    blocks.reverse()
+    return blocks
+
+
+def _split_words(units, start, end) -> tuple:
+    """
+    Splits units[start:end] in words (each with the spaces that follow it).
+
+    :return: A tuple of (the words' start positions, the words as bytes)
+    """
+    starts = []
+    words = []
+    position = start
+
+    while position < end:
+        try:
+            space = units.index(_space, position, end)
+        except ValueError:
+            space = end - 1
+
+        word_end = space + 1
+        while word_end < end and units[word_end] == _space:
+            word_end += 1
+
+        starts.append(position)
+        words.append(units[position:word_end].tobytes())
+        position = word_end
+
+    starts.append(end)
+    return starts, words
+
+
+def _align_words(old_units, old_words, new_units, new_words, offset_map):
+    """
+    Aligns two runs of words (see _split_words()) word by word, and character by character within the words that
+    differ.
+    """
+    old_starts, old_keys = old_words
+    new_starts, new_keys = new_words
+
+    matcher = SequenceMatcher(None, old_keys, new_keys, autojunk = False)
+    for operation, i1, i2, j1, j2 in matcher.get_opcodes():
+        a1, a2, b1, b2 = old_starts[i1], old_starts[i2], new_starts[j1], new_starts[j2]
+
+        if operation == 'equal':
+            offset_map.add(a1, b1, a2 - a1)
+        elif operation == 'replace':
+            blocks = _myers_blocks(old_units[a1:a2], new_units[b1:b2])
+            for i, j, length in blocks or ():
+                offset_map.add(a1 + i, b1 + j, length)
+
+
+def _get_anchors(old_keys, new_keys) -> list:
+    """
+    Returns the pages that are identical, and unique, in both versions (the anchors of patience diff): the longest
+    run of such (old page, new page) pairs that is in the same order in both versions.
+    """
+    old_positions = {}
+    for i, key in enumerate(old_keys):
+        old_positions[key] = None if key in old_positions else i
+    new_positions = {}
+    for j, key in enumerate(new_keys):
+        new_positions[key] = None if key in new_positions else j
+
+    pairs = [(i, new_positions[key]) for key, i in old_positions.items()
+             if i is not None and new_positions.get(key) is not None]
+    pairs.sort()
+
+    # The longest increasing subsequence of the new pages (patience sorting)
+    tails = []
+    tail_pairs = []
+    previous = {}
+    for pair in pairs:
+        position = bisect_right(tails, pair[1])
+        previous[pair] = tail_pairs[position - 1] if position else None
+        if position == len(tails):
+            tails.append(pair[1])
+            tail_pairs.append(pair)
+        else:
+            tails[position] = pair[1]
+            tail_pairs[position] = pair
+
+    anchors = []
+    pair = tail_pairs[-1] if tail_pairs else None
+    while pair is not None:
+        anchors.append(pair)
+        pair = previous[pair]
+
+    anchors.reverse()
+    return anchors
+
+
+def _pair_pages(old_words, new_words) -> list:
+    """
+    Pairs the pages between two anchors: the pairing (in page order, skipping pages that were added or removed)
+    with the most words in common, searched near the diagonal.
+
+    :return: A list of (old page, new page) indexes into old_words and new_words
+    """
+    n, m = len(old_words), len(new_words)
+    if not n or not m:
+        return []
+
+    low, high = min(0, m - n) - page_slack, max(0, m - n) + page_slack
+    if high - low > max_page_band:
+        # Too many pages were added or removed to search: only pair the pages at the same positions
+        return [(i, i) for i in range(min(n, m))]
+
+    old_sets = [set(keys) for _, keys in old_words]
+    new_sets = [set(keys) for _, keys in new_words]
+
+    def similarity(i, j):
+        common = len(old_sets[i] & new_sets[j])
+        return common / (len(old_sets[i]) + len(new_sets[j]) - common or 1)
+
+    # score[(i, j)]: the best total similarity of pairing the first i old pages with the first j new pages
+    score = {(0, 0): (0, None)}
+    for i in range(n + 1):
+        for j in range(max(0, i + low), min(m, i + high) + 1):
+            if i == j == 0:
+                continue
+            options = []
+            if i and j and (i - 1, j - 1) in score:
+                options.append((score[(i - 1, j - 1)][0] + similarity(i - 1, j - 1), (i - 1, j - 1)))
+            if i and (i - 1, j) in score:
+                options.append((score[(i - 1, j)][0], (i - 1, j)))
+            if j and (i, j - 1) in score:
+                options.append((score[(i, j - 1)][0], (i, j - 1)))
+            if options:
+                score[(i, j)] = max(options, key = lambda option:option[0])
+
+    pairs = []
+    cell = (n, m)
+    while cell in score and score[cell][1] is not None:
+        previous = score[cell][1]
+        if previous == (cell[0] - 1, cell[1] - 1) and similarity(*previous) >= min_page_similarity:
+            pairs.append(previous)
+        cell = previous
+
+    pairs.reverse()
+    return pairs
+
+
+def diff_documents(old_document, new_document) -> OffsetMap:
+    """
+    Aligns the characters of two versions of a document.
+
+    :param old_document: The old version (a HOCRToEOCRConverter's zuva_document, or an eOCR Document)
+    :param new_document: The new version
+    :return: The OffsetMap from the old version's character offsets to the new version's
+    """
+    old_units, old_pages = get_text(old_document)
+    new_units, new_pages = get_text(new_document)
+    old_keys = [old_units[start:end].tobytes() for start, end in old_pages]
+    new_keys = [new_units[start:end].tobytes() for start, end in new_pages]
+
+    offset_map = OffsetMap()
+    old_page, new_page = 0, 0
+
+    # Identical pages that are unique in both versions anchor the alignment; the pages between two anchors are
+    # paired by their words and diffed
+    for old_anchor, new_anchor in _get_anchors(old_keys, new_keys) + [(len(old_pages), len(new_pages))]:
+        old_words = [_split_words(old_units, *old_pages[i]) for i in range(old_page, old_anchor)]
+        new_words = [_split_words(new_units, *new_pages[j]) for j in range(new_page, new_anchor)]
+
+        for i, j in _pair_pages(old_words, new_words):
+            if old_keys[old_page + i] == new_keys[new_page + j]:
+                offset_map.add(old_pages[old_page + i][0], new_pages[new_page + j][0], len(old_keys[old_page + i]) // 2)
+            else:
+                _align_words(old_units, old_words[i], new_units, new_words[j], offset_map)
+
+        if old_anchor < len(old_pages):
+            start, end = old_pages[old_anchor]
+            offset_map.add(start, new_pages[new_anchor][0], end - start)
+
+        old_page, new_page = old_anchor + 1, new_anchor + 1
+
+    return offset_map
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Maps the character offsets of an .eocr to those of a new version')
+    parser.add_argument('old_eocr')
+    parser.add_argument('new_eocr')
+    parser.add_argument('--output', help = 'Write the offset map to this file (see OffsetMap.read())')
+    args = parser.parse_args()
+
+    old_document = eocr_helper.load_eocr(args.old_eocr)
+    offset_map = diff_documents(old_document, eocr_helper.load_eocr(args.new_eocr))
+
+    print(f'{offset_map.matched} of {len(old_document.characters)} character(s) mapped in {len(offset_map)} block(s)')
+    if args.output:
+        offset_map.write(args.output)
+
+
+if __name__ == '__main__':
+    main()
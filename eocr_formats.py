@@ -0,0 +1,538 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Writes converted documents (or .eocr files) back out as hOCR, ALTO XML or text with character offsets (JSON
+# Lines), page by page. Every page, paragraph, line and word carries its eOCR character offsets (UTF-16 code units,
+# the same as Page.range), so spans can be exchanged between the formats:
+#
+#   python3 eocr_formats.py <input.eocr> <output.hocr|output.xml|output.jsonl> [--format hocr|alto|jsonl]
+#                           [--structure input.eocrs]
+#
+# The words, lines and paragraphs are those the converter recorded (see eocr_structure.StructureIndex) when they are
+# available; otherwise (e.g. an .eocr without its structure file) they are rebuilt from the spaces between them.
+
+
+from abc import ABC, abstractmethod
+from array import array
+from xml.sax.saxutils import escape, quoteattr
+import argparse
+import json
+import sys
+
+import eocr_buffer
+import eocr_helper
+import eocr_structure
+
+# The output formats, by the file extensions that select them
+format_extensions = {'.hocr': 'hocr', '.html': 'hocr', '.xml': 'alto', '.alto': 'alto', '.jsonl': 'jsonl'}
+
+# The UTF-16 code unit the converter inserts between words, at the end of lines and at the end of paragraphs
+_space = 0x20
+
+_hocr_header = '''<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN"
+    "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" lang="en">
+ <head>
+  <title></title>
+  <meta http-equiv="Content-Type" content="text/html;charset=utf-8"/>
+  <meta name='ocr-system' content='hocr-to-eocr-converter' />
+  <meta name='ocr-capabilities' content='ocr_page ocr_par ocr_line ocrx_word ocrp_wconf'/>
+ </head>
+ <body>
+'''
+
+_hocr_footer = ''' </body>
+</html>
+'''
+
+_alto_header = '''<?xml version="1.0" encoding="UTF-8"?>
+<alto xmlns="http://www.loc.gov/standards/alto/ns-v4#" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+      xsi:schemaLocation="http://www.loc.gov/standards/alto/ns-v4# http://www.loc.gov/alto/v4/alto-4-2.xsd">
+ <Description>
+  <MeasurementUnit>pixel</MeasurementUnit>
+ </Description>
+ <Layout>
+'''
+
+_alto_footer = ''' </Layout>
+</alto>
+'''
+
+
+class Box(object):
+    """
+    A span of characters and its bounding box.
+
+    :param start: The character index (in the document) of where the span starts
+    :param end: The character index of where the span ends (excluded)
+    """
+    def __init__(self, start, end, x1, y1, x2, y2):
+        self.start = start
+        self.end = end
+        self.x1 = x1
+        self.y1 = y1
+        self.x2 = x2
+        self.y2 = y2
+
+    @property
+    def bbox(self) -> list:
+        return [self.x1, self.y1, self.x2, self.y2]
+
+
+class Word(Box):
+    def __init__(self, start, end, x1, y1, x2, y2, text, error):
+        super().__init__(start, end, x1, y1, x2, y2)
+        self.text = text
+        self.error = error
+
+
+class Line(Box):
+    def __init__(self, start, end, x1, y1, x2, y2, words):
+        super().__init__(start, end, x1, y1, x2, y2)
+        self.words = words
+
+
+class Paragraph(Box):
+    def __init__(self, start, end, x1, y1, x2, y2, lines):
+        super().__init__(start, end, x1, y1, x2, y2)
+        self.lines = lines
+
+
+def decode_utf16(units) -> str:
+    """
+    Decodes UTF-16 code units (unpaired surrogates become U+FFFD).
+    """
+    if sys.byteorder == 'big':
+        units = array(units.typecode, units)
+        units.byteswap()
+
+    return units.tobytes().decode('utf-16-le', errors = 'replace')
+
+
+def _union(items, space_box = None) -> tuple:
+    """
+    Returns the box around items (Boxes). The line and paragraph spaces the converter inserts have the right edge,
+    top and bottom of their line or paragraph, so the box of a line or paragraph is taken from them when there is one.
+    """
+    if space_box is not None:
+        x1, y1, x2, y2 = space_box
+        return min([item.x1 for item in items] + [x1]), y1, x2, y2
+
+    if not items:
+        return 0, 0, 0, 0
+
+    return (min(item.x1 for item in items), min(item.y1 for item in items),
+            max(item.x2 for item in items), max(item.y2 for item in items))
+
+
+def get_paragraphs(characters, offset = 0) -> list:
+    """
+    Rebuilds the paragraphs, lines and words of a converted page from the spaces the converter inserted between
+    them: a space between two words of a line ends where the next word starts (on the same line), a space after the
+    last word of a line does not (it is on the line's right edge), and a second space after a line ends the
+    paragraph.
+
+    :param characters: The page's CharacterBuffer
+    :param offset: The character index (in the document) of where the page starts
+    :return: A list of Paragraph
+    """
+    units = characters.unicode
+    error = characters.error
+    x1, y1, x2, y2 = characters.x1, characters.y1, characters.x2, characters.y2
+    count = len(units)
+    paragraphs = []
+    lines = []
+    words = []
+    i = 0
+
+    def space_box(k):
+        return x1[k], y1[k], x2[k], y2[k]
+
+    def end_line(space):
+        box = _union(words, space_box(space) if space is not None else None)
+        start = words[0].start if words else offset + (space if space is not None else i)
+        end = words[-1].end if words else start
+        lines.append(Line(start, end, *box, words = list(words)))
+        words.clear()
+
+    def end_paragraph(space):
+        box = _union(lines, space_box(space) if space is not None else None)
+        start = lines[0].start if lines else offset + (space if space is not None else i)
+        end = lines[-1].end if lines else start
+        paragraphs.append(Paragraph(start, end, *box, lines = list(lines)))
+        lines.clear()
+
+    while i < count:
+        if units[i] == _space and not error[i]:
+            # A space that does not follow a word: a paragraph without lines
+            end_paragraph(i)
+            i += 1
+            continue
+
+        j = i
+        while j < count and (units[j] != _space or error[j]):
+            # The inserted spaces have no error, unlike the spaces that are part of a word's text
+            j += 1
+
+        words.append(Word(offset + i, offset + j, x1[i], min(y1[i:j]), x2[j - 1], max(y2[i:j]),
+                          text = decode_utf16(units[i:j]), error = error[i]))
+        i = j
+
+        if i == count:
+            break
+
+        if i + 1 < count and units[i + 1] != _space and x1[i + 1] == x2[i] and y1[i + 1] < y2[i]:
+            # A space between two words of the line
+            i += 1
+            continue
+
+        end_line(i)
+        i += 1
+
+        if i < count and units[i] == _space:
+            end_paragraph(i)
+            i += 1
+
+    if words:
+        end_line(None)
+    if lines:
+        end_paragraph(None)
+
+    return paragraphs
+
+
+def get_structure_paragraphs(characters, structure, offset = 0, page_number = None) -> list:
+    """
+    Builds the paragraphs, lines and words of a converted page from the structure the converter recorded while
+    converting it, which (unlike get_paragraphs()) does not depend on the words' boxes or text.
+
+    :param characters: The page's CharacterBuffer
+    :param structure: The eocr_structure.StructureIndex of the page (with offsets relative to the start of the
+                      page, like PageBlock.structure), or of the document if page_number is set
+    :param offset: The character index (in the document) of where the page starts
+    :param page_number: The index of the page in a document's structure
+    :return: A list of Paragraph
+    """
+    units = characters.unicode
+    error = characters.error
+    x1, y1, x2, y2 = characters.x1, characters.y1, characters.x2, characters.y2
+    count = len(units)
+
+    if page_number is None:
+        base = offset
+        paragraph_numbers = range(structure.count('paragraphs'))
+    else:
+        base = 0
+        paragraph_numbers = structure.children('pages', page_number)
+
+    def space_box(k):
+        # The space the converter inserted after a line or paragraph, if it is there
+        if k < count and units[k] == _space and not error[k]:
+            return x1[k], y1[k], x2[k], y2[k]
+        return None
+
+    paragraphs = []
+    for p in paragraph_numbers:
+        lines = []
+        for l in structure.children('paragraphs', p):
+            words = []
+            for w in structure.children('lines', l):
+                start, end = structure.span('words', w)
+                i, j = base + start - offset, base + end - offset
+                if i < j:
+                    words.append(Word(base + start, base + end, x1[i], min(y1[i:j]), x2[j - 1], max(y2[i:j]),
+                                      text = decode_utf16(units[i:j]), error = error[i]))
+
+            start, end = structure.span('lines', l)
+            lines.append(Line(base + start, base + end, *_union(words, space_box(base + end - offset)),
+                              words = words))
+
+        start, end = structure.span('paragraphs', p)
+        space = lines[-1].end + 1 if lines else base + start
+        paragraphs.append(Paragraph(base + start, base + end, *_union(lines, space_box(space - offset)),
+                                    lines = lines))
+
+    return paragraphs
+
+
+def get_format(output_file, output_format = None) -> str:
+    """
+    Returns the output format: output_format if it is set, otherwise the one of the output file's extension.
+    """
+    if output_format is None:
+        for extension, name in format_extensions.items():
+            if str(output_file).endswith(extension):
+                output_format = name
+
+    if output_format not in ('hocr', 'alto', 'jsonl'):
+        raise Exception(f'Unknown output format {output_format!r} (use hocr, alto or jsonl)')
+
+    return output_format
+
+
+class LayoutWriter(ABC):
+    """
+    Writes a document page by page, in the order of its pages. Only the current page is in memory.
+
+    :param output_file: The file path (including file name) of the resultant file
+    """
+    header = ''
+    footer = ''
+
+    def __init__(self, output_file):
+        self.page_count = 0
+        self._output = open(output_file, 'w', encoding = 'utf-8')
+        self._output.write(self.header)
+
+    def write_page(self, characters, page, structure = None, page_number = None):
+        """
+        Writes a page.
+
+        :param characters: The page's eocr_buffer.CharacterBuffer
+        :param page: The eOCR Page
+        :param structure: Optional eocr_structure.StructureIndex of the page, or of the document (see
+                          get_structure_paragraphs()). Without it, the words, lines and paragraphs are rebuilt from
+                          the spaces between them (see get_paragraphs())
+        :param page_number: The index of the page in a document's structure
+        """
+        if structure is None:
+            paragraphs = get_paragraphs(characters, page.range.start)
+        else:
+            paragraphs = get_structure_paragraphs(characters, structure, page.range.start, page_number)
+
+        self._write_page(characters, page, paragraphs)
+        self.page_count += 1
+
+    @abstractmethod
+    def _write_page(self, characters, page, paragraphs):
+        pass
+
+    def write_page_block(self, block):
+        """
+        Writes a converted page (see HOCRToEOCRConverter.iter_pages()).
+        """
+        self.write_page(block.characters, block.page, block.structure)
+
+    def write_document(self, zuva_document, structure = None):
+        """
+        Writes the pages of a HOCRToEOCRConverter's zuva_document, or of an eOCR Document.
+
+        :param structure: Optional eocr_structure.StructureIndex of the document (by default, the zuva_document's
+                          own, if it has one for all of its pages)
+        """
+        if structure is None:
+            structure = getattr(zuva_document, 'structure', None)
+        if structure is not None and structure.count('pages') != len(zuva_document.pages):
+            structure = None
+
+        for page_number, (page, characters) in enumerate(eocr_buffer.iter_page_buffers(zuva_document)):
+            self.write_page(characters, page, structure, page_number if structure is not None else None)
+
+    def close(self):
+        if self._output.closed:
+            return
+
+        self._output.write(self.footer)
+        self._output.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class HOCRWriter(LayoutWriter):
+    """
+    Writes hOCR. The character offsets are in the x_offsets property of each element's title (start and end, end
+    excluded), and the file can be converted again: it gives the same characters as the document it was written from.
+    """
+    header = _hocr_header
+    footer = _hocr_footer
+
+    def _write_page(self, characters, page, paragraphs):
+        number = self.page_count + 1
+        parts = [f"  <div class='ocr_page' id='page_{number}' title='bbox 0 0 {page.width} {page.height}; "
+                 f"ppageno {self.page_count}; x_offsets {page.range.start} {page.range.end}'>\n"]
+
+        for p, paragraph in enumerate(paragraphs, 1):
+            parts.append(f"   <p class='ocr_par' id='par_{number}_{p}' title='{self._title(paragraph)}'>\n")
+
+            for l, line in enumerate(paragraph.lines, 1):
+                parts.append(f"    <span class='ocr_line' id='line_{number}_{p}_{l}' title='{self._title(line)}'>\n")
+
+                for w, word in enumerate(line.words, 1):
+                    parts.append(f"     <span class='ocrx_word' id='word_{number}_{p}_{l}_{w}' "
+                                 f"title='{self._title(word)}; x_wconf {100 - word.error}'>"
+                                 f"{escape(word.text)}</span>\n")
+
+                parts.append('    </span>\n')
+            parts.append('   </p>\n')
+        parts.append('  </div>\n')
+
+        self._output.write(''.join(parts))
+
+    @staticmethod
+    def _title(box) -> str:
+        return f'bbox {box.x1} {box.y1} {box.x2} {box.y2}; x_offsets {box.start} {box.end}'
+
+
+class ALTOWriter(LayoutWriter):
+    """
+    Writes ALTO (version 4) XML. Paragraphs are TextBlocks, and the character offsets are in the ID of each
+    element: page_<page number>_<start>_<end>, block_<start>_<end>, line_<start>_<end> and word_<start>_<end>
+    (end excluded).
+    """
+    header = _alto_header
+    footer = _alto_footer
+
+    def _write_page(self, characters, page, paragraphs):
+        parts = [f'  <Page ID="page_{self.page_count}_{page.range.start}_{page.range.end}" '
+                 f'PHYSICAL_IMG_NR="{self.page_count + 1}" WIDTH="{page.width}" HEIGHT="{page.height}">\n',
+                 f'   <PrintSpace HPOS="0" VPOS="0" WIDTH="{page.width}" HEIGHT="{page.height}">\n']
+
+        for paragraph in paragraphs:
+            lines = [line for line in paragraph.lines if line.words]
+            if not lines:
+                continue
+
+            parts.append(f'    <TextBlock ID="block_{paragraph.start}_{paragraph.end}" {self._position(paragraph)}>\n')
+            for line in lines:
+                parts.append(f'     <TextLine ID="line_{line.start}_{line.end}" {self._position(line)}>\n')
+
+                for i, word in enumerate(line.words):
+                    if i:
+                        previous = line.words[i - 1]
+                        parts.append(f'      <SP HPOS="{previous.x2}" VPOS="{previous.y1}" '
+                                     f'WIDTH="{max(0, word.x1 - previous.x2)}"/>\n')
+                    parts.append(f'      <String ID="word_{word.start}_{word.end}" CONTENT={quoteattr(word.text)} '
+                                 f'{self._position(word)} WC="{(100 - word.error) / 100:.2f}"/>\n')
+
+                parts.append('     </TextLine>\n')
+            parts.append('    </TextBlock>\n')
+
+        parts.append('   </PrintSpace>\n')
+        parts.append('  </Page>\n')
+
+        self._output.write(''.join(parts))
+
+    @staticmethod
+    def _position(box) -> str:
+        # ALTO sizes are not negative: an inverted box (e.g. x1 > x2) is written as an empty one
+        return f'HPOS="{box.x1}" VPOS="{box.y1}" WIDTH="{max(0, box.x2 - box.x1)}" HEIGHT="{max(0, box.y2 - box.y1)}"'
+
+
+class TextOffsetWriter(LayoutWriter):
+    """
+    Writes the text as JSON Lines: one record per page, line or word (see granularity), with its start and end
+    character offsets (end excluded). The text of a record has one character per offset, except for characters
+    outside of the BMP, which are two UTF-16 code units (like in eOCR).
+
+    :param granularity: 'page' (the page's text, including the spaces between words, lines and paragraphs),
+                        'line' or 'word' (with their bounding box and, for words, the eOCR error)
+    """
+    def __init__(self, output_file, granularity = 'page'):
+        if granularity not in ('page', 'line', 'word'):
+            raise Exception(f'Unknown granularity {granularity!r} (use page, line or word)')
+
+        super().__init__(output_file)
+        self.granularity = granularity
+
+    def write_page(self, characters, page, structure = None, page_number = None):
+        if self.granularity == 'page':
+            self._write_records([{'page': self.page_count,
+                                  'start': page.range.start,
+                                  'end': page.range.end,
+                                  'width': page.width,
+                                  'height': page.height,
+                                  'text': decode_utf16(characters.unicode)}])
+            self.page_count += 1
+            return
+
+        super().write_page(characters, page, structure, page_number)
+
+    def _write_page(self, characters, page, paragraphs):
+        records = []
+        start = page.range.start
+
+        for paragraph in paragraphs:
+            for line in paragraph.lines:
+                if not line.words:
+                    continue
+
+                if self.granularity == 'line':
+                    records.append({'page': self.page_count,
+                                    'start': line.start,
+                                    'end': line.end,
+                                    'bbox': line.bbox,
+                                    'text': decode_utf16(characters.unicode[line.start - start:line.end - start])})
+                    continue
+
+                for word in line.words:
+                    records.append({'page': self.page_count,
+                                    'start': word.start,
+                                    'end': word.end,
+                                    'bbox': word.bbox,
+                                    'error': word.error,
+                                    'text': word.text})
+
+        self._write_records(records)
+
+    def _write_records(self, records):
+        self._output.write(''.join(json.dumps(record, ensure_ascii = False) + '\n' for record in records))
+
+
+def new_writer(output_file, output_format = None, granularity = 'page') -> LayoutWriter:
+    """
+    Opens a writer for the output format (see get_format()).
+
+    :param granularity: The records of the jsonl format (see TextOffsetWriter)
+    """
+    output_format = get_format(output_file, output_format)
+
+    if output_format == 'hocr':
+        return HOCRWriter(output_file)
+    if output_format == 'alto':
+        return ALTOWriter(output_file)
+    return TextOffsetWriter(output_file, granularity)
+
+
+def write_document(zuva_document, output_file, output_format = None, granularity = 'page', structure = None):
+    """
+    Writes a HOCRToEOCRConverter's zuva_document, or an eOCR Document, as hOCR, ALTO or text with offsets.
+
+    :param structure: Optional eocr_structure.StructureIndex of the document (see LayoutWriter.write_document())
+    """
+    with new_writer(output_file, output_format, granularity) as writer:
+        writer.write_document(zuva_document, structure)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Writes an .eocr as hOCR, ALTO or text with character offsets')
+    parser.add_argument('eocr_file')
+    parser.add_argument('output_file')
+    parser.add_argument('--format', choices = ('hocr', 'alto', 'jsonl'),
+                        help = 'The output format (by default, the one of the output file extension)')
+    parser.add_argument('--granularity', choices = ('page', 'line', 'word'), default = 'page',
+                        help = 'The records of the jsonl format')
+    parser.add_argument('--structure', help = 'The structure file of the .eocr (see HOCRToEOCRConverter.export())')
+    args = parser.parse_args()
+
+    structure = eocr_structure.StructureIndex.read(args.structure) if args.structure else None
+    write_document(eocr_helper.load_eocr(args.eocr_file), args.output_file, args.format, args.granularity, structure)
+
+
+if __name__ == '__main__':
+    main()
@@ -13,9 +13,11 @@
 # limitations under the License.
 
 
-from recognition_results_pb2 import BoundingBox, Character, Document, CharacterRange, Page
+from recognition_results_pb2 import BoundingBox, Character, Document, CharacterRange, Footer, FontSize, FontStyle, \
+    Header, Page
 import hashlib
 import gzip
+import zlib
 
 # The header to be added to the compiled byte-content of the EOCR file
 eocr_header = b'eocr     \n'
@@ -49,13 +51,33 @@ def new_character(char, left_x1, top_y1, right_x2, bottom_y2, confidence: int) -
     :param confidence: The confidence
     :return: EOCR Character
     """
+    return new_utf16_character(unicode = ord(char),
+                               left_x1 = left_x1,
+                               top_y1 = top_y1,
+                               right_x2 = right_x2,
+                               bottom_y2 = bottom_y2,
+                               confidence = confidence)
+
+
+def new_utf16_character(unicode: int, left_x1, top_y1, right_x2, bottom_y2, confidence: int) -> Character:
+    """
+    Creates a new eOCR Character from a UTF-16 code unit, with bounding boxes and confidence
+
+    :param unicode: The UTF-16 code unit of the character
+    :param left_x1: The x1 pixel location
+    :param top_y1: The y1 pixel location
+    :param right_x2: The x2 pixel location
+    :param bottom_y2: The y2 pixel location
+    :param confidence: The confidence
+    :return: EOCR Character
+    """
     bb = BoundingBox()
     bb.x1 = left_x1
     bb.y1 = top_y1
     bb.x2 = right_x2
     bb.y2 = bottom_y2
 
-    char = Character(unicode = ord(char),
+    char = Character(unicode = unicode,
                      error = confidence,
                      bounding_box = bb)
 
@@ -95,17 +117,115 @@ def new_page(range_start, range_end, width, height, dpi_x: int = page_dpi_x, dpi
     return page
 
 
+def new_font_size(start, end, size: int) -> FontSize:
+    """
+    Creates a new eOCR FontSize
+
+    :param start: The character position of the range's first character
+    :param end: The character position after the range's last character
+    :param size: The size of the font in points
+    :return: EOCR FontSize
+    """
+    return FontSize(range = new_page_range(start = start, end = end),
+                    size = size)
+
+
+def new_font_style(start, end, style) -> FontStyle:
+    """
+    Creates a new eOCR FontStyle
+
+    :param start: The character position of the range's first character
+    :param end: The character position after the range's last character
+    :param style: FontStyle.BOLD or FontStyle.ITALIC
+    :return: EOCR FontStyle
+    """
+    return FontStyle(range = new_page_range(start = start, end = end),
+                     style = style)
+
+
+def new_header(start, end) -> Header:
+    """
+    Creates a new eOCR Header over a range of characters
+    """
+    return Header(range = new_page_range(start = start, end = end))
+
+
+def new_footer(start, end) -> Footer:
+    """
+    Creates a new eOCR Footer over a range of characters
+    """
+    return Footer(range = new_page_range(start = start, end = end))
+
+
 def get_eocr_file_content(zuva_document: Document) -> bytes:
     """
     Creates the compiled EOCR content using the eOCR Document.
 
+    :return: The byte-content of the eOCR file
+    """
+    return get_eocr_file_content_from_bytes(zuva_document.SerializeToString())
+
+
+def get_eocr_file_content_from_bytes(serialized: bytes) -> bytes:
+    """
+    Creates the compiled EOCR content using an already serialized eOCR Document.
+
     :return: The byte-content of the eOCR file
     """
     content = b''
     content += eocr_header
 
-    # Use mtime=0 to set the timestamp, so that the eOCR file is generated deterministically
-    body = gzip.compress(zuva_document.SerializeToString(), mtime=0)
+    compressor = new_body_compressor()
+    body = compressor.compress(serialized) + compressor.flush()
     content += hashlib.sha1(body).digest()
     content += body
     return content
+
+
+def new_body_compressor():
+    """
+    Creates the compressor of the eOCR body (gzip, best compression). Its gzip header has no timestamp,
+    so that the eOCR file is generated deterministically.
+
+    :return: A zlib compression object
+    """
+    return zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def get_eocr_document_bytes(content: bytes) -> bytes:
+    """
+    Verifies the byte-content of an eOCR file and returns the serialized eOCR Document it contains.
+
+    :param content: The byte-content of the eOCR file
+    :return: The serialized (uncompressed) Document
+    """
+    if not content.startswith(eocr_header):
+        raise Exception('The content is not an eOCR file (missing header)')
+
+    digest = content[len(eocr_header):len(eocr_header) + 20]
+    body = content[len(eocr_header) + 20:]
+
+    if hashlib.sha1(body).digest() != digest:
+        raise Exception('The eOCR body does not match its sha1 digest')
+
+    return gzip.decompress(body)
+
+
+def read_eocr_file(eocr_file) -> bytes:
+    """
+    Reads an eOCR file, verifies it and returns the serialized eOCR Document it contains (see
+    get_eocr_document_bytes()).
+
+    :param eocr_file: The file path of the eOCR file
+    """
+    with open(eocr_file, 'rb') as eocr:
+        return get_eocr_document_bytes(eocr.read())
+
+
+def load_eocr(eocr_file) -> Document:
+    """
+    Reads an eOCR file as an eOCR Document.
+
+    :param eocr_file: The file path of the eOCR file
+    """
+    return Document.FromString(read_eocr_file(eocr_file))
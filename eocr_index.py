@@ -0,0 +1,681 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from bisect import bisect_right
+import struct
+import zlib
+
+from recognition_results_pb2 import Document
+import eocr_helper
+
+# The header of an eOCR index (sidecar) file
+index_header = b'eocrx 2\n'
+
+# The headers of the index versions that can be read. Version 1 indexes have the same layout as version 2 ones.
+readable_headers = (b'eocrx 1\n', index_header)
+
+# The default distance (in uncompressed bytes) between two index checkpoints
+checkpoint_span = 256 * 1024
+
+# The size of the deflate sliding window that is saved with each checkpoint
+window_size = 32 * 1024
+
+# The number of compressed bytes read at a time when inflating from a checkpoint
+read_size = 64 * 1024
+
+_index_struct = struct.Struct('<IIII')
+_checkpoint_struct = struct.Struct('<QQI')
+_page_struct = struct.Struct('<QQIIIIII')
+
+# Deflate length/distance base values and extra bits (RFC 1951, section 3.2.5)
+_length_base = [3, 4, 5, 6, 7, 8, 9, 10, 11, 13, 15, 17, 19, 23, 27, 31,
+                35, 43, 51, 59, 67, 83, 99, 115, 131, 163, 195, 227, 258]
+_length_extra = [0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 2, 2, 2, 2,
+                 3, 3, 3, 3, 4, 4, 4, 4, 5, 5, 5, 5, 0]
+_distance_extra = [0, 0, 0, 0, 1, 1, 2, 2, 3, 3, 4, 4, 5, 5, 6, 6,
+                   7, 7, 8, 8, 9, 9, 10, 10, 11, 11, 12, 12, 13, 13]
+_code_length_order = [16, 17, 18, 0, 8, 7, 9, 6, 10, 5, 11, 4, 12, 3, 13, 2, 14, 1, 15]
+
+
+class Checkpoint(object):
+    """
+    A point in the compressed body where inflating can be resumed.
+
+    :param bit_offset: The bit position (from the start of the gzip body) of a deflate block
+    :param out_offset: The uncompressed position of the same deflate block
+    :param window: Up to 32KB of uncompressed data preceding out_offset
+    """
+    def __init__(self, bit_offset, out_offset, window):
+        self.bit_offset = bit_offset
+        self.out_offset = out_offset
+        self.window = window
+
+
+class PageEntry(object):
+    """
+    The location of a page's characters in the uncompressed Document.
+
+    :param wire_start: The uncompressed position of the page's first character
+    :param wire_end: The uncompressed position after the page's last character
+    :param page: The eOCR Page
+    """
+    def __init__(self, wire_start, wire_end, page):
+        self.wire_start = wire_start
+        self.wire_end = wire_end
+        self.page = page
+
+
+class EOCRIndex(object):
+    def __init__(self, digest, checkpoints, pages, body_offset = len(eocr_helper.eocr_header) + 20):
+        self.digest = digest
+        self.checkpoints = checkpoints
+        self.pages = pages
+        self.body_offset = body_offset
+        self._checkpoint_offsets = [c.out_offset for c in checkpoints]
+
+    def find_checkpoint(self, out_offset) -> Checkpoint:
+        """
+        Returns the last checkpoint at or before the uncompressed position.
+        """
+        return self.checkpoints[bisect_right(self._checkpoint_offsets, out_offset) - 1]
+
+    def to_bytes(self) -> bytes:
+        """
+        Creates the byte-content of the index (sidecar) file.
+        """
+        content = [index_header,
+                   self.digest,
+                   _index_struct.pack(self.body_offset, len(self.checkpoints), len(self.pages), 0)]
+
+        for checkpoint in self.checkpoints:
+            window = zlib.compress(checkpoint.window)
+            content.append(_checkpoint_struct.pack(checkpoint.bit_offset, checkpoint.out_offset, len(window)))
+            content.append(window)
+
+        for entry in self.pages:
+            page = entry.page
+            content.append(_page_struct.pack(entry.wire_start, entry.wire_end,
+                                             page.range.start, page.range.end,
+                                             page.width, page.height, page.dpi_x, page.dpi_y))
+
+        return b''.join(content)
+
+    @classmethod
+    def from_bytes(cls, content):
+        """
+        Loads an index from the byte-content of an index (sidecar) file.
+        """
+        if not content.startswith(readable_headers):
+            if content.startswith(index_header[:6]):
+                version = content[6:content.find(b'\n')].decode(errors = 'replace')
+                raise Exception(f'Unsupported eOCR index version {version} (rebuild it with write_index())')
+            raise Exception('Not an eOCR index file')
+
+        position = len(index_header)
+        digest = content[position:position + 20]
+        position += 20
+        body_offset, checkpoint_count, page_count, _ = _index_struct.unpack_from(content, position)
+        position += _index_struct.size
+
+        checkpoints = []
+        for _ in range(checkpoint_count):
+            bit_offset, out_offset, window_length = _checkpoint_struct.unpack_from(content, position)
+            position += _checkpoint_struct.size
+            window = zlib.decompress(content[position:position + window_length])
+            position += window_length
+            checkpoints.append(Checkpoint(bit_offset, out_offset, window))
+
+        pages = []
+        for _ in range(page_count):
+            wire_start, wire_end, range_start, range_end, width, height, dpi_x, dpi_y = \
+                _page_struct.unpack_from(content, position)
+            position += _page_struct.size
+            page = eocr_helper.new_page(range_start = range_start,
+                                        range_end = range_end,
+                                        width = width,
+                                        height = height,
+                                        dpi_x = dpi_x,
+                                        dpi_y = dpi_y)
+            pages.append(PageEntry(wire_start, wire_end, page))
+
+        return cls(digest, checkpoints, pages, body_offset)
+
+
+def _read_varint(data, position):
+    """
+    Reads a protobuf varint and returns the value and the position after it.
+    """
+    value = 0
+    shift = 0
+    while True:
+        b = data[position]
+        position += 1
+        value |= (b & 0x7f) << shift
+        if b < 0x80:
+            return value, position
+        shift += 7
+
+
+def iter_fields(data, position = 0, end = None):
+    """
+    Walks the top-level fields of a serialized protobuf message.
+
+    :param data: The serialized message
+    :return: Yields (field number, start, end) for each field, where start/end cover the whole field
+    """
+    end = len(data) if end is None else end
+
+    while position < end:
+        start = position
+        key, position = _read_varint(data, position)
+        wire_type = key & 7
+
+        if wire_type == 0:
+            _, position = _read_varint(data, position)
+        elif wire_type == 1:
+            position += 8
+        elif wire_type == 2:
+            length, position = _read_varint(data, position)
+            position += length
+        elif wire_type == 5:
+            position += 4
+        else:
+            raise Exception(f'Unsupported protobuf wire type {wire_type}')
+
+        yield key >> 3, start, position
+
+
+def get_character_wire_offsets(serialized):
+    """
+    Finds where each character is located in a serialized eOCR Document.
+
+    :param serialized: The serialized (uncompressed) Document
+    :return: A tuple of (character offsets, end of the character block, Document without its characters)
+    """
+    character_field = Document.DESCRIPTOR.fields_by_name['characters'].number
+    offsets = []
+    others = []
+    end = 0
+
+    for field_number, start, field_end in iter_fields(serialized):
+        if field_number == character_field:
+            offsets.append(start)
+            end = field_end
+        else:
+            others.append(serialized[start:field_end])
+
+    return offsets, end, Document.FromString(b''.join(others))
+
+
+class _BitReader(object):
+    def __init__(self, data, bit_offset):
+        self.data = data
+        self.position = bit_offset >> 3
+        self.buffer = 0
+        self.count = 0
+        self.bits(bit_offset & 7)
+
+    def bits(self, n):
+        while self.count < n:
+            if self.position >= len(self.data):
+                raise Exception('Unexpected end of deflate stream')
+            self.buffer |= self.data[self.position] << self.count
+            self.position += 1
+            self.count += 8
+        value = self.buffer & ((1 << n) - 1)
+        self.buffer >>= n
+        self.count -= n
+        return value
+
+    def tell(self):
+        return self.position * 8 - self.count
+
+    def align(self):
+        self.bits(self.count & 7)
+
+
+def _huffman_table(lengths):
+    """
+    Builds a lookup table (indexed by the next bits of the stream) for canonical Huffman code lengths.
+
+    :return: A tuple of (table, bits), where each entry is symbol << 4 | code length (or -1 if invalid)
+    """
+    max_bits = max(lengths) or 1
+    table = [-1] * (1 << max_bits)
+    code = 0
+    for bits in range(1, max_bits + 1):
+        for symbol, length in enumerate(lengths):
+            if length != bits:
+                continue
+            reversed_code = int(format(code, f'0{bits}b')[::-1], 2)
+            entry = symbol << 4 | bits
+            for i in range(reversed_code, 1 << max_bits, 1 << bits):
+                table[i] = entry
+            code += 1
+        code <<= 1
+    return table, max_bits
+
+
+def _read_symbol(reader, table, bits):
+    entry = table[_peek(reader, bits)]
+    if entry < 0:
+        raise Exception('Invalid Huffman code in deflate stream')
+    reader.bits(entry & 15)
+    return entry >> 4
+
+
+def _peek(reader, n):
+    while reader.count < n and reader.position < len(reader.data):
+        reader.buffer |= reader.data[reader.position] << reader.count
+        reader.position += 1
+        reader.count += 8
+    return reader.buffer & ((1 << n) - 1)
+
+
+def _read_dynamic_tables(reader):
+    hlit = reader.bits(5) + 257
+    hdist = reader.bits(5) + 1
+    hclen = reader.bits(4) + 4
+
+    code_lengths = [0] * 19
+    for i in range(hclen):
+        code_lengths[_code_length_order[i]] = reader.bits(3)
+    table, bits = _huffman_table(code_lengths)
+
+    lengths = []
+    while len(lengths) < hlit + hdist:
+        symbol = _read_symbol(reader, table, bits)
+        if symbol < 16:
+            lengths.append(symbol)
+        elif symbol == 16:
+            lengths.extend([lengths[-1]] * (3 + reader.bits(2)))
+        elif symbol == 17:
+            lengths.extend([0] * (3 + reader.bits(3)))
+        else:
+            lengths.extend([0] * (11 + reader.bits(7)))
+
+    return _huffman_table(lengths[:hlit]), _huffman_table(lengths[hlit:])
+
+
+_fixed_tables = (_huffman_table([8] * 144 + [9] * 112 + [7] * 24 + [8] * 8),
+                 _huffman_table([5] * 30))
+
+
+class _BitWriter(object):
+    def __init__(self):
+        self.value = 0
+        self.count = 0
+
+    def bits(self, value, n):
+        self.value |= value << self.count
+        self.count += n
+
+    def code(self, code, n):
+        # Huffman codes are packed starting from their most significant bit
+        self.bits(int(format(code, f'0{n}b')[::-1], 2), n)
+
+    def to_bytes(self) -> bytes:
+        return self.value.to_bytes(self.count // 8, 'little')
+
+
+def _canonical_codes(lengths) -> list:
+    """
+    Returns the canonical Huffman code of each symbol (RFC 1951, section 3.2.2), as _huffman_table assigns them.
+    """
+    codes = [0] * len(lengths)
+    code = 0
+    for bits in range(1, max(lengths) + 1):
+        for symbol, length in enumerate(lengths):
+            if length == bits:
+                codes[symbol] = code
+                code += 1
+        code <<= 1
+    return codes
+
+
+def _complete_lengths(count) -> list:
+    """
+    Returns code lengths that make a complete Huffman code of count (2 or more) symbols.
+    """
+    bits = count.bit_length() - 1
+    longer = 2 * (count - (1 << bits))
+    return [bits] * (count - longer) + [bits + 1] * longer
+
+
+def _skip_bits_prefix(byte, count) -> bytes:
+    """
+    Creates deflate blocks that produce no output, and whose last code is the low count bits of byte. Inflating the
+    prefix followed by the compressed bytes from that byte on resumes at the block that starts count bits into it, the
+    way zlib's inflatePrime() would (which Python does not expose). The bits keep their position within a byte, so
+    the stored blocks that follow stay aligned.
+
+    :param byte: The byte that the checkpoint's deflate block starts in
+    :param count: The number of bits (1 to 7) of the byte that belong to the block before
+    :return: The prefix, a whole number of bytes
+    """
+    # The end-of-block code, as inflate reads it (most significant bit first)
+    end_of_block = 0
+    for i in range(count):
+        end_of_block = end_of_block << 1 | (byte >> i) & 1
+
+    # A complete literal/length code (zlib refuses incomplete ones) in which the end-of-block code is count bits long
+    # and worth end_of_block. Shorter codes and codes of the same length for smaller symbols come before it, longer
+    # codes and codes of the same length for larger symbols after it.
+    literals = iter(range(256))
+    lengths = [0] * 286
+    for i in range(count):
+        if end_of_block >> i & 1:
+            lengths[next(literals)] = count - i
+    lengths[256] = count
+    after = (1 << count) - 1 - end_of_block
+    for symbol in range(257, 257 + min(after, 29)):
+        lengths[symbol] = count
+    for _ in range(2 * max(0, after - 29)):
+        lengths[next(literals)] = count + 1
+
+    literal_count = max(257, max(symbol for symbol, length in enumerate(lengths) if length) + 1)
+    # One distance code, of length 1 (which zlib allows to be incomplete)
+    sequence = lengths[:literal_count] + [1]
+
+    used = sorted(set(sequence))
+    code_lengths = [0] * 19
+    for symbol, length in zip(used, _complete_lengths(len(used))):
+        code_lengths[symbol] = length
+    codes = _canonical_codes(code_lengths)
+    minimum = max(4, max(_code_length_order.index(symbol) for symbol in used) + 1)
+
+    # The prefix must end on a byte boundary: one more (unused) code length code changes the size of the block by 3
+    # bits, and each empty fixed Huffman block before it adds 10 bits
+    size = 17 + sum(code_lengths[length] for length in sequence)
+    hclen, empty_blocks = next((hclen, empty_blocks) for hclen in (minimum, minimum + 1) for empty_blocks in range(4)
+                               if (size + 3 * hclen + 10 * empty_blocks) % 8 == 0)
+
+    writer = _BitWriter()
+    for _ in range(empty_blocks):
+        writer.bits(0b010, 3)
+        writer.bits(0, 7)
+
+    writer.bits(0b100, 3)
+    writer.bits(literal_count - 257, 5)
+    writer.bits(0, 5)
+    writer.bits(hclen - 4, 4)
+    for symbol in _code_length_order[:hclen]:
+        writer.bits(code_lengths[symbol], 3)
+    for length in sequence:
+        writer.code(codes[length], code_lengths[length])
+
+    return writer.to_bytes()
+
+
+def _skip_block(reader, literals, distances):
+    """
+    Decodes a Huffman-coded deflate block without producing its output.
+
+    :return: The number of uncompressed bytes in the block
+    """
+    literal_table, literal_bits = literals
+    distance_table, distance_bits = distances
+    literal_mask = (1 << literal_bits) - 1
+    distance_mask = (1 << distance_bits) - 1
+    data = reader.data
+    position = reader.position
+    buffer = reader.buffer
+    count = reader.count
+    out = 0
+
+    while True:
+        # A literal/length code, its extra bits, a distance code and its extra bits fit in 48 bits
+        if count < 48:
+            chunk = data[position:position + 6]
+            buffer |= int.from_bytes(chunk, 'little') << count
+            position += len(chunk)
+            count += len(chunk) * 8
+
+        entry = literal_table[buffer & literal_mask]
+        if entry < 0:
+            raise Exception('Invalid Huffman code in deflate stream')
+        length = entry & 15
+        buffer >>= length
+        count -= length
+        symbol = entry >> 4
+
+        if symbol < 256:
+            out += 1
+        elif symbol == 256:
+            break
+        else:
+            symbol -= 257
+            extra = _length_extra[symbol]
+            out += _length_base[symbol] + (buffer & ((1 << extra) - 1))
+            buffer >>= extra
+            count -= extra
+
+            entry = distance_table[buffer & distance_mask]
+            if entry < 0:
+                raise Exception('Invalid Huffman code in deflate stream')
+            length = entry & 15
+            extra = _distance_extra[entry >> 4]
+            buffer >>= length + extra
+            count -= length + extra
+
+        if count < 0:
+            raise Exception('Unexpected end of deflate stream')
+
+    reader.position = position
+    reader.buffer = buffer
+    reader.count = count
+    return out
+
+
+def _gzip_header_length(body) -> int:
+    """
+    Returns the length of the gzip member header (RFC 1952) at the start of the body.
+    """
+    if body[:3] != b'\x1f\x8b\x08':
+        raise Exception('The eOCR body is not gzip compressed')
+
+    flags = body[3]
+    position = 10
+    if flags & 4:
+        position += 2 + int.from_bytes(body[position:position + 2], 'little')
+    if flags & 8:
+        position = body.index(b'\x00', position) + 1
+    if flags & 16:
+        position = body.index(b'\x00', position) + 1
+    if flags & 2:
+        position += 2
+    return position
+
+
+def get_deflate_blocks(body):
+    """
+    Finds the start of every deflate block in a gzip compressed body.
+
+    :param body: The gzip compressed body
+    :return: A list of (bit offset, uncompressed offset) tuples, one per block
+    """
+    reader = _BitReader(body, _gzip_header_length(body) * 8)
+    blocks = []
+    out = 0
+
+    while True:
+        blocks.append((reader.tell(), out))
+        final = reader.bits(1)
+        block_type = reader.bits(2)
+
+        if block_type == 0:
+            reader.align()
+            length = reader.bits(16)
+            reader.bits(16)
+            reader.position += length
+            out += length
+        elif block_type == 1:
+            out += _skip_block(reader, *_fixed_tables)
+        elif block_type == 2:
+            out += _skip_block(reader, *_read_dynamic_tables(reader))
+        else:
+            raise Exception('Invalid deflate block type')
+
+        if final:
+            return blocks
+
+
+def build_index(content, span: int = checkpoint_span) -> EOCRIndex:
+    """
+    Creates the index of an eOCR file's content. The content itself is not modified.
+
+    Checkpoints are put at the first deflate block at least span bytes after the previous checkpoint, so they are
+    span bytes apart plus at most one block (zlib's blocks hold up to 16K codes, typically some tens of KB).
+
+    :param content: The byte-content of the eOCR file
+    :param span: The distance (in uncompressed bytes) between two checkpoints
+    :return: The EOCRIndex
+    """
+    body_offset = len(eocr_helper.eocr_header) + 20
+    digest = content[len(eocr_helper.eocr_header):body_offset]
+    body = content[body_offset:]
+    serialized = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+
+    checkpoints = []
+    for bit_offset, out_offset in get_deflate_blocks(body):
+        if checkpoints and out_offset - checkpoints[-1].out_offset < span:
+            continue
+        window = serialized[max(0, out_offset - window_size):out_offset]
+        checkpoints.append(Checkpoint(bit_offset, out_offset, window))
+
+    offsets, end, document = get_character_wire_offsets(serialized)
+    offsets.append(end)
+
+    pages = []
+    for page in document.pages:
+        pages.append(PageEntry(offsets[min(page.range.start, len(offsets) - 1)],
+                               offsets[min(page.range.end, len(offsets) - 1)],
+                               page))
+
+    return EOCRIndex(digest, checkpoints, pages, body_offset)
+
+
+def write_index(content, index_file, span: int = checkpoint_span):
+    """
+    Writes the index (sidecar) file of an eOCR file's content.
+
+    :param content: The byte-content of the eOCR file
+    :param index_file: The file path of the index
+    :param span: The distance (in uncompressed bytes) between two checkpoints
+    """
+    index = build_index(content, span)
+
+    with open(index_file, "wb") as output:
+        output.write(index.to_bytes())
+
+
+class EOCRReader(object):
+    """
+    Reads pages and characters out of an eOCR file without decompressing it entirely.
+
+    :param eocr_file: The file path of the eOCR file
+    :param index_file: The file path of the index (sidecar) file that was written for it
+    """
+    def __init__(self, eocr_file, index_file):
+        with open(index_file, 'rb') as index:
+            self.index = EOCRIndex.from_bytes(index.read())
+
+        self.eocr = open(eocr_file, 'rb')
+        self.eocr.seek(len(eocr_helper.eocr_header))
+        if self.eocr.read(20) != self.index.digest:
+            self.eocr.close()
+            raise Exception(f'{index_file} is not the index of {eocr_file}')
+
+        self._page_starts = [entry.page.range.start for entry in self.index.pages]
+
+    def close(self):
+        self.eocr.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def page_count(self) -> int:
+        return len(self.index.pages)
+
+    def read_uncompressed(self, start, end) -> bytes:
+        """
+        Inflates the uncompressed Document bytes between start and end, starting from the closest checkpoint.
+        """
+        checkpoint = self.index.find_checkpoint(start)
+        byte_offset, bits = divmod(checkpoint.bit_offset, 8)
+
+        if checkpoint.window:
+            inflater = zlib.decompressobj(-zlib.MAX_WBITS, zdict = checkpoint.window)
+        else:
+            inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+
+        skip = start - checkpoint.out_offset
+        wanted = end - start
+        result = bytearray()
+
+        self.eocr.seek(self.index.body_offset + byte_offset)
+        data = self.eocr.read(read_size)
+
+        # The checkpoint's block starts part way into a byte: inflate skips the bits before it (see _skip_bits_prefix)
+        if bits and data:
+            data = _skip_bits_prefix(data[0], bits) + data
+
+        while data and len(result) < wanted and not inflater.eof:
+            chunk = inflater.decompress(data)
+
+            if skip:
+                skipped = min(skip, len(chunk))
+                chunk = chunk[skipped:]
+                skip -= skipped
+            result += chunk
+            data = self.eocr.read(read_size)
+
+        if len(result) < wanted:
+            raise Exception(f'Could not read uncompressed bytes {start} to {end}')
+
+        return bytes(result[:wanted])
+
+    def read_page(self, page_number):
+        """
+        Reads a single page.
+
+        :param page_number: The 0-based page number
+        :return: A tuple of (eOCR Page, list of eOCR Characters)
+        """
+        entry = self.index.pages[page_number]
+        data = self.read_uncompressed(entry.wire_start, entry.wire_end)
+        return entry.page, list(Document.FromString(data).characters)
+
+    def read_characters(self, start, end):
+        """
+        Reads the characters between start and end, only inflating the pages that contain them.
+
+        :param start: The index of the first character
+        :param end: The index after the last character
+        :return: A list of eOCR Characters
+        """
+        if end <= start:
+            return []
+
+        first = self.index.pages[max(0, bisect_right(self._page_starts, start) - 1)]
+        last = self.index.pages[max(0, bisect_right(self._page_starts, end - 1) - 1)]
+        data = self.read_uncompressed(first.wire_start, last.wire_end)
+        characters = Document.FromString(data).characters
+        offset = first.page.range.start
+        return list(characters[start - offset:end - offset])
@@ -0,0 +1,527 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# A work queue for converting many documents on several hosts that share a filesystem, without a message broker.
+# The queue is a SQLite database on the shared mount. A worker claims a task under a lease, renews the lease while
+# it converts, and publishes the .eocr by renaming it into place. When a worker dies, its lease expires and the
+# task is claimed again by another worker (up to max_attempts times). The largest tasks (by the estimated cost of
+# their .hocr files, see eocr_batch.estimate_cost()) are claimed first, and a large document can be split into
+# shards that are converted by several workers.
+#
+#   python3 eocr_queue.py <queue.db> add <name> <hocr_folder or manifest> <md5 hex> <output.eocr> [--shard-bytes N]
+#   python3 eocr_queue.py <queue.db> work [--lease 60] [--workers 2] [--wait]
+#   python3 eocr_queue.py <queue.db> status
+#   python3 eocr_queue.py <queue.db> retry
+#
+# SQLite relies on the file locks of the shared filesystem, so use a mount where POSIX locks work across hosts
+# (e.g. NFSv4). The database is kept in rollback journal mode, as WAL needs memory shared on one host. Leases are
+# compared against each host's clock, so the hosts' clocks should be synchronised (e.g. by NTP) to well within
+# the lease duration.
+
+
+from contextlib import contextmanager
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import eocr_batch
+import eocr_splice
+import hocr_helper
+from HOCRToEOCRConverter import HOCRToEOCRConverter
+
+# The states of a task
+task_states = ('pending', 'leased', 'done', 'failed')
+
+# A task either converts (a shard of) a document, or merges the shards of a document once they are all converted
+_schema = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    document TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    shard INTEGER NOT NULL,
+    shard_count INTEGER NOT NULL,
+    cost INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_expires REAL,
+    error TEXT,
+    UNIQUE (document, kind, shard)
+);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, kind, cost);
+"""
+
+# The version of the schema, kept in the database's user_version. Version 1 added the cost of the tasks: the tasks
+# of older databases are given a cost of 0, so they are claimed in the order they were added.
+schema_version = 1
+
+_task_columns = 'id, document, kind, shard, shard_count, payload, attempts, worker'
+
+
+class Task(object):
+    """
+    A task claimed from the WorkQueue. The worker and the attempt number identify the lease: a worker whose lease
+    expired and was claimed again can no longer renew, complete or fail the task.
+    """
+    def __init__(self, id, document, kind, shard, shard_count, payload, attempts, worker):
+        self.id = id
+        self.document = document
+        self.kind = kind
+        self.shard = shard
+        self.shard_count = shard_count
+        self.payload = json.loads(payload)
+        self.attempts = attempts
+        self.worker = worker
+
+    def __repr__(self):
+        return f'Task({self.document!r}, {self.kind}, shard {self.shard + 1}/{self.shard_count})'
+
+
+def get_part_file(output_file, shard) -> str:
+    """
+    Returns the file path of the .eocr of one shard of a document, next to the document's .eocr.
+    """
+    return f'{output_file}.part{shard:04d}'
+
+
+class WorkQueue(object):
+    """
+    The tasks of a conversion run, in a SQLite database.
+
+    :param database: The file path of the database (created if needed), on storage shared by the workers
+    :param max_attempts: The number of times a task is claimed before it is given up as failed
+    :param timeout: The number of seconds to wait for another worker's lock on the database
+    """
+    def __init__(self, database, max_attempts = 3, timeout = 60):
+        self.database = database
+        self.max_attempts = max_attempts
+        self.connection = sqlite3.connect(database, timeout = timeout, isolation_level = None)
+        self.connection.execute('PRAGMA journal_mode = DELETE')
+        self._migrate()
+        self.connection.executescript(_schema)
+
+    def _migrate(self):
+        """
+        Brings the tasks table of a database written by an older version up to schema_version.
+        """
+        with self._transaction() as db:
+            version = db.execute('PRAGMA user_version').fetchone()[0]
+            if version > schema_version:
+                raise Exception(f'The queue {self.database} was written by a newer version (schema {version})')
+
+            columns = {row[1] for row in db.execute('PRAGMA table_info(tasks)')}
+
+            if version < 1 and columns and 'cost' not in columns:
+                db.execute('ALTER TABLE tasks ADD COLUMN cost INTEGER NOT NULL DEFAULT 0')
+                # The tasks were indexed by id, rather than by cost
+                db.execute('DROP INDEX IF EXISTS tasks_state')
+
+            if version < schema_version:
+                db.execute(f'PRAGMA user_version = {schema_version}')
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @contextmanager
+    def _transaction(self):
+        # An immediate transaction takes the write lock up front, so two workers never claim the same task
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        self.connection.execute('COMMIT')
+
+    def add_document(self, document, hocr_files, md5, output_file, shard_pages = None, shard_bytes = None) -> int:
+        """
+        Adds the conversion of a document. Adding a document that is already in the queue does nothing.
+
+        :param document: The name of the document, unique in the queue
+        :param hocr_files: The file paths of the document's .hocr files, in page order. They must be readable by
+                           every worker (e.g. absolute paths on the shared mount).
+        :param md5: The message digest of the source file, as bytes or as a hex string
+        :param output_file: The file path of the resultant .eocr
+        :param shard_pages: Optional number of .hocr files per shard. A document with more files is converted as
+                            several shards (on several workers), whose .eocr are merged when they are all done.
+        :param shard_bytes: Optional estimated cost (see eocr_batch.estimate_cost()) of the .hocr files per shard,
+                            instead of shard_pages
+        :return: The number of tasks added
+        """
+        hocr_files = [os.path.abspath(f) for f in hocr_files]
+        if not hocr_files:
+            raise Exception(f'Document {document!r} has no .hocr files')
+
+        if isinstance(md5, bytes):
+            md5 = md5.hex()
+
+        output_file = os.path.abspath(output_file)
+        costs = [eocr_batch.estimate_cost(f) for f in hocr_files]
+
+        if shard_bytes:
+            shards = eocr_batch.split_shards(hocr_files, costs, shard_bytes)
+        else:
+            shard_pages = shard_pages or len(hocr_files)
+            shards = [hocr_files[i:i + shard_pages] for i in range(0, len(hocr_files), shard_pages)]
+
+        rows = []
+        first = 0
+        for shard, files in enumerate(shards):
+            payload = {'hocr_files': files, 'md5': md5, 'output_file': output_file}
+            if len(shards) > 1:
+                payload['part_file'] = get_part_file(output_file, shard)
+
+            rows.append((document, 'convert', shard, len(shards), sum(costs[first:first + len(files)]),
+                         json.dumps(payload)))
+            first += len(files)
+
+        with self._transaction() as db:
+            added = db.total_changes
+            db.executemany('INSERT OR IGNORE INTO tasks (document, kind, shard, shard_count, cost, payload) '
+                           'VALUES (?, ?, ?, ?, ?, ?)', rows)
+            return db.total_changes - added
+
+    def claim(self, worker, lease_seconds) -> Task:
+        """
+        Claims the next pending task, or a task whose lease expired. Merges are claimed before conversions, so
+        that documents are finished as soon as possible, and then the largest conversions first, so that a large
+        document does not start last and hold up the end of the run.
+
+        :param worker: The id of the worker
+        :param lease_seconds: The number of seconds the task is leased for (see heartbeat())
+        :return: The Task, or None if there is no task to claim
+        """
+        now = time.time()
+
+        with self._transaction() as db:
+            db.execute("UPDATE tasks SET state = 'failed', error = ? || worker, worker = NULL "
+                       "WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?",
+                       ('lease expired on its last attempt, by ', now, self.max_attempts))
+
+            row = db.execute(f"SELECT {_task_columns} FROM tasks "
+                             f"WHERE state = 'pending' OR (state = 'leased' AND lease_expires < ?) "
+                             f"ORDER BY kind = 'convert', cost DESC, id LIMIT 1", (now,)).fetchone()
+            if row is None:
+                return None
+
+            db.execute("UPDATE tasks SET state = 'leased', attempts = attempts + 1, worker = ?, lease_expires = ? "
+                       "WHERE id = ?", (worker, now + lease_seconds, row[0]))
+
+        return Task(*row[:6], row[6] + 1, worker)
+
+    def _owned(self, task):
+        return "id = ? AND worker = ? AND attempts = ? AND state = 'leased'", (task.id, task.worker, task.attempts)
+
+    def heartbeat(self, task, lease_seconds) -> bool:
+        """
+        Renews the lease of a task.
+
+        :return: Whether the task is still leased by its worker. If not, the worker should abandon the task.
+        """
+        where, parameters = self._owned(task)
+        cursor = self.connection.execute(f'UPDATE tasks SET lease_expires = ? WHERE {where}',
+                                         (time.time() + lease_seconds,) + parameters)
+        return cursor.rowcount == 1
+
+    def complete(self, task) -> bool:
+        """
+        Marks a task as done. When the last shard of a document is done, a task that merges the shards is added.
+
+        :return: Whether the task was still leased by its worker
+        """
+        where, parameters = self._owned(task)
+
+        with self._transaction() as db:
+            if db.execute(f"UPDATE tasks SET state = 'done', worker = NULL, error = NULL WHERE {where}",
+                          parameters).rowcount != 1:
+                return False
+
+            if task.kind == 'convert' and task.shard_count > 1:
+                done = db.execute("SELECT count(*) FROM tasks WHERE document = ? AND kind = 'convert' "
+                                  "AND state = 'done'", (task.document,)).fetchone()[0]
+
+                if done == task.shard_count:
+                    payload = {'part_files': [get_part_file(task.payload['output_file'], shard)
+                                              for shard in range(task.shard_count)],
+                               'md5': task.payload['md5'],
+                               'output_file': task.payload['output_file']}
+                    db.execute("INSERT OR IGNORE INTO tasks (document, kind, shard, shard_count, cost, payload) "
+                               "VALUES (?, 'merge', 0, 1, 0, ?)", (task.document, json.dumps(payload)))
+
+        return True
+
+    def fail(self, task, error) -> bool:
+        """
+        Gives a task back after an error. It is claimed again, unless it has been tried max_attempts times.
+
+        :return: Whether the task was still leased by its worker
+        """
+        where, parameters = self._owned(task)
+        state = 'pending' if task.attempts < self.max_attempts else 'failed'
+
+        cursor = self.connection.execute(f'UPDATE tasks SET state = ?, worker = NULL, lease_expires = NULL, '
+                                         f'error = ? WHERE {where}', (state, str(error)) + parameters)
+        return cursor.rowcount == 1
+
+    def retry_failed(self) -> int:
+        """
+        Puts the failed tasks back in the queue, with their attempts reset.
+
+        :return: The number of tasks put back
+        """
+        cursor = self.connection.execute("UPDATE tasks SET state = 'pending', attempts = 0 WHERE state = 'failed'")
+        return cursor.rowcount
+
+    def counts(self) -> dict:
+        """
+        Returns the number of tasks in each state.
+        """
+        counts = dict.fromkeys(task_states, 0)
+        counts.update(self.connection.execute('SELECT state, count(*) FROM tasks GROUP BY state'))
+        return counts
+
+    def failures(self) -> list:
+        """
+        Returns a list of (document, kind, shard, attempts, error) of the failed tasks.
+        """
+        return self.connection.execute("SELECT document, kind, shard, attempts, error FROM tasks "
+                                       "WHERE state = 'failed' ORDER BY id").fetchall()
+
+
+class _Heartbeat(threading.Thread):
+    """
+    Renews the lease of a task every interval seconds while the task runs, on its own database connection.
+    """
+    def __init__(self, database, task, lease_seconds, interval):
+        super().__init__(daemon = True)
+        self.database = database
+        self.task = task
+        self.lease_seconds = lease_seconds
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.lost = threading.Event()
+
+    def run(self):
+        with WorkQueue(self.database) as work_queue:
+            while not self.stopped.wait(self.interval):
+                if not work_queue.heartbeat(self.task, self.lease_seconds):
+                    self.lost.set()
+                    return
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class QueueWorker(object):
+    """
+    Claims tasks from a WorkQueue and runs them, until the queue is empty. Run one worker per process; any number
+    of workers, on any number of hosts, can share the queue.
+
+    Results are published atomically: a worker writes the .eocr to a temporary file next to it, and renames it into
+    place only if it still holds the task's lease. A worker that loses its lease (e.g. because it was paused for
+    longer than the lease) abandons the task.
+
+    :param database: The file path of the queue's database
+    :param worker_id: Optional id of the worker (defaults to the host name, process id and a random suffix)
+    :param lease_seconds: The number of seconds a task is leased for. A dead worker's task is claimed again after
+                          at most this long.
+    :param heartbeat_interval: The number of seconds between lease renewals (defaults to a third of the lease)
+    :param max_attempts: See WorkQueue
+    :param memory_budget: See HOCRToEOCRConverter
+    :param spill_directory: See HOCRToEOCRConverter
+    """
+    def __init__(self, database, worker_id = None, lease_seconds = 60, heartbeat_interval = None, max_attempts = 3,
+                 memory_budget = None, spill_directory = None):
+        self.database = database
+        self.queue = WorkQueue(database, max_attempts = max_attempts)
+        self.worker_id = worker_id or f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self.lease_seconds = lease_seconds
+        self.heartbeat_interval = heartbeat_interval or lease_seconds / 3
+        self.converter = HOCRToEOCRConverter(memory_budget = memory_budget, spill_directory = spill_directory)
+
+    def consoleout(self, msg):
+        print(f'[{datetime.now()}] [{self.worker_id}] {msg}')
+
+    def run(self, wait = False, poll_interval = 5) -> int:
+        """
+        Runs tasks until there are none left to claim.
+
+        :param wait: Whether to keep polling while other workers still hold leases (whose tasks may be given back,
+                     or add merges), rather than returning as soon as there is nothing to claim
+        :param poll_interval: The number of seconds between polls while waiting
+        :return: The number of tasks completed by this worker
+        """
+        completed = 0
+
+        while True:
+            task = self.queue.claim(self.worker_id, self.lease_seconds)
+
+            if task is None:
+                if not wait or not self.queue.counts()['leased']:
+                    return completed
+                time.sleep(poll_interval)
+                continue
+
+            if self.run_task(task):
+                completed += 1
+
+    def run_task(self, task) -> bool:
+        """
+        Runs a claimed task, renewing its lease while it runs.
+
+        :return: Whether the task was completed
+        """
+        self.consoleout(f'Claimed {task} (attempt {task.attempts})')
+        heartbeat = _Heartbeat(self.database, task, self.lease_seconds, self.heartbeat_interval)
+        heartbeat.start()
+
+        try:
+            if task.kind == 'merge':
+                self._merge(task, heartbeat)
+            else:
+                self._convert(task, heartbeat)
+        except Exception as e:
+            heartbeat.stop()
+            self.consoleout(f'{task} failed: {e!r}')
+            self.queue.fail(task, repr(e))
+            return False
+
+        heartbeat.stop()
+
+        if not self.queue.complete(task):
+            self.consoleout(f'Lost the lease of {task}')
+            return False
+
+        if task.kind == 'merge':
+            for part_file in task.payload['part_files']:
+                if os.path.exists(part_file):
+                    os.remove(part_file)
+
+        self.consoleout(f'{task} done')
+        return True
+
+    def _convert(self, task, heartbeat):
+        converter = self.converter
+        converter.reset()
+        converter.set_hocr_manifest(task.payload['hocr_files'])
+        converter.set_document_md5(bytes.fromhex(task.payload['md5']))
+        converter.start()
+
+        output_file = task.payload.get('part_file', task.payload['output_file'])
+        self._publish(task, heartbeat, output_file, converter.export)
+        converter.reset()
+
+    def _merge(self, task, heartbeat):
+        parts = eocr_splice.concatenate(eocr_splice.load_eocr(part_file)
+                                        for part_file in task.payload['part_files'])
+        md5 = bytes.fromhex(task.payload['md5'])
+
+        self._publish(task, heartbeat, task.payload['output_file'],
+                      lambda temporary_file: eocr_splice.export(parts, temporary_file, md5))
+
+    def _publish(self, task, heartbeat, output_file, write):
+        """
+        Writes a result to a temporary file next to output_file, and renames it to output_file if the task is
+        still leased by this worker.
+
+        :param write: A function that writes the result to the file path it is given
+        """
+        temporary_file = f'{output_file}.{self.worker_id}.tmp'
+
+        try:
+            write(temporary_file)
+
+            with open(temporary_file, 'rb') as written:
+                os.fsync(written.fileno())
+
+            if heartbeat.lost.is_set() or not self.queue.heartbeat(task, self.lease_seconds):
+                raise Exception('Lost the lease before publishing')
+
+            os.replace(temporary_file, output_file)
+        finally:
+            if os.path.exists(temporary_file):
+                os.remove(temporary_file)
+
+
+def _work(database, lease_seconds, max_attempts, wait):
+    QueueWorker(database, lease_seconds = lease_seconds, max_attempts = max_attempts).run(wait = wait)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Converts documents from a work queue shared by several hosts')
+    parser.add_argument('database', help = 'The SQLite database of the queue, on the shared mount')
+    parser.add_argument('--max-attempts', type = int, default = 3,
+                        help = 'Number of times a task is tried before it is given up')
+    subparsers = parser.add_subparsers(dest = 'command', required = True)
+
+    add = subparsers.add_parser('add', help = 'Adds a document to the queue')
+    add.add_argument('name', help = 'The name of the document, unique in the queue')
+    add.add_argument('hocr', help = 'A folder of .hocr files or a manifest of them')
+    add.add_argument('md5', help = 'The md5 of the source file, as hex')
+    add.add_argument('output_file', help = 'The file path of the resultant .eocr')
+    add.add_argument('--shard-pages', type = int, help = 'Convert the document in shards of this many .hocr files')
+    add.add_argument('--shard-bytes', type = int,
+                     help = 'Convert the document in shards of .hocr files of about this many bytes')
+
+    work = subparsers.add_parser('work', help = 'Runs workers until the queue is empty')
+    work.add_argument('--lease', type = float, default = 60, help = 'Number of seconds a task is leased for')
+    work.add_argument('--workers', type = int, default = 1, help = 'Number of worker processes on this host')
+    work.add_argument('--wait', action = 'store_true',
+                      help = 'Keep polling while other workers hold tasks, instead of exiting')
+
+    subparsers.add_parser('status', help = 'Prints the number of tasks in each state, and the failures')
+    subparsers.add_parser('retry', help = 'Puts the failed tasks back in the queue')
+    args = parser.parse_args()
+
+    if args.command == 'work':
+        processes = [multiprocessing.Process(target = _work,
+                                             args = (args.database, args.lease, args.max_attempts, args.wait))
+                     for _ in range(args.workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        return
+
+    with WorkQueue(args.database, max_attempts = args.max_attempts) as work_queue:
+        if args.command == 'add':
+            added = work_queue.add_document(args.name, hocr_helper.list_hocr_files(args.hocr), args.md5,
+                                            args.output_file, shard_pages = args.shard_pages,
+                                            shard_bytes = args.shard_bytes)
+            print(f'Added {added} task(s)')
+        elif args.command == 'status':
+            print(json.dumps(work_queue.counts()))
+            for document, kind, shard, attempts, error in work_queue.failures():
+                print(f'{document} {kind} shard {shard}: failed after {attempts} attempt(s): {error}')
+        elif args.command == 'retry':
+            print(f'Put back {work_queue.retry_failed()} task(s)')
+
+
+if __name__ == '__main__':
+    main()
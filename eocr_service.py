@@ -0,0 +1,331 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# A local conversion service: a small HTTP server that keeps a pool of warm worker processes, so that each
+# conversion does not pay for starting Python and importing bs4/lxml/protobuf.
+#
+#   python3 eocr_service.py [--host 127.0.0.1] [--port 8080] [--unix-socket /tmp/eocr.sock] [--workers 4]
+#
+#   POST /convert?md5=<hex md5 of the source file>   body: one .hocr page, a multipart/form-data upload of
+#                                                    .hocr pages (in page order), or a zip/tar archive of them
+#   GET  /metrics                                    latency and throughput, as JSON
+#   GET  /health
+
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from email.parser import BytesParser
+from email import policy
+from urllib.parse import parse_qs, urlsplit
+import argparse
+import asyncio
+import gzip
+import io
+import json
+import os
+import tarfile
+import time
+import zipfile
+import zlib
+from datetime import datetime
+
+import eocr_helper
+import hocr_helper
+from HOCRToEOCRConverter import HOCRToEOCRConverter
+
+# The largest accepted upload, in bytes
+max_upload_size = 512 * 1024 * 1024
+
+# The number of recent requests that latency percentiles are computed over
+latency_window = 1000
+
+# The size of the chunks the .eocr is written back in
+response_chunk_size = 64 * 1024
+
+_warmup_hocr = b"""<html><body><div class='ocr_page' title='bbox 0 0 10 10'><p class='ocr_par' title='bbox 0 0 10 10'>
+<span class='ocr_line' title='bbox 0 0 10 10'><span class='ocrx_word' title='bbox 0 0 10 10; x_wconf 90'>a</span>
+</span></p></div></body></html>"""
+
+
+def _warm_up_worker():
+    """
+    Runs once in each worker process, so that the first request does not pay for the imports and caches.
+    """
+    convert_pages([('warmup.hocr', _warmup_hocr)], b'warmup')
+
+
+_converter = None
+
+
+def convert_pages(pages, md5):
+    """
+    Converts .hocr pages to .eocr content. Runs in a worker process, which reuses its converter: it is reset()
+    before every request so that nothing is shared between requests.
+
+    :param pages: A list of (file name, .hocr content), in page order
+    :param md5: The message digest of the source file
+    :return: A tuple of (.eocr content, number of pages, number of characters)
+    """
+    global _converter
+
+    if _converter is None:
+        _converter = HOCRToEOCRConverter()
+        _converter.consoleout = lambda msg: None
+
+    converter = _converter
+    converter.reset()
+    converter.set_document_md5(md5)
+
+    for hocr_filename, content in pages:
+        converter.convert_hocr_content(content, hocr_filename)
+
+    document = converter.zuva_document
+    return eocr_helper.get_eocr_file_content(document), len(document.pages), len(document.characters)
+
+
+def read_upload(content_type, body) -> list:
+    """
+    Reads the .hocr pages of an upload.
+
+    :param content_type: The Content-Type of the request
+    :param body: The request body
+    :return: A list of (file name, .hocr content), in page order
+    :raises ValueError: If the body is not a valid multipart upload or archive
+    """
+    content_type = content_type or ''
+    # The media type is case-insensitive, but its parameters (e.g. the multipart boundary) are not
+    media_type = content_type.split(';', 1)[0].strip().lower()
+
+    if media_type.startswith('multipart/'):
+        message = BytesParser(policy = policy.HTTP).parsebytes(
+            f'Content-Type: {content_type}\r\n\r\n'.encode() + body)
+        return [(part.get_filename() or f'page-{i}.hocr', part.get_payload(decode = True))
+                for i, part in enumerate(message.iter_parts())]
+
+    try:
+        # Either a compressed tar archive or a single compressed .hocr page
+        if body[:2] == b'\x1f\x8b':
+            body = gzip.decompress(body)
+            if body[257:262] != b'ustar':
+                return [('page.hocr', body)]
+
+        if body[:2] == b'PK' or body[257:262] == b'ustar' or media_type in ('application/zip', 'application/x-tar'):
+            return hocr_helper.read_archive(io.BytesIO(body))
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError, OSError, zlib.error) as e:
+        raise ValueError(f'The upload is not a valid archive ({e})')
+
+    return [('page.hocr', body)]
+
+
+def convert_upload(content_type, body, md5):
+    """
+    Reads the .hocr pages of an upload (see read_upload()) and converts them (see convert_pages()). Runs in a
+    worker process, so that the server does not parse large multipart bodies and archives itself.
+    """
+    pages = read_upload(content_type, body)
+    if not pages:
+        raise ValueError('The upload does not contain any .hocr')
+
+    return convert_pages(pages, md5)
+
+
+class Metrics(object):
+    def __init__(self):
+        self.started = time.monotonic()
+        self.requests = 0
+        self.failures = 0
+        self.in_flight = 0
+        self.pages = 0
+        self.characters = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.latencies = deque(maxlen = latency_window)
+
+    def record(self, latency, bytes_in, bytes_out = 0, pages = 0, characters = 0, failed = False):
+        self.requests += 1
+        self.failures += failed
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+        self.pages += pages
+        self.characters += characters
+        self.latencies.append(latency)
+
+    def to_dict(self) -> dict:
+        uptime = time.monotonic() - self.started
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] if latencies else None
+
+        return {'uptime_seconds': uptime,
+                'requests': self.requests,
+                'failures': self.failures,
+                'in_flight': self.in_flight,
+                'pages': self.pages,
+                'characters': self.characters,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'requests_per_second': self.requests / uptime if uptime else 0,
+                'pages_per_second': self.pages / uptime if uptime else 0,
+                'latency_seconds': {'p50': percentile(50),
+                                    'p95': percentile(95),
+                                    'p99': percentile(99),
+                                    'max': latencies[-1] if latencies else None}}
+
+
+class ConversionService(object):
+    """
+    :param workers: The number of worker processes
+    :param max_tasks_per_worker: Optional number of conversions after which a worker process is replaced
+    """
+    def __init__(self, workers = None, max_tasks_per_worker = None):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.metrics = Metrics()
+        self.pool = None
+
+    def consoleout(self, msg):
+        print(f'[{datetime.now()}] {msg}')
+
+    def start_pool(self):
+        kwargs = {'max_tasks_per_child': self.max_tasks_per_worker} if self.max_tasks_per_worker else {}
+        self.pool = ProcessPoolExecutor(max_workers = self.workers, initializer = _warm_up_worker, **kwargs)
+
+        # Start every worker now rather than on the first requests
+        for future in [self.pool.submit(os.getpid) for _ in range(self.workers)]:
+            future.result()
+
+    async def _respond(self, writer, status, content_type, body):
+        reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 411: 'Length Required',
+                   413: 'Payload Too Large', 500: 'Internal Server Error'}
+        writer.write(f'HTTP/1.1 {status} {reasons.get(status, "")}\r\n'
+                     f'Content-Type: {content_type}\r\n'
+                     f'Content-Length: {len(body)}\r\n'
+                     f'Connection: close\r\n\r\n'.encode())
+
+        for position in range(0, len(body), response_chunk_size):
+            writer.write(body[position:position + response_chunk_size])
+            await writer.drain()
+
+        await writer.drain()
+
+    async def _respond_json(self, writer, status, content):
+        await self._respond(writer, status, 'application/json', json.dumps(content).encode())
+
+    async def _convert(self, writer, query, headers, body):
+        md5 = query.get('md5', [headers.get('x-source-md5', '')])[0]
+
+        try:
+            md5 = bytes.fromhex(md5)
+        except ValueError:
+            md5 = b''
+        if not md5:
+            await self._respond_json(writer, 400, {'error': 'The md5 of the source file must be provided '
+                                                            '(md5 query parameter or X-Source-MD5 header)'})
+            return
+
+        started = time.monotonic()
+        self.metrics.in_flight += 1
+
+        try:
+            content, page_count, character_count = await asyncio.get_running_loop().run_in_executor(
+                self.pool, convert_upload, headers.get('content-type'), body, md5)
+        except Exception as e:
+            self.metrics.record(time.monotonic() - started, len(body), failed = True)
+            await self._respond_json(writer, 400 if isinstance(e, ValueError) else 500, {'error': str(e)})
+            return
+        finally:
+            self.metrics.in_flight -= 1
+
+        self.metrics.record(time.monotonic() - started, len(body), len(content), page_count, character_count)
+        await self._respond(writer, 200, 'application/octet-stream', content)
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1')
+                if line in ('\r\n', '\n', ''):
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            if len(request_line) < 2:
+                return
+
+            method, target = request_line[0], urlsplit(request_line[1])
+
+            if method == 'GET' and target.path == '/health':
+                await self._respond_json(writer, 200, {'status': 'ok', 'workers': self.workers})
+            elif method == 'GET' and target.path == '/metrics':
+                await self._respond_json(writer, 200, self.metrics.to_dict())
+            elif method == 'POST' and target.path == '/convert':
+                content_length = headers.get('content-length', '')
+
+                if 'content-length' not in headers:
+                    await self._respond_json(writer, 411, {'error': 'Content-Length is required'})
+                elif not content_length.isdigit() or not content_length.isascii():
+                    await self._respond_json(writer, 400, {'error': f'Invalid Content-Length {content_length!r}'})
+                elif int(content_length)>max_upload_size:
+                    await self._respond_json(writer, 413, {'error': 'The upload is too large'})
+                else:
+                    body = await reader.readexactly(int(content_length))
+                    await self._convert(writer, parse_qs(target.query), headers, body)
+            else:
+                await self._respond_json(writer, 404, {'error': f'{method} {target.path} is not supported'})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host = '127.0.0.1', port = 8080, unix_socket = None):
+        """
+        Starts the worker pool and serves requests until cancelled.
+        """
+        self.start_pool()
+
+        if unix_socket is not None:
+            server = await asyncio.start_unix_server(self.handle, path = unix_socket)
+            self.consoleout(f'Listening on {unix_socket} with {self.workers} worker(s)')
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+            self.consoleout(f'Listening on http://{host}:{port} with {self.workers} worker(s)')
+
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.pool.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Serves .hocr to .eocr conversions over HTTP')
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 8080)
+    parser.add_argument('--unix-socket', help = 'Listen on a Unix socket instead of host/port')
+    parser.add_argument('--workers', type = int, help = 'Number of worker processes')
+    parser.add_argument('--max-tasks-per-worker', type = int,
+                        help = 'Replace a worker process after this many conversions')
+    args = parser.parse_args()
+
+    service = ConversionService(workers = args.workers, max_tasks_per_worker = args.max_tasks_per_worker)
+    try:
+        asyncio.run(service.serve(args.host, args.port, args.unix_socket))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from array import array
+
+from recognition_results_pb2 import Document
+import eocr_helper
+import eocr_index
+
+_character_field = Document.DESCRIPTOR.fields_by_name['characters'].number
+
+# The repeated Document fields (other than pages) whose messages cover a CharacterRange
+range_layers = [f.name for f in Document.DESCRIPTOR.fields
+                if f.message_type is not None
+                and 'range' in f.message_type.fields_by_name
+                and f.name != 'pages']
+
+
+class DocumentParts(object):
+    """
+    An eOCR Document split into its characters, which are kept as serialized bytes, and everything else.
+    Splicing only re-bases the small messages (pages, layers, tables) and copies the character bytes as-is.
+
+    :param characters: The serialized characters, as they appear in a serialized Document
+    :param offsets: The position of each character in `characters`, followed by len(characters)
+    :param document: A Document with everything but the characters (version, pages, layers, tables, md5)
+    """
+    def __init__(self, characters: bytes, offsets: array, document: Document):
+        self.characters = characters
+        self.offsets = offsets
+        self.document = document
+
+    @property
+    def character_count(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def page_count(self) -> int:
+        return len(self.document.pages)
+
+
+def _character_offsets(characters, base = 0) -> array:
+    offsets = array('Q')
+    for _, start, _ in eocr_index.iter_fields(characters):
+        offsets.append(start - base)
+    offsets.append(len(characters) - base)
+    return offsets
+
+
+def split_document(serialized: bytes) -> DocumentParts:
+    """
+    Splits a serialized eOCR Document without parsing its characters.
+
+    :param serialized: The serialized (uncompressed) Document
+    :return: DocumentParts
+    """
+    characters = []
+    others = []
+
+    for field_number, start, end in eocr_index.iter_fields(serialized):
+        if field_number == _character_field:
+            # Characters are written contiguously, so consecutive fields are merged into one slice
+            if characters and characters[-1][1] == start:
+                characters[-1][1] = end
+            else:
+                characters.append([start, end])
+        else:
+            others.append(serialized[start:end])
+
+    block = b''.join(serialized[start:end] for start, end in characters)
+    return DocumentParts(block, _character_offsets(block), Document.FromString(b''.join(others)))
+
+
+def load_eocr(eocr_file) -> DocumentParts:
+    """
+    Reads an eOCR file as DocumentParts.
+
+    :param eocr_file: The file path of the eOCR file
+    """
+    return split_document(eocr_helper.read_eocr_file(eocr_file))
+
+
+def read_page_range(reader: eocr_index.EOCRReader, start, end) -> DocumentParts:
+    """
+    Reads pages[start:end] from an indexed eOCR file, inflating only the part of the body that holds them.
+    The index only records pages, so optional layers (fonts, headers, tables, ...) are not carried over.
+
+    :param reader: An eocr_index.EOCRReader
+    :param start: The 0-based number of the first page
+    :param end: The 0-based number after the last page
+    :return: DocumentParts
+    """
+    entries = reader.index.pages[start:end]
+    if not entries:
+        raise Exception(f'Page range {start}:{end} is empty')
+
+    characters = reader.read_uncompressed(entries[0].wire_start, entries[-1].wire_end)
+    base = entries[0].page.range.start
+
+    document = eocr_helper.new_document()
+    for entry in entries:
+        page = document.pages.add()
+        page.CopyFrom(entry.page)
+        page.range.start -= base
+        page.range.end -= base
+
+    return DocumentParts(characters, _character_offsets(characters), document)
+
+
+def _copy_layers(source: Document, target: Document, start, end, shift):
+    """
+    Copies the range layers that overlap characters [start, end) of source, clipped and moved by shift.
+    """
+    for name in range_layers:
+        target_layer = getattr(target, name)
+
+        for item in getattr(source, name):
+            if item.range.end <= start or item.range.start >= end:
+                continue
+
+            new_item = target_layer.add()
+            new_item.CopyFrom(item)
+            new_item.range.start = max(item.range.start, start) + shift
+            new_item.range.end = min(item.range.end, end) + shift
+
+
+def _copy_tables(source: Document, target: Document, page_start, page_end, page_shift, id_shift):
+    """
+    Copies the tables on pages [page_start, page_end) of source (and their cells), moved by page_shift.
+    """
+    table_ids = set()
+
+    for table in source.tables:
+        if page_start<=table.page_number<page_end:
+            table_ids.add(table.id)
+            target.tables.add(id = table.id + id_shift, page_number = table.page_number + page_shift)
+
+    for cell in source.table_cells:
+        if cell.id in table_ids:
+            new_cell = target.table_cells.add()
+            new_cell.CopyFrom(cell)
+            new_cell.id += id_shift
+
+
+def slice_pages(parts: DocumentParts, start, end) -> DocumentParts:
+    """
+    Slices pages[start:end] out of a document. Page ranges and all other layers are re-based on the first
+    character of the first page that is kept.
+
+    :param parts: The DocumentParts to slice
+    :param start: The 0-based number of the first page
+    :param end: The 0-based number after the last page
+    :return: DocumentParts
+    """
+    pages = parts.document.pages[start:end]
+    if not pages:
+        raise Exception(f'Page range {start}:{end} is empty')
+
+    character_start = pages[0].range.start
+    character_end = pages[-1].range.end
+
+    document = eocr_helper.new_document(version = parts.document.version)
+    document.md5 = parts.document.md5
+
+    for page in pages:
+        new_page = document.pages.add()
+        new_page.CopyFrom(page)
+        new_page.range.start -= character_start
+        new_page.range.end -= character_start
+
+    _copy_layers(parts.document, document, character_start, character_end, -character_start)
+    _copy_tables(parts.document, document, start, start + len(pages), -start, 0)
+
+    byte_start = parts.offsets[character_start]
+    byte_end = parts.offsets[character_end]
+    offsets = array('Q', (o - byte_start for o in parts.offsets[character_start:character_end + 1]))
+
+    return DocumentParts(parts.characters[byte_start:byte_end], offsets, document)
+
+
+def concatenate(documents) -> DocumentParts:
+    """
+    Concatenates several documents into one. Character ranges, page numbers and table ids of each document are
+    moved past the ones of the documents before it.
+
+    :param documents: An iterable of DocumentParts, in order
+    :return: DocumentParts
+    """
+    document = None
+    characters = []
+    offsets = array('Q')
+    character_shift = 0
+    byte_shift = 0
+    page_shift = 0
+    id_shift = 0
+
+    for parts in documents:
+        if document is None:
+            document = eocr_helper.new_document(version = parts.document.version)
+            document.md5 = parts.document.md5
+
+        for page in parts.document.pages:
+            new_page = document.pages.add()
+            new_page.CopyFrom(page)
+            new_page.range.start += character_shift
+            new_page.range.end += character_shift
+
+        _copy_layers(parts.document, document, 0, parts.character_count, character_shift)
+        _copy_tables(parts.document, document, 0, parts.page_count, page_shift, id_shift)
+
+        characters.append(parts.characters)
+        offsets.extend(o + byte_shift for o in parts.offsets[:-1])
+
+        character_shift += parts.character_count
+        byte_shift += len(parts.characters)
+        page_shift += parts.page_count
+        id_shift = max([id_shift] + [t.id + 1 for t in document.tables])
+
+    if document is None:
+        raise Exception('No documents to concatenate')
+
+    offsets.append(byte_shift)
+    return DocumentParts(b''.join(characters), offsets, document)
+
+
+def to_serialized(parts: DocumentParts, md5 = None) -> bytes:
+    """
+    Serializes DocumentParts, in the same field order as a serialized eOCR Document.
+
+    :param parts: The DocumentParts to serialize
+    :param md5: The message digest of the new source file. Defaults to the md5 already in the document.
+    :return: The serialized (uncompressed) Document
+    """
+    head = eocr_helper.new_document(version = parts.document.version)
+    tail = Document()
+    tail.CopyFrom(parts.document)
+    tail.version = 0
+
+    if md5 is not None:
+        tail.md5 = md5
+
+    if not tail.md5:
+        raise Exception('source_hash must be provided (use the md5 parameter)')
+
+    return head.SerializeToString() + parts.characters + tail.SerializeToString()
+
+
+def export(parts: DocumentParts, output_file, md5 = None):
+    """
+    Writes DocumentParts as an eOCR file.
+
+    :param parts: The DocumentParts to write
+    :param output_file: The file path (including file name) of the resultant .eocr
+    :param md5: The message digest of the new source file. Defaults to the md5 already in the document.
+    """
+    content = eocr_helper.get_eocr_file_content_from_bytes(to_serialized(parts, md5))
+
+    with open(output_file, "wb") as output:
+        output.write(content)
@@ -0,0 +1,173 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# The hOCR structure of a converted document (its words, lines, paragraphs and pages) as character offsets, which
+# the eOCR format does not keep. It is recorded by HOCRToEOCRConverter while it converts, and can be saved as a
+# sidecar file next to the .eocr.
+
+
+from array import array
+from bisect import bisect_left, bisect_right
+import struct
+import sys
+
+# The header of a structure (sidecar) file
+structure_header = b'eocrs 1\n'
+
+# The levels of the structure, from the smallest to the largest
+levels = ('words', 'lines', 'paragraphs', 'pages')
+
+_typecode = 'I'
+_count_struct = struct.Struct('<IIII')
+
+
+class StructureIndex(object):
+    """
+    The start and end (excluded) character offsets of the words, lines, paragraphs and pages of a document, in
+    document order. A line runs from the start of its first word to the end of its last word (without the spaces
+    the converter adds around it), and likewise for paragraphs; pages are their Page.range. Each line, paragraph and
+    page also records the index of its first word, line or paragraph.
+
+    Finding what contains an offset is a binary search; a unit's span and its children are read directly.
+    """
+    def __init__(self):
+        self.starts = {level: array(_typecode) for level in levels}
+        self.ends = {level: array(_typecode) for level in levels}
+        self.first_child = {level: array(_typecode) for level in levels[1:]}
+
+    def count(self, level) -> int:
+        return len(self.starts[level])
+
+    def clear(self):
+        for columns in (self.starts, self.ends, self.first_child):
+            for column in columns.values():
+                del column[:]
+
+    def add(self, level, start, end):
+        """
+        Adds a unit after the ones of its level. Its children must have been added before it.
+        """
+        self.starts[level].append(start)
+        self.ends[level].append(end)
+
+        if level != levels[0]:
+            child_level = levels[levels.index(level) - 1]
+            self.first_child[level].append(bisect_left(self.starts[child_level], start))
+
+    def extend(self, other, offset = 0):
+        """
+        Adds the units of another StructureIndex (e.g. the one of a page) after the ones of this index.
+
+        :param offset: The number of characters to move the other index's units by
+        """
+        for i, level in enumerate(levels):
+            self.starts[level].extend(array(_typecode, [start + offset for start in other.starts[level]]))
+            self.ends[level].extend(array(_typecode, [end + offset for end in other.ends[level]]))
+
+            if i:
+                shift = self.count(levels[i - 1]) - other.count(levels[i - 1])
+                self.first_child[level].extend(array(_typecode, [first + shift
+                                                                 for first in other.first_child[level]]))
+
+    def find(self, level, offset):
+        """
+        Returns the index of the unit (of level) that contains a character offset, or None if the offset is not in
+        any (e.g. a space between two words).
+        """
+        i = bisect_right(self.starts[level], offset) - 1
+        return i if i >= 0 and offset < self.ends[level][i] else None
+
+    def span(self, level, index) -> tuple:
+        """
+        Returns the (start, end) character offsets of a unit.
+        """
+        return self.starts[level][index], self.ends[level][index]
+
+    def children(self, level, index) -> range:
+        """
+        Returns the indexes of the units one level down (e.g. the words of a line) that make up a unit.
+        """
+        child_level = levels[levels.index(level) - 1]
+        first = self.first_child[level]
+        return range(first[index], first[index + 1] if index + 1 < len(first) else self.count(child_level))
+
+    def parent(self, level, index) -> int:
+        """
+        Returns the index of the unit one level up (e.g. the line of a word) that a unit is part of.
+        """
+        parent_level = levels[levels.index(level) + 1]
+        return bisect_right(self.first_child[parent_level], index) - 1
+
+    def expand(self, start, end, level = 'lines'):
+        """
+        Expands a span of characters (end excluded) to the whole units of level it overlaps, e.g. an extraction span
+        to the lines it is on.
+
+        :return: A tuple of (start, end), or None if the span does not overlap any unit of level
+        """
+        first = bisect_right(self.ends[level], start)
+        last = bisect_left(self.starts[level], max(end, start + 1)) - 1
+
+        if first > last:
+            return None
+
+        return self.starts[level][first], self.ends[level][last]
+
+    def to_bytes(self) -> bytes:
+        columns = []
+        for level in levels:
+            columns.extend([self.starts[level], self.ends[level]])
+            if level != levels[0]:
+                columns.append(self.first_child[level])
+
+        if sys.byteorder == 'big':
+            columns = [array(_typecode, column) for column in columns]
+            for column in columns:
+                column.byteswap()
+
+        return structure_header + _count_struct.pack(*[self.count(level) for level in levels]) + \
+            b''.join(column.tobytes() for column in columns)
+
+    @classmethod
+    def from_bytes(cls, content):
+        if not content.startswith(structure_header):
+            raise Exception('The content is not an eOCR structure file (missing header)')
+
+        index = cls()
+        position = len(structure_header)
+        counts = _count_struct.unpack_from(content, position)
+        position += _count_struct.size
+
+        for level, count in zip(levels, counts):
+            columns = [index.starts[level], index.ends[level]]
+            if level != levels[0]:
+                columns.append(index.first_child[level])
+
+            for column in columns:
+                size = count * column.itemsize
+                column.frombytes(content[position:position + size])
+                if sys.byteorder == 'big':
+                    column.byteswap()
+                position += size
+
+        return index
+
+    def write(self, structure_file):
+        with open(structure_file, 'wb') as output:
+            output.write(self.to_bytes())
+
+    @classmethod
+    def read(cls, structure_file):
+        with open(structure_file, 'rb') as structure:
+            return cls.from_bytes(structure.read())
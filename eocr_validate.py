@@ -0,0 +1,284 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Checks converted documents (or .eocr files) for the problems that make Zuva reject an .eocr, before it is
+# uploaded. The character checks run over whole columns at a time (with numpy when it is installed):
+#
+#   python3 eocr_validate.py <document.eocr> [<document.eocr> ...]
+
+
+from array import array
+from bisect import bisect_right
+from itertools import compress, count
+from operator import gt
+import argparse
+import gzip
+import hashlib
+import sys
+import zlib
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import eocr_buffer
+import eocr_helper
+import eocr_splice
+
+# The highest valid Character.error
+max_error = 100
+
+
+class ValidationIssue(object):
+    """
+    :param check: The name of the check that failed (e.g. 'page_range', 'bounding_box')
+    :param message: A description of the problem
+    :param page: The 0-based page number the problem is on, if any
+    :param position: The index of the (first) character the problem is about, if any
+    """
+    def __init__(self, check, message, page = None, position = None):
+        self.check = check
+        self.message = message
+        self.page = page
+        self.position = position
+
+    def __str__(self):
+        location = f'page {self.page}: ' if self.page is not None else ''
+        return f'[{self.check}] {location}{self.message}'
+
+
+class ValidationError(Exception):
+    def __init__(self, issues):
+        super().__init__(f'{len(issues)} validation issue(s): ' + '; '.join(str(issue) for issue in issues[:5]))
+        self.issues = issues
+
+
+class _Columns(object):
+    """
+    The column operations the checks need, on numpy arrays (without copying the columns) when numpy is installed,
+    and on the array.array columns with builtins otherwise.
+    """
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.length = len(buffer)
+
+        if numpy is not None:
+            self.values = {name: numpy.frombuffer(getattr(buffer, name), dtype = getattr(buffer, name).typecode)
+                           for name in eocr_buffer.columns}
+        else:
+            self.values = {name: getattr(buffer, name) for name in eocr_buffer.columns}
+
+    def count_greater(self, a, b) -> tuple:
+        """
+        Returns the number of characters where column a is greater than column b (or than the value b), and the
+        index of the first one.
+        """
+        a = self.values[a]
+        b = self.values[b] if isinstance(b, str) else b
+
+        if numpy is not None:
+            positions = numpy.flatnonzero(a > b)
+            return len(positions), int(positions[0]) if len(positions) else None
+
+        if isinstance(b, int):
+            if not a or max(a) <= b:
+                return 0, None
+            positions = [i for i, value in enumerate(a) if value > b]
+        else:
+            positions = list(compress(count(), map(gt, a, b)))
+        return len(positions), positions[0] if positions else None
+
+    def max(self, name, start, end) -> int:
+        if start >= end:
+            return 0
+        return int(self.values[name][start:end].max()) if numpy is not None else max(self.values[name][start:end])
+
+
+def _check_pages(pages, character_count, issues):
+    position = 0
+
+    for page_number, page in enumerate(pages):
+        start, end = page.range.start, page.range.end
+
+        if start != position:
+            issues.append(ValidationIssue('page_range', f'starts at character {start}, but the previous page ends '
+                                                        f'at {position}', page_number, start))
+        if end < start:
+            issues.append(ValidationIssue('page_range', f'ends ({end}) before it starts ({start})', page_number,
+                                          start))
+        if page.width <= 0 or page.height <= 0:
+            issues.append(ValidationIssue('page_size', f'has no size ({page.width}x{page.height})', page_number))
+
+        position = max(position, end)
+
+    if position != character_count:
+        issues.append(ValidationIssue('page_range', f'the pages cover {position} character(s), but the document '
+                                                    f'has {character_count}'))
+
+
+def _get_unpaired_surrogates(units) -> list:
+    """
+    Returns the index of every UTF-16 surrogate that is not part of a (high, low) pair.
+    """
+    if numpy is not None:
+        values = numpy.frombuffer(units, dtype = units.typecode)
+        high = (values >= 0xd800) & (values < 0xdc00)
+        low = (values >= 0xdc00) & (values < 0xe000)
+        paired = numpy.zeros(len(values), dtype = bool)
+        paired[:-1] = high[:-1] & low[1:]
+        paired[1:] |= paired[:-1] & high[:-1]
+        return numpy.flatnonzero((high | low) & ~paired).tolist()
+
+    content = units.tobytes()
+    if sys.byteorder == 'big':
+        swapped = array(units.typecode, units)
+        swapped.byteswap()
+        content = swapped.tobytes()
+
+    # Each decoding error is an unpaired surrogate; the decoding goes on after it
+    positions = []
+    start = 0
+    while True:
+        try:
+            content[start:].decode('utf-16-le')
+            return positions
+        except UnicodeDecodeError as e:
+            positions.append((start + e.start) // 2)
+            start += e.end
+
+
+def _check_utf16(units, offset, issues):
+    for position in _get_unpaired_surrogates(units):
+        issues.append(ValidationIssue('unicode', f'unpaired UTF-16 surrogate {units[position]:#06x}',
+                                      position = offset + position))
+
+
+def _check_characters(pages, buffers, issues):
+    page_starts = [page.range.start for page in pages]
+    offset = 0
+
+    for buffer in buffers:
+        columns = _Columns(buffer)
+        end = offset + columns.length
+
+        _check_utf16(buffer.unicode, offset, issues)
+
+        for check, a, b, message in (('error', 'error', max_error, f'error is over {max_error}'),
+                                     ('bounding_box', 'x1', 'x2', 'x1 is greater than x2'),
+                                     ('bounding_box', 'y1', 'y2', 'y1 is greater than y2')):
+            violations, first = columns.count_greater(a, b)
+            if violations:
+                issues.append(ValidationIssue(check, f'{message} for {violations} character(s)',
+                                              position = offset + first))
+
+        # The boxes of each page (or part of a page) in this buffer must be inside the page
+        page_number = max(0, bisect_right(page_starts, offset) - 1)
+        while page_number < len(pages) and pages[page_number].range.start < end:
+            page = pages[page_number]
+            start = max(page.range.start, offset) - offset
+            stop = min(page.range.end, end) - offset
+
+            for name, limit in (('x2', page.width), ('y2', page.height)):
+                highest = columns.max(name, start, stop)
+                if highest > limit:
+                    issues.append(ValidationIssue('bounding_box', f'a character box ends at {name}={highest}, outside '
+                                                                  f'of the page ({page.width}x{page.height})',
+                                                  page_number))
+            page_number += 1
+
+        offset = end
+
+
+def _validate(document, character_count, buffers) -> list:
+    issues = []
+
+    if not document.md5:
+        issues.append(ValidationIssue('md5', 'the md5 of the source file is not set'))
+
+    _check_pages(document.pages, character_count, issues)
+    _check_characters(document.pages, buffers, issues)
+
+    return issues
+
+
+def validate_document(zuva_document) -> list:
+    """
+    Checks a converted document: its md5, that its pages cover the characters contiguously, and that its
+    characters have valid UTF-16 code units (every unpaired surrogate is reported), errors and bounding boxes
+    (inside their page).
+
+    :param zuva_document: A HOCRToEOCRConverter's zuva_document, or an eOCR Document
+    :return: A list of ValidationIssue (empty if the document is valid)
+    """
+    return _validate(zuva_document, len(zuva_document.characters), eocr_buffer.iter_document_buffers(zuva_document))
+
+
+def validate_eocr_content(content) -> list:
+    """
+    Checks the byte-content of an .eocr file: its header, the digest of its body, that the body decompresses and
+    parses, and then the document itself (see validate_document()). The characters are decoded straight into a
+    CharacterBuffer, without parsing them as Character messages.
+
+    :return: A list of ValidationIssue (empty if the file is valid)
+    """
+    header_length = len(eocr_helper.eocr_header)
+
+    if content[:header_length] != eocr_helper.eocr_header:
+        return [ValidationIssue('header', f'the file does not start with {eocr_helper.eocr_header!r}')]
+
+    digest, body = content[header_length:header_length + 20], content[header_length + 20:]
+    if hashlib.sha1(body).digest() != digest:
+        return [ValidationIssue('digest', 'the sha1 digest does not match the body')]
+
+    try:
+        serialized = gzip.decompress(body)
+    except (OSError, EOFError, zlib.error) as e:
+        return [ValidationIssue('body', f'the body cannot be decompressed ({e})')]
+
+    try:
+        parts = eocr_splice.split_document(serialized)
+        characters = eocr_buffer.CharacterBuffer.from_serialized(parts.characters)
+    except Exception as e:
+        return [ValidationIssue('body', f'the body is not an eOCR Document ({e})')]
+
+    return _validate(parts.document, len(characters), [characters])
+
+
+def validate_eocr_file(eocr_file) -> list:
+    """
+    Checks an .eocr file (see validate_eocr_content()).
+    """
+    with open(eocr_file, 'rb') as eocr:
+        return validate_eocr_content(eocr.read())
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Checks .eocr files before they are uploaded')
+    parser.add_argument('eocr_files', nargs = '+')
+    args = parser.parse_args()
+
+    invalid = 0
+    for eocr_file in args.eocr_files:
+        issues = validate_eocr_file(eocr_file)
+        invalid += bool(issues)
+        print(f'{eocr_file}: {"valid" if not issues else f"{len(issues)} issue(s)"}')
+        for issue in issues:
+            print(f'    {issue}')
+
+    sys.exit(1 if invalid else 0)
+
+
+if __name__ == '__main__':
+    main()
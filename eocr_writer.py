@@ -0,0 +1,217 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import struct
+import zlib
+
+from recognition_results_pb2 import Document
+import eocr_buffer
+import eocr_helper
+
+
+# The number of uncompressed bytes each thread compresses at a time, when the body is compressed in parallel
+parallel_block_size = 1024 * 1024
+
+# The size of the deflate window: each block is compressed with the end of the previous block as its dictionary
+_window_size = 32 * 1024
+
+
+def _deflate_block(data, dictionary, last):
+    """
+    Compresses a block of the body as raw deflate. Blocks other than the last end with a sync flush, so that the
+    compressed blocks can be concatenated into one deflate stream (like pigz).
+    """
+    if dictionary:
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS, zdict = dictionary)
+    else:
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+class EOCRWriter(object):
+    """
+    Writes an eOCR file incrementally: the characters are compressed and written as they are added, and only
+    the (small) page and layer records are kept until the file is closed. The file is the same as the one written by
+    eocr_helper.get_eocr_file_content() for the same Document. It is written to output_file.tmp, and only renamed to
+    output_file once it is complete, so an error part way (or discard()) leaves output_file as it was.
+
+    :param output_file: The file path (including file name) of the resultant .eocr
+    :param md5: The message digest of the source file
+    :param version: The version of the protobuf schema used
+    :param workers: Optional number of threads that compress the body in parallel (zlib releases the GIL), in
+                    blocks of parallel_block_size bytes, while this thread hashes and writes the compressed blocks in
+                    order. The file is a valid .eocr with the same Document, but not byte-identical to the one
+                    written without workers.
+    """
+    def __init__(self, output_file, md5, version: int = eocr_helper.proto_version, workers = None):
+        self.md5 = md5
+        self.pages = []
+        self.layers = {name: [] for name in eocr_buffer.layers}
+        self.character_count = 0
+        self._compressor = eocr_helper.new_body_compressor()
+        self._sha1 = hashlib.sha1()
+        self.output_file = output_file
+        self._temporary_file = f'{output_file}.tmp'
+        self._output = open(self._temporary_file, 'wb')
+        self.workers = workers
+        self._pool = ThreadPoolExecutor(max_workers = workers) if workers else None
+        self._pending = deque()
+        self._block = bytearray()
+        self._dictionary = b''
+        self._crc = 0
+        self._size = 0
+
+        # The digest of the body is only known once the body is written, so it is filled in by close()
+        self._output.write(eocr_helper.eocr_header + bytes(20))
+
+        if self._pool is not None:
+            # The same gzip header as the one of the serial compressor
+            self._write_body(self._compressor.flush()[:10])
+
+        self._write(Document(version = version).SerializeToString())
+
+    def _write_body(self, body):
+        if body:
+            self._sha1.update(body)
+            self._output.write(body)
+
+    def _write(self, serialized):
+        if self._pool is None:
+            self._write_body(self._compressor.compress(serialized))
+            return
+
+        self._block += serialized
+        while len(self._block) >= parallel_block_size:
+            self._submit_block(bytes(self._block[:parallel_block_size]))
+            del self._block[:parallel_block_size]
+
+    def _submit_block(self, data, last = False):
+        """
+        Hands a block to the compression threads, and writes the blocks that are compressed (in order) once too many
+        are pending.
+        """
+        self._crc = zlib.crc32(data, self._crc)
+        self._size += len(data)
+        self._pending.append(self._pool.submit(_deflate_block, data, self._dictionary, last))
+        self._dictionary = data[-_window_size:]
+
+        while len(self._pending) > 2 * self.workers or (last and self._pending):
+            self._write_body(self._pending.popleft().result())
+
+    @property
+    def page_count(self) -> int:
+        return len(self.pages)
+
+    def write_characters(self, serialized, count):
+        """
+        Writes already serialized characters (see eocr_buffer.CharacterBuffer.serialize()).
+
+        :param serialized: The serialized characters
+        :param count: The number of characters
+        """
+        self._write(serialized)
+        self.character_count += count
+
+    def write_page(self, characters, page, layers = None):
+        """
+        Writes a page and its characters.
+
+        :param characters: The page's eocr_buffer.CharacterBuffer
+        :param page: The eOCR Page. Its range must start at the number of characters written so far.
+        :param layers: Optional dict of the page's layers (e.g. {'font_sizes': [FontSize, ...]})
+        """
+        if page.range.start != self.character_count:
+            raise Exception(f'The page starts at character {page.range.start}, '
+                            f'but {self.character_count} character(s) were written')
+
+        self.write_characters(characters.serialize(), len(characters))
+        self.pages.append(page)
+
+        for name, items in (layers or {}).items():
+            self.layers[name].extend(items)
+
+    def write_document(self, zuva_document):
+        """
+        Writes the characters and pages of an eocr_buffer.DocumentView, one CharacterBuffer at a time
+        (characters that were spilled to disk are read back one chunk at a time).
+        """
+        for buffer in zuva_document.characters.iter_buffers():
+            self.write_characters(buffer.serialize(), len(buffer))
+
+        self.pages.extend(zuva_document.pages)
+
+        for name in eocr_buffer.layers:
+            self.layers[name].extend(getattr(zuva_document, name))
+
+    def write_page_block(self, block):
+        """
+        Writes a converted page (see HOCRToEOCRConverter.iter_pages()).
+        """
+        self.write_page(block.characters, block.page, block.layers)
+
+    def close(self):
+        """
+        Writes the pages, layers and digest, and renames the complete file to output_file.
+        """
+        if self._output.closed:
+            return
+
+        try:
+            tail = Document(md5 = self.md5)
+            tail.pages.extend(self.pages)
+            for name in eocr_buffer.layers:
+                getattr(tail, name).extend(self.layers[name])
+            self._write(tail.SerializeToString())
+
+            if self._pool is None:
+                self._write_body(self._compressor.flush())
+            else:
+                self._submit_block(bytes(self._block), last = True)
+                self._write_body(struct.pack('<II', self._crc, self._size & 0xffffffff))
+                self._pool.shutdown()
+
+            self._output.seek(len(eocr_helper.eocr_header))
+            self._output.write(self._sha1.digest())
+            self._output.close()
+        except BaseException:
+            self.discard()
+            raise
+
+        os.replace(self._temporary_file, self.output_file)
+
+    def discard(self):
+        """
+        Stops writing and deletes the incomplete file, without touching output_file.
+        """
+        self._output.close()
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures = True)
+        if os.path.exists(self._temporary_file):
+            os.remove(self._temporary_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.discard()
+            return
+
+        self.close()
@@ -13,23 +13,171 @@
 # limitations under the License.
 
 
+import gzip
+import json
+import os
 import re
+import tarfile
+import threading
+import zipfile
 import bs4
 from bs4 import BeautifulSoup as bs
+from bs4.builder import builder_registry
+
+
+# The extensions of HOCR files: plain, or compressed on their own with gzip
+hocr_extensions = ('.hocr', '.hocr.gz')
+
+# The classes of the HOCR lines that are converted with header_lines (see HOCRToEOCRConverter): ocr_line, and the
+# lines tesseract marks as headers and footers (which have the same content as an ocr_line)
+line_classes = ['ocr_line', 'ocr_header', 'ocr_footer']
+
+# The tree builders are cached per thread: a builder keeps the state of the document it is parsing
+_tree_builders = threading.local()
+
+
+def get_tree_builder():
+    """
+    Returns the (cached) lxml tree builder of the current thread, so that it is not looked up and created again for
+    every HOCR file
+    """
+    tree_builder = getattr(_tree_builders, 'builder', None)
+
+    if tree_builder is None:
+        tree_builder = _tree_builders.builder = builder_registry.lookup('lxml')()
+
+    return tree_builder
 
 
 def to_bs4(hocr) -> bs4.BeautifulSoup:
     """
-    Opens an HOCR file and returns its contents as BeautifulSoup
+    Opens an HOCR file (.hocr or .hocr.gz) and returns its contents as BeautifulSoup
     """
-    with open(hocr) as hocr_document:
+    opener = gzip.open if os.fspath(hocr).endswith('.gz') else open
+
+    with opener(hocr, 'rt') as hocr_document:
         lines = hocr_document.readlines()
         lines = "".join(lines)
-        hocr_soup = bs(lines, 'lxml')
+        hocr_soup = bs(lines, builder = get_tree_builder())
 
     return hocr_soup
 
 
+def content_to_bs4(content) -> bs4.BeautifulSoup:
+    """
+    Returns HOCR content (str or bytes) that is already in memory as BeautifulSoup
+    """
+    return bs(content, builder = get_tree_builder())
+
+
+def is_hocr_file(filename) -> bool:
+    """
+    Checks whether a file name is the name of an HOCR file (.hocr or .hocr.gz)
+    """
+    return os.fspath(filename).endswith(hocr_extensions)
+
+
+def _decompress_member(name, content) -> bytes:
+    return gzip.decompress(content) if name.endswith('.gz') else content
+
+
+def iter_archive(archive):
+    """
+    Reads the HOCR files (.hocr or .hocr.gz) of a zip or tar (optionally compressed) archive, in natural (page)
+    order. The members are read one at a time, in memory: nothing is extracted to disk.
+
+    :param archive: The file path of the archive, or a binary file object
+    :return: Yields a tuple of (file name, HOCR content as bytes)
+    """
+    if zipfile.is_zipfile(archive):
+        with zipfile.ZipFile(archive) as zip_archive:
+            names = sorted((name for name in zip_archive.namelist() if is_hocr_file(name)), key = natural_sort_key)
+            for name in names:
+                yield name, _decompress_member(name, zip_archive.read(name))
+        return
+
+    if hasattr(archive, 'seek'):
+        archive.seek(0)
+        tar_archive = tarfile.open(fileobj = archive)
+    else:
+        tar_archive = tarfile.open(archive)
+
+    with tar_archive:
+        # Listing the members only reads their headers. When the members are stored in page order (the usual
+        # case), reading them in that order goes through a compressed tar once, without seeking back.
+        members = sorted((member for member in tar_archive.getmembers()
+                          if member.isfile() and is_hocr_file(member.name)),
+                         key = lambda member:natural_sort_key(member.name))
+        for member in members:
+            yield member.name, _decompress_member(member.name, tar_archive.extractfile(member).read())
+
+
+def read_archive(archive) -> list:
+    """
+    Reads the HOCR files of a zip or tar (optionally compressed) archive, in natural (page) order.
+
+    :param archive: The file path of the archive, or a binary file object
+    :return: A list of (file name, HOCR content as bytes)
+    """
+    return list(iter_archive(archive))
+
+
+def is_complete(hocr) -> bool:
+    """
+    Checks whether an HOCR file has been completely written (i.e. it ends with the closing html tag).
+    """
+    with open(hocr, 'rb') as hocr_document:
+        hocr_document.seek(0, 2)
+        size = hocr_document.tell()
+        hocr_document.seek(max(0, size - 64))
+        return hocr_document.read().rstrip().endswith(b'</html>')
+
+
+def get_page_number(filename) -> int:
+    """
+    Returns the page number of an HOCR file name, i.e. its last number (e.g. 12 for doc2-page-0012.hocr)
+    """
+    return int(re.findall(r'[0-9]+', filename)[-1])
+
+
+def natural_sort_key(filename) -> tuple:
+    """
+    Returns a key that sorts file names by their text and numbers (e.g. doc2-page-9.hocr before doc2-page-10.hocr)
+    """
+    return tuple(int(part) if part.isdigit() else part for part in re.split(r'([0-9]+)', filename))
+
+
+def read_manifest(manifest_file) -> list:
+    """
+    Reads an ordered manifest of HOCR files. The manifest is either a JSON list of file paths
+    (or an object with that list under "pages"), or a text file with one file path per line.
+    Relative file paths are relative to the manifest's folder.
+    """
+    with open(manifest_file) as manifest:
+        content = manifest.read()
+
+    if content.lstrip().startswith(('[', '{')):
+        hocr_files = json.loads(content)
+        if isinstance(hocr_files, dict):
+            hocr_files = hocr_files['pages']
+    else:
+        hocr_files = [line.strip() for line in content.splitlines() if line.strip()]
+
+    folder = os.path.dirname(manifest_file)
+    return [os.path.join(folder, f) for f in hocr_files]
+
+
+def list_hocr_files(hocr) -> list:
+    """
+    Lists the file paths of the HOCR files of a folder (in natural page order), or of a manifest (see read_manifest).
+    """
+    if os.path.isdir(hocr):
+        return [os.path.join(hocr, f) for f in sorted((f for f in os.listdir(hocr) if is_hocr_file(f)),
+                                                      key = natural_sort_key)]
+
+    return read_manifest(hocr)
+
+
 def get_confidence(s) -> int:
     """
     Using the input string (for x_wconf), parse out the confidence value and return
@@ -40,6 +188,39 @@ def get_confidence(s) -> int:
     return 100 - int(match.group(0)) if match else 100
 
 
+def get_font_size(s):
+    """
+    Using the input string (for x_fsize), parse out the font size (in points) and return it, or None if it is not set
+    """
+    match = re.search(r'(?<=x_fsize )([0-9.]+)', s.get('title'))
+    return round(float(match.group(0))) if match else None
+
+
+def get_line_size(s):
+    """
+    Using the input string (for x_size), parse out the height of the line's characters (in pixels) and return it,
+    or None if it is not set
+    """
+    match = re.search(r'(?<=x_size )([0-9.]+)', s.get('title'))
+    return float(match.group(0)) if match else None
+
+
+def get_styles(s) -> tuple:
+    """
+    Returns whether the text of a word is bold (<strong>) and whether it is italic (<em>)
+    """
+    bold = italic = False
+    tags = [child for child in s.contents if child.name]
+
+    while tags:
+        tag = tags.pop()
+        bold = bold or tag.name in ('strong', 'b')
+        italic = italic or tag.name in ('em', 'i')
+        tags.extend(child for child in tag.contents if child.name)
+
+    return bold, italic
+
+
 def get_boundingbox(s) -> dict:
     """
     Using the input string (for bbox), parse out the x1, y1, x2, y2 coordinates (i.e. BoundingBox)
@@ -87,11 +268,11 @@ def get_paragraphs(soup) -> bs4.element.ResultSet:
     return soup.find_all("p", {"class":"ocr_par"})
 
 
-def get_lines(soup) -> bs4.element.ResultSet:
+def get_lines(soup, classes = 'ocr_line') -> bs4.element.ResultSet:
     """
-    Returns the soup for the ocr_line
+    Returns the soup for the ocr_line (or for the lines of any of classes, see line_classes)
     """
-    return soup.find_all("span", {"class":"ocr_line"})
+    return soup.find_all("span", {"class":classes})
 
 
 def get_words(soup) -> bs4.element.ResultSet:
@@ -0,0 +1,230 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Rasterizes and OCRs a PDF page by page on a pool of workers, and streams each page's hOCR into the
+# HOCRToEOCRConverter as soon as it (and every page before it) is done. This replaces doOcr.sh:
+#
+#   python3 ocr_orchestrator.py <source.pdf> <output.eocr> [--hocr-dir out/] [--workers 4]
+
+
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import hashlib
+import os
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+from os.path import join
+
+import hocr_helper
+from HOCRToEOCRConverter import HOCRToEOCRConverter
+
+
+class Rasterizer(ABC):
+    """
+    Turns the pages of a source file into images.
+    """
+    @abstractmethod
+    def get_page_count(self, source_file) -> int:
+        pass
+
+    @abstractmethod
+    def rasterize(self, source_file, page_number, image_file):
+        """
+        :param source_file: The file path of the source file
+        :param page_number: The 0-based page number
+        :param image_file: The file path of the image to write
+        """
+
+
+class OCREngine(ABC):
+    """
+    Turns a page image into hOCR.
+    """
+    @abstractmethod
+    def ocr(self, image_file) -> str:
+        """
+        :param image_file: The file path of the page image
+        :return: The hOCR content of the page
+        """
+
+
+class MagickRasterizer(Rasterizer):
+    """
+    Uses the local ImageMagick `magick` binary, with the same settings as doOcr.sh.
+    """
+    def __init__(self, density = 300, size = '2481x3508', binary = 'magick'):
+        self.density = density
+        self.size = size
+        self.binary = binary
+
+    def get_page_count(self, source_file) -> int:
+        output = subprocess.run([self.binary, 'identify', '-format', '%n\n', source_file],
+                                check = True, capture_output = True, text = True).stdout
+        return int(output.split()[0])
+
+    def rasterize(self, source_file, page_number, image_file):
+        subprocess.run([self.binary, '-density', str(self.density), f'{source_file}[{page_number}]',
+                        '-set', 'colorspace', 'RGB', '-alpha', 'off', '-resize', self.size, image_file],
+                       check = True, capture_output = True)
+
+
+class TesseractEngine(OCREngine):
+    """
+    Uses the local `tesseract` binary, with the same settings as doOcr.sh.
+    """
+    def __init__(self, language = 'eng', binary = 'tesseract'):
+        self.language = language
+        self.binary = binary
+
+    def ocr(self, image_file) -> str:
+        return subprocess.run([self.binary, image_file, 'stdout', '-l', self.language, 'hocr'],
+                              check = True, capture_output = True, text = True).stdout
+
+
+class FakeRasterizer(Rasterizer):
+    """
+    Writes placeholder images, for running the orchestrator without ImageMagick.
+    """
+    def __init__(self, page_count):
+        self.page_count = page_count
+
+    def get_page_count(self, source_file) -> int:
+        return self.page_count
+
+    def rasterize(self, source_file, page_number, image_file):
+        with open(image_file, 'w') as image:
+            image.write(str(page_number))
+
+
+class FakeOCREngine(OCREngine):
+    """
+    Replays a folder of already OCR'd .hocr files (in page order), for running the orchestrator without tesseract.
+
+    :param hocr_folder: The folder that contains the .hocr of each page
+    :param delay: The number of seconds each page takes to "OCR"
+    """
+    def __init__(self, hocr_folder, delay = 0):
+        self.hocr_files = [join(hocr_folder, f) for f in sorted((f for f in os.listdir(hocr_folder)
+                                                                 if f.endswith('.hocr')),
+                                                                key = hocr_helper.get_page_number)]
+        self.delay = delay
+
+    def ocr(self, image_file) -> str:
+        with open(image_file) as image:
+            page_number = int(image.read())
+
+        time.sleep(self.delay)
+
+        with open(self.hocr_files[page_number]) as hocr:
+            return hocr.read()
+
+
+class OCROrchestrator(object):
+    """
+    :param rasterizer: The Rasterizer (defaults to MagickRasterizer)
+    :param engine: The OCREngine (defaults to TesseractEngine)
+    :param workers: The number of pages rasterized and OCR'd at the same time
+    :param max_pending: The maximum number of pages that are OCR'd but not converted yet (defaults to 2 * workers)
+    :param hocr_folder: Optional folder where each page's .hocr is also written (like doOcr.sh)
+    """
+    def __init__(self, rasterizer = None, engine = None, workers = None, max_pending = None, hocr_folder = None):
+        self.rasterizer = rasterizer or MagickRasterizer()
+        self.engine = engine or TesseractEngine()
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or 2 * self.workers
+        self.hocr_folder = hocr_folder
+
+    def consoleout(self, msg):
+        print(f'[{datetime.now()}] {msg}')
+
+    def _ocr_page(self, source_file, page_number, image_folder) -> str:
+        image_file = join(image_folder, f'page-{page_number:04d}.png')
+
+        try:
+            self.rasterizer.rasterize(source_file, page_number, image_file)
+            hocr = self.engine.ocr(image_file)
+        finally:
+            if os.path.exists(image_file):
+                os.remove(image_file)
+
+        if self.hocr_folder is not None:
+            with open(join(self.hocr_folder, f'page-{page_number:04d}.hocr'), 'w') as hocr_file:
+                hocr_file.write(hocr)
+
+        return hocr
+
+    def run(self, source_file, converter = None) -> HOCRToEOCRConverter:
+        """
+        OCRs the source file and converts it. Pages are converted in order, while the next pages are still
+        being OCR'd.
+
+        :param source_file: The file path of the source file (e.g. a PDF)
+        :param converter: Optional HOCRToEOCRConverter to convert into. If its md5 is not set, the md5 of the
+                          source file is used.
+        :return: The HOCRToEOCRConverter
+        """
+        if converter is None:
+            converter = HOCRToEOCRConverter()
+
+        if not converter.zuva_document.md5:
+            with open(source_file, 'rb') as source:
+                converter.set_document_md5(hashlib.md5(source.read()).digest())
+
+        if self.hocr_folder is not None:
+            os.makedirs(self.hocr_folder, exist_ok = True)
+
+        page_count = self.rasterizer.get_page_count(source_file)
+        self.consoleout(f'OCRing {page_count} page(s) of {source_file} with {self.workers} worker(s)')
+
+        with tempfile.TemporaryDirectory() as image_folder, ThreadPoolExecutor(max_workers = self.workers) as pool:
+            pending = {}
+            next_page = 0
+
+            for page_number in range(page_count):
+                # Only max_pending pages are queued ahead of the conversion, which bounds the hOCR held in memory
+                while len(pending) >= self.max_pending:
+                    converter.convert_hocr_content(pending.pop(next_page).result(), f'page-{next_page:04d}.hocr')
+                    next_page += 1
+
+                pending[page_number] = pool.submit(self._ocr_page, source_file, page_number, image_folder)
+
+            while pending:
+                converter.convert_hocr_content(pending.pop(next_page).result(), f'page-{next_page:04d}.hocr')
+                next_page += 1
+
+        return converter
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'OCRs a source file and converts it to .eocr')
+    parser.add_argument('source_file')
+    parser.add_argument('eocr_file')
+    parser.add_argument('--hocr-dir', help = 'Also write the .hocr of each page to this folder')
+    parser.add_argument('--workers', type = int, help = 'Number of pages to OCR at the same time')
+    parser.add_argument('--language', default = 'eng', help = 'The tesseract language')
+    args = parser.parse_args()
+
+    orchestrator = OCROrchestrator(engine = TesseractEngine(language = args.language),
+                                   workers = args.workers,
+                                   hocr_folder = args.hocr_dir)
+    converter = orchestrator.run(args.source_file)
+    converter.export(args.eocr_file)
+    orchestrator.consoleout(f'Conversion done and saved to {args.eocr_file}')
+
+
+if __name__ == '__main__':
+    main()
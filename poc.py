@@ -88,7 +88,7 @@ consoleout(f'Waiting for requests to complete')
 
 # Wait for the requests to complete
 while len(jobs)>0:
-    for job in jobs:
+    for job in list(jobs):
         if isinstance(job, Language):
             _latest, _ = sdk.language.get(request_id = job.request_id)
             if not _latest.is_done(): continue
@@ -0,0 +1,49 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# The tests run against the bundled sample (out/CANADAGOOS-F1Securiti-2152017/):
+#
+#   python3 -m pytest tests/
+
+
+import os
+import sys
+import pytest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+import hocr_helper
+
+sample_hocr_folder = os.path.join(root, 'out', 'CANADAGOOS-F1Securiti-2152017')
+sample_eocr_file = os.path.join(root, 'CANADAGOOS-F1Securiti-2152017.eocr')
+
+
+def pytest_configure(config):
+    # The sample's .hocr files have an XML declaration, which bs4 warns about when parsing them as HTML
+    config.addinivalue_line('filterwarnings', 'ignore::bs4.XMLParsedAsHTMLWarning')
+
+
+@pytest.fixture
+def sample_hocr_files():
+    return hocr_helper.list_hocr_files(sample_hocr_folder)
+
+
+@pytest.fixture
+def sample_eocr_content():
+    """
+    The byte-content of the bundled .eocr, which was converted from the sample's .hocr files.
+    """
+    with open(sample_eocr_file, 'rb') as eocr:
+        return eocr.read()
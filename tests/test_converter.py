@@ -0,0 +1,174 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import hashlib
+
+import pytest
+
+from HOCRToEOCRConverter import HOCRToEOCRConverter
+import eocr_formats
+import eocr_helper
+import eocr_validate
+
+# A page with an empty word, which fails to convert
+malformed_hocr = '''<html><body><div class="ocr_page" title="bbox 0 0 100 200">
+<p class="ocr_par" title="bbox 0 0 100 100"><span class="ocr_line" title="bbox 0 0 100 100">
+<span class="ocrx_word" title="x_wconf 90"></span></span></p></div></body></html>
+'''
+
+
+@pytest.fixture
+def malformed_file(tmp_path):
+    hocr_file = tmp_path / 'malformed.hocr'
+    hocr_file.write_text(malformed_hocr)
+    return str(hocr_file)
+
+
+def _converter(hocr_files, **kwargs) -> HOCRToEOCRConverter:
+    converter = HOCRToEOCRConverter(**kwargs)
+    converter.set_hocr_manifest(hocr_files)
+    converter.set_document_md5(hashlib.md5(b'source').digest())
+    converter.start()
+    return converter
+
+
+def _convert(hocr_files, **kwargs):
+    return _converter(hocr_files, **kwargs).zuva_document.to_document()
+
+
+def test_layers_keep_the_characters(sample_hocr_files):
+    with_layers = _convert(sample_hocr_files)
+    without_layers = _convert(sample_hocr_files, layers = False)
+
+    assert with_layers.characters == without_layers.characters
+    assert with_layers.pages == without_layers.pages
+    assert with_layers.font_sizes
+    assert not with_layers.headers and not with_layers.footers
+    assert not without_layers.font_sizes
+
+    # The .eocr body only differs by the layers
+    del with_layers.font_sizes[:], with_layers.font_styles[:]
+    assert eocr_helper.get_eocr_file_content(with_layers) == eocr_helper.get_eocr_file_content(without_layers)
+
+
+def test_header_lines(sample_hocr_files):
+    document = _convert(sample_hocr_files)
+    with_headers = _convert(sample_hocr_files, header_lines = True)
+
+    assert len(with_headers.characters) > len(document.characters)
+    assert with_headers.headers or with_headers.footers
+
+
+def test_sample_is_valid(sample_hocr_files, tmp_path):
+    converter = _converter(sample_hocr_files)
+    converter.export(tmp_path / 'sample.eocr', validate = True)
+
+    assert not eocr_validate.validate_eocr_file(tmp_path / 'sample.eocr')
+
+
+def test_overlapping_words_space(tmp_path):
+    (tmp_path / 'page.hocr').write_text('''<html><body><div class="ocr_page" title="bbox 0 0 100 100">
+<p class="ocr_par" title="bbox 0 0 100 20"><span class="ocr_line" title="bbox 0 0 100 20">
+<span class="ocrx_word" title="bbox 10 0 50 20; x_wconf 90">ab</span>
+<span class="ocrx_word" title="bbox 40 0 80 20; x_wconf 90">cd</span></span></p></div></body></html>
+''')
+    converter = _converter([str(tmp_path / 'page.hocr')])
+
+    space = converter.zuva_document.characters[2]
+    assert chr(space.unicode) == ' '
+    assert space.bounding_box.x1 == space.bounding_box.x2 == 40
+
+    # The space still ends where the next word starts, so both words are on one line
+    paragraphs = eocr_formats.get_paragraphs(converter.zuva_document.characters.buffer)
+    assert [[word.text for word in line.words] for line in paragraphs[0].lines] == [['ab', 'cd']]
+
+
+def test_surrogate_pairs(tmp_path):
+    (tmp_path / 'page.hocr').write_text('''<html><body><div class="ocr_page" title="bbox 0 0 100 100">
+<p class="ocr_par" title="bbox 0 0 100 20"><span class="ocr_line" title="bbox 0 0 100 20">
+<span class="ocrx_word" title="bbox 0 0 30 20; x_wconf 90">a\U0001d538b</span>
+<span class="ocrx_word" title="bbox 40 0 50 20; x_wconf 90">c</span></span></p></div></body></html>
+''', encoding = 'utf-8')
+    converter = _converter([str(tmp_path / 'page.hocr')])
+    characters = converter.zuva_document.characters[:6]
+
+    # The character outside of the BMP is two UTF-16 code units, which both get its box
+    assert [c.unicode for c in characters] == [ord('a'), 0xd835, 0xdd38, ord('b'), ord(' '), ord('c')]
+    assert [(c.bounding_box.x1, c.bounding_box.x2) for c in characters] == \
+        [(0, 10), (10, 20), (10, 20), (20, 30), (30, 40), (40, 50)]
+
+    # The offsets after it count both code units
+    structure = converter.zuva_document.structure
+    assert [structure.span('words', i) for i in range(structure.count('words'))] == [(0, 4), (5, 6)]
+    paragraphs = eocr_formats.get_paragraphs(converter.zuva_document.characters.buffer)
+    assert [[word.text for word in line.words] for line in paragraphs[0].lines] == [['a\U0001d538b', 'c']]
+
+    converter.export(tmp_path / 'page.eocr')
+    assert not eocr_validate.validate_eocr_file(tmp_path / 'page.eocr')
+
+
+@pytest.mark.parametrize('memory_budget', [None, 1])
+def test_reset(sample_hocr_files, malformed_file, tmp_path, memory_budget):
+    converter = _converter([sample_hocr_files[0], malformed_file], memory_budget = memory_budget,
+                           spill_directory = tmp_path, on_error = 'skip')
+    assert converter.failures
+
+    # A reset() converter converts the next document as a new converter would
+    for hocr_files in [sample_hocr_files[1:3], sample_hocr_files[3:4]]:
+        converter.reset()
+        converter.set_hocr_manifest(hocr_files)
+        converter.set_document_md5(hashlib.md5(b'source').digest())
+        converter.start()
+        expected = _converter(hocr_files, memory_budget = memory_budget, spill_directory = tmp_path)
+
+        assert converter.zuva_document.SerializeToString() == expected.zuva_document.SerializeToString()
+        assert converter.zuva_document.structure.to_bytes() == expected.zuva_document.structure.to_bytes()
+        assert not converter.failures
+
+
+def _ranges(document) -> list:
+    return [(page.range.start, page.range.end) for page in document.pages]
+
+
+def test_skip_failed_page(sample_hocr_files, malformed_file):
+    converter = _converter([sample_hocr_files[0], malformed_file, sample_hocr_files[1]], on_error = 'skip')
+    document = converter.zuva_document.to_document()
+    expected = _convert(sample_hocr_files[:2])
+
+    # The failed page is left out, and the pages after it follow on from the ones before it
+    assert len(document.pages) == 2
+    assert _ranges(document) == _ranges(expected)
+    assert document.characters == expected.characters
+    assert [(failure.source, failure.page, failure.error, failure.action) for failure in converter.failures] == \
+        [('malformed.hocr', 0, 'ZeroDivisionError', 'skip')]
+
+
+def test_empty_failed_page(sample_hocr_files, malformed_file):
+    converter = _converter([sample_hocr_files[0], malformed_file, sample_hocr_files[1]], on_error = 'empty')
+    document = converter.zuva_document.to_document()
+    expected = _convert(sample_hocr_files[:2])
+    (first_start, first_end), second = _ranges(expected)
+
+    # The failed page is replaced by an empty page of its size, between the pages before and after it
+    assert len(document.pages) == 3
+    assert _ranges(document) == [(first_start, first_end), (first_end, first_end), second]
+    assert (document.pages[1].width, document.pages[1].height) == (100, 200)
+    assert document.characters == expected.characters
+    assert converter.get_failure_report()['failures'][0]['action'] == 'empty'
+
+
+def test_fail_on_failed_page(sample_hocr_files, malformed_file):
+    with pytest.raises(ZeroDivisionError):
+        _converter([sample_hocr_files[0], malformed_file], on_error = 'fail')
@@ -0,0 +1,83 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import hashlib
+
+import pytest
+
+pyarrow = pytest.importorskip('pyarrow')
+import pyarrow.ipc
+import pyarrow.parquet
+
+from HOCRToEOCRConverter import HOCRToEOCRConverter
+from recognition_results_pb2 import Document
+import eocr_arrow
+import eocr_helper
+
+sample_character_count = 124700
+
+
+def _converter(hocr_files, **kwargs) -> HOCRToEOCRConverter:
+    converter = HOCRToEOCRConverter(**kwargs)
+    converter.set_hocr_manifest(hocr_files)
+    converter.set_document_md5(hashlib.md5(b'source').digest())
+    converter.start()
+    return converter
+
+
+def _read(output_file):
+    if str(output_file).endswith('.parquet'):
+        return pyarrow.parquet.read_table(output_file)
+
+    with pyarrow.ipc.open_file(output_file) as reader:
+        return reader.read_all()
+
+
+@pytest.mark.parametrize('file_name', ['sample.parquet', 'sample.arrow'])
+def test_write_columns(sample_hocr_files, tmp_path, file_name):
+    converter = _converter(sample_hocr_files)
+    eocr_arrow.write_columns(converter.zuva_document, tmp_path / file_name)
+    table = _read(tmp_path / file_name)
+
+    document = converter.zuva_document.to_document()
+    pages = table.column('page').to_pylist()
+
+    assert table.schema == eocr_arrow.get_schema()
+    assert table.num_rows == sample_character_count
+    assert table.column('unicode').to_pylist() == [c.unicode for c in document.characters]
+    assert table.column('x2').to_pylist() == [c.bounding_box.x2 for c in document.characters]
+    for page_number, page in enumerate(document.pages):
+        assert set(pages[page.range.start:page.range.end]) == {page_number}
+
+
+def test_spill_keeps_the_output(sample_hocr_files, tmp_path):
+    in_memory = eocr_arrow.to_table(_converter(sample_hocr_files).zuva_document)
+
+    converter = _converter(sample_hocr_files, memory_budget = 1, spill_directory = tmp_path)
+    assert converter.zuva_document.characters.spilled_count > 0
+    spilled = eocr_arrow.to_table(converter.zuva_document)
+
+    assert spilled.num_rows == sample_character_count
+    assert spilled.equals(in_memory)
+
+
+def test_eocr_document(sample_eocr_content, tmp_path):
+    document = Document.FromString(eocr_helper.get_eocr_document_bytes(sample_eocr_content))
+    eocr_arrow.write_columns(document, tmp_path / 'sample.parquet')
+    table = _read(tmp_path / 'sample.parquet')
+
+    assert table.num_rows == sample_character_count
+    assert table.column('unicode').to_pylist() == [c.unicode for c in document.characters]
+    assert table.column('page').to_pylist()[-1] == len(document.pages) - 1
@@ -0,0 +1,169 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import multiprocessing
+import os
+import threading
+
+import pytest
+
+from recognition_results_pb2 import Document
+from HOCRToEOCRConverter import HOCRToEOCRConverter
+import eocr_batch
+import eocr_helper
+
+
+@pytest.fixture
+def slow_shards(monkeypatch):
+    """
+    Makes the shards that have a .hocr file of the returned set hang (until the test is done).
+    """
+    slow_files = set()
+    done = threading.Event()
+    convert_shard = eocr_batch.convert_shard
+
+    def slow_convert_shard(hocr_files, *args):
+        if slow_files.intersection(hocr_files):
+            done.wait(60)
+        return convert_shard(hocr_files, *args)
+
+    monkeypatch.setattr(eocr_batch, 'convert_shard', slow_convert_shard)
+    yield slow_files
+    done.set()
+
+
+@pytest.fixture
+def started_shards(monkeypatch):
+    """
+    Records the .hocr files of each shard when its conversion starts.
+    """
+    started = []
+    convert_shard = eocr_batch.convert_shard
+
+    def recorded_convert_shard(hocr_files, *args):
+        started.append([os.path.basename(f) for f in hocr_files])
+        return convert_shard(hocr_files, *args)
+
+    monkeypatch.setattr(eocr_batch, 'convert_shard', recorded_convert_shard)
+    return started
+
+
+def _read_document(eocr_file) -> Document:
+    with open(eocr_file, 'rb') as eocr:
+        return Document.FromString(eocr_helper.get_eocr_document_bytes(eocr.read()))
+
+
+@pytest.mark.parametrize('mode', ['thread', pytest.param('process', marks = pytest.mark.skipif(
+    multiprocessing.get_start_method() != 'fork', reason = 'the worker processes are forked with the slow shards'))])
+def test_page_timeout(sample_hocr_files, slow_shards, tmp_path, mode):
+    slow_shards.add(sample_hocr_files[0])
+    documents = [eocr_batch.BatchDocument('slow', sample_hocr_files[:2], b'test', tmp_path / 'slow.eocr'),
+                 eocr_batch.BatchDocument('sample', sample_hocr_files[2:4], b'test', tmp_path / 'sample.eocr')]
+
+    report = eocr_batch.convert_batch(documents, workers = 2, mode = mode, shard_bytes = 1, on_error = 'empty',
+                                      page_timeout = 1)
+
+    # The slow file is replaced by an empty page, the other files are converted
+    assert [(failure.source, failure.error, failure.action) for failure in report.failures['slow']] == \
+        [(os.path.basename(sample_hocr_files[0]), 'TimeoutError', 'empty')]
+    assert not report.failures['sample']
+
+    slow = _read_document(tmp_path / 'slow.eocr')
+    assert slow.pages[0].range.start == slow.pages[0].range.end == 0
+    assert slow.pages[1].range.end == len(slow.characters) > 0
+
+    converter = HOCRToEOCRConverter()
+    converter.set_hocr_manifest(sample_hocr_files[2:4])
+    converter.set_document_md5(b'test')
+    converter.start()
+    assert _read_document(tmp_path / 'sample.eocr') == converter.zuva_document.to_document()
+
+
+def test_page_timeout_fails(sample_hocr_files, slow_shards, tmp_path):
+    slow_shards.add(sample_hocr_files[0])
+    documents = [eocr_batch.BatchDocument('slow', sample_hocr_files[:1], b'test', tmp_path / 'slow.eocr')]
+
+    with pytest.raises(TimeoutError):
+        eocr_batch.convert_batch(documents, workers = 1, mode = 'thread', page_timeout = 0.5)
+
+
+def test_split_shards():
+    files = ['a', 'b', 'c', 'd', 'e']
+
+    # Consecutive files up to shard_bytes, and a file larger than shard_bytes on its own
+    assert eocr_batch.split_shards(files, [5, 5, 20, 3, 3], 10) == [['a', 'b'], ['c'], ['d', 'e']]
+    assert eocr_batch.split_shards(files, [5, 6, 4, 1, 10], 10) == [['a'], ['b', 'c'], ['d'], ['e']]
+    assert eocr_batch.split_shards(files, [1] * 5, 100) == [files]
+
+
+def test_document_shards(sample_hocr_files, tmp_path):
+    document = eocr_batch.BatchDocument('sample', sample_hocr_files, b'test', tmp_path / 'sample.eocr')
+    shard_bytes = 3 * max(document.costs)
+
+    shards = document.get_shards(shard_bytes)
+
+    assert len(shards) > 1
+    assert [f for _, files in shards for f in files] == sample_hocr_files
+    assert sum(cost for cost, _ in shards) == document.cost
+    assert all(cost <= shard_bytes for cost, _ in shards)
+    assert document.get_shards() == [(document.cost, sample_hocr_files)]
+
+
+def _batch_documents(sample_hocr_files, tmp_path) -> list:
+    # Documents of one, three and two files, in that order
+    return [eocr_batch.BatchDocument(name, files, b'test', tmp_path / f'{name}.eocr')
+            for name, files in (('small', sample_hocr_files[:1]), ('large', sample_hocr_files[1:4]),
+                                ('medium', sample_hocr_files[4:6]))]
+
+
+@pytest.mark.parametrize('order', ['largest', 'fifo'])
+def test_submission_order(sample_hocr_files, started_shards, tmp_path, order):
+    documents = _batch_documents(sample_hocr_files, tmp_path)
+
+    # One worker converts the shards in the order they are submitted
+    report = eocr_batch.convert_batch(documents, workers = 1, mode = 'thread', order = order)
+
+    expected = sorted(documents, key = lambda document: -document.cost) if order == 'largest' else documents
+    assert [document.name for document in expected] == \
+        (['large', 'medium', 'small'] if order == 'largest' else ['small', 'large', 'medium'])
+    assert started_shards == [[os.path.basename(f) for f in document.hocr_files] for document in expected]
+    assert sorted(report.latencies) == ['large', 'medium', 'small']
+
+
+def test_submission_order_of_shards(sample_hocr_files, started_shards, tmp_path):
+    documents = _batch_documents(sample_hocr_files, tmp_path)
+    shard_bytes = max(documents[1].costs)
+    shards = [(cost, document.cost, [os.path.basename(f) for f in files])
+              for document in documents for cost, files in document.get_shards(shard_bytes)]
+
+    eocr_batch.convert_batch(documents, workers = 1, mode = 'thread', shard_bytes = shard_bytes)
+
+    # The largest shards first, and between shards of the same cost, those of the largest document
+    assert started_shards == [files for _, _, files in sorted(shards, key = lambda shard: (-shard[0], -shard[1]))]
+    for document in documents:
+        assert _read_document(document.output_file).pages
+
+
+def test_replaced_pool_keeps_the_order(sample_hocr_files, slow_shards, started_shards, tmp_path):
+    documents = _batch_documents(sample_hocr_files, tmp_path)
+    slow_shards.add(sample_hocr_files[1])
+
+    report = eocr_batch.convert_batch(documents, workers = 1, mode = 'thread', on_error = 'empty', page_timeout = 1)
+
+    # The slow (largest) shard times out, and the shards queued behind it are submitted again in the same order
+    assert started_shards == [['page-1.hocr', 'page-2.hocr', 'page-3.hocr'], ['page-4.hocr', 'page-5.hocr'],
+                              ['page-0.hocr']]
+    assert [failure.error for failure in report.failures['large']] == ['TimeoutError'] * 3
+    assert len(_read_document(tmp_path / 'large.eocr').pages) == 3
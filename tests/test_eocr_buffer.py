@@ -0,0 +1,88 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import hashlib
+
+import pytest
+
+from recognition_results_pb2 import Document
+import eocr_buffer
+import eocr_helper
+
+# Values that are left out (0), one byte and several bytes long once encoded
+_characters = [eocr_helper.new_character('a', 0, 0, 10, 20, 0),
+               eocr_helper.new_utf16_character(0xd835, 127, 128, 300, 16383, 100),
+               eocr_helper.new_utf16_character(0xdd38, 16384, 70000, 2 ** 32 - 1, 5, 1),
+               eocr_helper.new_character(' ', 0, 0, 0, 0, 0)]
+
+
+def _document_view() -> eocr_buffer.DocumentView:
+    view = eocr_buffer.DocumentView()
+    view.characters.append(_characters[0])
+    view.characters.extend(_characters[1:])
+    view.pages.append(eocr_helper.new_page(0, len(_characters), 100, 200))
+    view.font_sizes.append(eocr_helper.new_font_size(0, 2, 11))
+    view.md5 = hashlib.md5(b'source').digest()
+    return view
+
+
+def _document() -> Document:
+    document = eocr_helper.new_document()
+    document.characters.extend(_characters)
+    document.pages.append(eocr_helper.new_page(0, len(_characters), 100, 200))
+    document.font_sizes.append(eocr_helper.new_font_size(0, 2, 11))
+    document.md5 = hashlib.md5(b'source').digest()
+    return document
+
+
+def test_serialize_like_protobuf():
+    view = _document_view()
+
+    assert view.SerializeToString() == _document().SerializeToString()
+    assert view.to_document() == _document()
+    assert view.characters.buffer.serialize(1, 3) == Document(characters = _characters[1:3]).SerializeToString()
+
+
+def test_character_proxies():
+    view = _document_view()
+
+    assert len(view.characters) == len(_characters)
+    assert view.characters[1] == _characters[1]
+    assert view.characters[-1] == _characters[-1]
+    assert view.characters[1:3] == _characters[1:3]
+    assert view.characters[::2] == _characters[::2]
+    assert list(view.characters) == _characters
+    assert view.characters[2].bounding_box.x2 == 2 ** 32 - 1
+
+    with pytest.raises(IndexError):
+        view.characters[len(_characters)]
+
+
+def test_proxies_set_the_columns():
+    view = _document_view()
+    view.characters[0].bounding_box.x1 = 5
+    view.characters[0].error = 7
+
+    character = view.to_document().characters[0]
+    assert (character.bounding_box.x1, character.error) == (5, 7)
+
+
+def test_document_attributes():
+    view = _document_view()
+
+    # Fields that the view does not keep itself are read from the Document
+    assert view.version == eocr_helper.proto_version
+    assert len(view.tables) == 0
+    assert view.ByteSize() == _document().ByteSize()
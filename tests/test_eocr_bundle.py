@@ -0,0 +1,130 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import hashlib
+import os
+
+import pytest
+
+import eocr_bundle
+import eocr_helper
+
+
+def _eocr_content(name) -> bytes:
+    """
+    The .eocr content of an empty document, whose md5 is that of name.
+    """
+    document = eocr_helper.new_document()
+    document.md5 = hashlib.md5(name.encode()).digest()
+    return eocr_helper.get_eocr_file_content(document)
+
+
+def _read_all(bundle_file) -> dict:
+    with eocr_bundle.EOCRBundleReader(bundle_file) as reader:
+        return {name: reader.read(name) for name in reader.names()}
+
+
+@pytest.fixture
+def bundle_file(sample_eocr_content, tmp_path) -> str:
+    """
+    A bundle of the bundled sample's .eocr and of a small one.
+    """
+    bundle_file = str(tmp_path / 'documents.eocrb')
+    with eocr_bundle.EOCRBundleWriter(bundle_file) as writer:
+        writer.add('sample.eocr', sample_eocr_content)
+        writer.add('a.eocr', _eocr_content('a'))
+    return bundle_file
+
+
+def test_read(bundle_file, sample_eocr_content, tmp_path):
+    with eocr_bundle.EOCRBundleReader(bundle_file) as reader:
+        assert reader.names() == ['sample.eocr', 'a.eocr']
+        assert 'a.eocr' in reader and 'b.eocr' not in reader
+
+        # Each member is byte-identical to the standalone .eocr
+        assert reader.read('sample.eocr') == sample_eocr_content
+        assert b''.join(reader.iter_chunks('sample.eocr', chunk_size = 1000)) == sample_eocr_content
+        assert reader.read_document_bytes('sample.eocr') == eocr_helper.get_eocr_document_bytes(sample_eocr_content)
+
+        reader.extract('a.eocr', tmp_path / 'a.eocr')
+        assert (tmp_path / 'a.eocr').read_bytes() == _eocr_content('a')
+
+        with pytest.raises(Exception, match = 'does not contain b.eocr'):
+            reader.read('b.eocr')
+
+
+def test_duplicate_name(tmp_path):
+    with eocr_bundle.EOCRBundleWriter(tmp_path / 'documents.eocrb') as writer:
+        writer.add('a.eocr', _eocr_content('a'))
+
+        with pytest.raises(Exception, match = 'already contains a.eocr'):
+            writer.add('a.eocr', _eocr_content('a'))
+
+
+def test_append(bundle_file, sample_eocr_content):
+    with eocr_bundle.EOCRBundleWriter(bundle_file, append = True) as writer:
+        writer.add('b.eocr', _eocr_content('b'))
+
+        with pytest.raises(Exception, match = 'already contains a.eocr'):
+            writer.add('a.eocr', _eocr_content('a'))
+
+    assert _read_all(bundle_file) == {'sample.eocr': sample_eocr_content,
+                                      'a.eocr': _eocr_content('a'),
+                                      'b.eocr': _eocr_content('b')}
+
+
+def test_interrupted_append(bundle_file, sample_eocr_content):
+    before = _read_all(bundle_file)
+    with open(bundle_file, 'rb') as bundle:
+        original = bundle.read()
+
+    # A member that contains the trailer's magic, which must not be taken for a trailer
+    with eocr_bundle.EOCRBundleWriter(bundle_file, append = True) as writer:
+        writer.add('b.eocr', b'eocrb 1\n' + bytes(16) + eocr_bundle.trailer_magic + _eocr_content('b'))
+    with open(bundle_file, 'rb') as bundle:
+        appended = bundle.read()
+
+    # The size of the bundle once c.eocr is appended to the original one
+    with open(bundle_file, 'wb') as bundle:
+        bundle.write(original)
+    with eocr_bundle.EOCRBundleWriter(bundle_file, append = True) as writer:
+        writer.add('c.eocr', _eocr_content('c'))
+    size = os.path.getsize(bundle_file)
+
+    # The append stops (e.g. the process crashes) before the new trailer is completely written: before the new member,
+    # part way into it, into the index, and into the trailer
+    for end in [len(original), len(original) + 30, len(appended) - 40, len(appended) - 1]:
+        with open(bundle_file, 'wb') as bundle:
+            bundle.write(appended[:end])
+
+        assert _read_all(bundle_file) == before
+
+        # The next append drops what the interrupted one wrote
+        with eocr_bundle.EOCRBundleWriter(bundle_file, append = True) as writer:
+            writer.add('c.eocr', _eocr_content('c'))
+
+        assert _read_all(bundle_file) == dict(before, **{'c.eocr': _eocr_content('c')})
+        assert os.path.getsize(bundle_file) == size
+
+
+def test_unclosed_bundle(bundle_file):
+    # The writer of a new bundle stops before writing the index and trailer
+    with open(bundle_file, 'rb') as bundle:
+        content = bundle.read()
+    with open(bundle_file, 'wb') as bundle:
+        bundle.write(content[:len(eocr_bundle.bundle_header) + 100])
+
+    with pytest.raises(Exception, match = 'was not closed'):
+        eocr_bundle.EOCRBundleReader(bundle_file)
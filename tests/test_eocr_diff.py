@@ -0,0 +1,143 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+
+import pytest
+
+from recognition_results_pb2 import Document
+import eocr_diff
+import eocr_helper
+
+
+def _document(pages):
+    """
+    A document with one character per letter of each page's text.
+    """
+    document = eocr_helper.new_document()
+    for text in pages:
+        start = len(document.characters)
+        document.characters.extend([eocr_helper.new_character(char, i * 10, 0, i * 10 + 9, 20, 100)
+                                    for i, char in enumerate(text)])
+        document.pages.append(eocr_helper.new_page(start, len(document.characters), 1000, 1000))
+    return document
+
+
+def _page_text(number) -> str:
+    return ' '.join(f'page{number}word{i}' for i in range(12))
+
+
+def _page_ranges(pages) -> list:
+    ranges = []
+    for text in pages:
+        start = ranges[-1][1] if ranges else 0
+        ranges.append((start, start + len(text)))
+    return ranges
+
+
+def _diff(old_pages, new_pages) -> eocr_diff.OffsetMap:
+    return eocr_diff.diff_documents(_document(old_pages), _document(new_pages))
+
+
+def _mapped_characters(offset_map, start, end) -> list:
+    return [offset for offset in range(start, end) if offset_map.map_span(offset, offset + 1) is not None]
+
+
+def test_inserted_deleted_and_edited_pages():
+    a, b, c, d, e, x = [_page_text(number) for number in range(6)]
+    edited_c = c.replace('page2word5', 'page2WORD5')
+    old_pages, new_pages = [a, b, c, d, e], [a, edited_c, d, x, e]
+    old_ranges, new_ranges = _page_ranges(old_pages), _page_ranges(new_pages)
+
+    offset_map = _diff(old_pages, new_pages)
+
+    # Unchanged pages map as a whole, wherever they moved to
+    for old, new in [(0, 0), (3, 2), (4, 4)]:
+        assert offset_map.map_span(*old_ranges[old]) == new_ranges[new]
+        assert offset_map.map_offset(old_ranges[old][0] + 7) == new_ranges[new][0] + 7
+
+    # The deleted page is not in the new version
+    assert offset_map.map_span(*old_ranges[1]) is None
+    assert _mapped_characters(offset_map, *old_ranges[1]) == []
+
+    # Nothing maps into the inserted page
+    for new_start, length in zip(offset_map.new_starts, offset_map.lengths):
+        assert new_start + length <= new_ranges[3][0] or new_start >= new_ranges[3][1]
+
+    # Only the edited letters of the edited page are not mapped
+    start = old_ranges[2][0]
+    mapped = _mapped_characters(offset_map, *old_ranges[2])
+    assert len(mapped) == len(c) - len('word')
+    assert offset_map.map_span(*old_ranges[2]) == new_ranges[1]
+    edited = start + c.index('page2word5') + len('page2')
+    assert offset_map.map_span(edited, edited + len('word')) is None
+
+    assert offset_map.matched == len(a) + len(c) - len('word') + len(d) + len(e)
+
+
+def test_edit_inside_a_word():
+    offset_map = _diff(['the quick brown fox'], ['the quack brown fox'])
+
+    assert offset_map.matched == len('the quick brown fox') - 1
+    # The common letters around the edit still map one to one
+    for offset in [4, 5, 7, 8]:
+        assert offset_map.map_offset(offset) == offset
+    # The replaced letter goes to the next common letter, or after the previous one
+    assert offset_map.map_offset(6, 'start') == 7
+    assert offset_map.map_offset(6, 'end') == 6
+    assert offset_map.map_span(6, 7) is None
+    assert offset_map.map_span(4, 9) == (4, 9)
+
+
+def test_map_span_across_an_edit():
+    old_text, new_text = 'alpha beta gamma delta', 'alpha gamma delta epsilon'
+    offset_map = _diff([old_text], [new_text])
+
+    # A span that starts in the deleted word shrinks to its common characters
+    beta, gamma = old_text.index('beta'), old_text.index('gamma')
+    assert offset_map.map_span(beta, gamma + len('gamma')) == (new_text.index('gamma'), new_text.index(' delta'))
+    assert offset_map.map_span(beta, gamma) is None
+    assert offset_map.map_span(0, len(old_text)) == (0, new_text.index(' epsilon'))
+    assert offset_map.map_spans([(0, len('alpha')), (beta, beta + 1)]) == [(0, len('alpha')), None]
+
+    # There is no common character after the end of the old version
+    assert offset_map.map_offset(len(old_text), 'start') is None
+    assert offset_map.map_offset(len(old_text), 'end') == new_text.index(' epsilon')
+
+
+def test_offset_map_round_trip(tmp_path):
+    offset_map = _diff([_page_text(0), _page_text(1), _page_text(2)],
+                       [_page_text(0), _page_text(2).replace('word3', 'word33'), _page_text(1)])
+    assert len(offset_map) > 1
+
+    map_file = os.path.join(tmp_path, 'offsets.eocrmap')
+    offset_map.write(map_file)
+    for loaded in [eocr_diff.OffsetMap.from_bytes(offset_map.to_bytes()), eocr_diff.OffsetMap.read(map_file)]:
+        assert (loaded.old_starts, loaded.new_starts, loaded.lengths) == \
+               (offset_map.old_starts, offset_map.new_starts, offset_map.lengths)
+        assert loaded.to_bytes() == offset_map.to_bytes()
+
+    assert eocr_diff.OffsetMap.from_bytes(eocr_diff.OffsetMap().to_bytes()).matched == 0
+    with pytest.raises(Exception, match = 'not an offset map'):
+        eocr_diff.OffsetMap.from_bytes(b'eocrx 2\n')
+
+
+def test_identical_sample(sample_eocr_content):
+    document = Document.FromString(eocr_helper.get_eocr_document_bytes(sample_eocr_content))
+
+    offset_map = eocr_diff.diff_documents(document, document)
+
+    assert len(offset_map) == 1
+    assert offset_map.matched == len(document.characters) == 124700
@@ -0,0 +1,165 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import hashlib
+import json
+import xml.etree.ElementTree as ElementTree
+
+import pytest
+
+from HOCRToEOCRConverter import HOCRToEOCRConverter
+import eocr_buffer
+import eocr_formats
+import eocr_helper
+import eocr_structure
+
+_alto = '{http://www.loc.gov/standards/alto/ns-v4#}'
+
+# A word with a space in its text, and no error (like the spaces the converter inserts between words)
+spaced_word_hocr = '''<html><body><div class="ocr_page" title="bbox 0 0 300 100">
+<p class="ocr_par" title="bbox 0 0 300 20"><span class="ocr_line" title="bbox 0 0 300 20">
+<span class="ocrx_word" title="bbox 0 0 80 20; x_wconf 100">New York</span>
+<span class="ocrx_word" title="bbox 100 0 140 20; x_wconf 100">City</span></span></p>
+<p class="ocr_par" title="bbox 0 40 300 60"><span class="ocr_line" title="bbox 0 40 300 60">
+<span class="ocrx_word" title="bbox 0 40 40 60; x_wconf 90">Hall</span></span></p></div></body></html>
+'''
+
+
+def _converter(hocr_files) -> HOCRToEOCRConverter:
+    converter = HOCRToEOCRConverter()
+    converter.set_hocr_manifest(hocr_files)
+    converter.set_document_md5(hashlib.md5(b'source').digest())
+    converter.start()
+    return converter
+
+
+@pytest.fixture
+def sample_converter(sample_hocr_files):
+    return _converter(sample_hocr_files[:4])
+
+
+def _read_words(jsonl_file) -> list:
+    with open(jsonl_file, encoding = 'utf-8') as records:
+        return [(record['start'], record['end'], record['text']) for record in map(json.loads, records)]
+
+
+def _read_alto(alto_file) -> list:
+    """
+    :return: A list of (page width, page height, [String element, ...]) per page
+    """
+    pages = []
+    for page in ElementTree.parse(alto_file).getroot().iter(f'{_alto}Page'):
+        pages.append((int(page.get('WIDTH')), int(page.get('HEIGHT')), list(page.iter(f'{_alto}String'))))
+    return pages
+
+
+def test_hocr_round_trip(sample_converter, tmp_path):
+    sample_converter.export_format(tmp_path / 'sample.hocr')
+
+    converter = _converter([str(tmp_path / 'sample.hocr')])
+
+    # The same characters and pages (hOCR has no font sizes or styles)
+    document, expected = converter.zuva_document.to_document(), sample_converter.zuva_document.to_document()
+    assert document.characters == expected.characters
+    assert document.pages == expected.pages
+
+
+def test_alto_round_trip(sample_converter, tmp_path):
+    sample_converter.export_format(tmp_path / 'sample.xml')
+    document = sample_converter.zuva_document
+    pages = _read_alto(tmp_path / 'sample.xml')
+
+    assert [(width, height) for width, height, _ in pages] == [(page.width, page.height) for page in document.pages]
+
+    for number, (page, characters) in enumerate(eocr_buffer.iter_page_buffers(document)):
+        strings = pages[number][2]
+        text = eocr_formats.decode_utf16(characters.unicode)
+        paragraphs = eocr_formats.get_structure_paragraphs(characters, document.structure, page.range.start, number)
+        words = [word for paragraph in paragraphs for line in paragraph.lines for word in line.words]
+        structure_words = [document.structure.span('words', w) for w in range(document.structure.count('words'))
+                           if page.range.start <= document.structure.starts['words'][w] < page.range.end]
+        assert [(word.start, word.end) for word in words] == structure_words and words
+
+        # The structure the converter recorded gives the same words, lines and paragraphs as the spaces between them
+        assert [(paragraph.start, paragraph.end, paragraph.bbox) for paragraph in paragraphs] == \
+            [(paragraph.start, paragraph.end, paragraph.bbox)
+             for paragraph in eocr_formats.get_paragraphs(characters, page.range.start)]
+
+        # Each word is a String, with its text, character offsets and box
+        assert [string.get('ID') for string in strings] == [f'word_{word.start}_{word.end}' for word in words]
+        for string, word in zip(strings, words):
+            assert string.get('CONTENT') == text[word.start - page.range.start:word.end - page.range.start] == word.text
+            assert [int(string.get(name)) for name in ('HPOS', 'VPOS', 'WIDTH', 'HEIGHT')] == \
+                [word.x1, word.y1, max(0, word.x2 - word.x1), max(0, word.y2 - word.y1)]
+
+
+def test_alto_inverted_box(tmp_path):
+    # A word whose bbox has x1 > x2 gives its characters inverted boxes
+    (tmp_path / 'page.hocr').write_text('''<html><body><div class="ocr_page" title="bbox 0 0 100 100">
+<p class="ocr_par" title="bbox 0 0 100 20"><span class="ocr_line" title="bbox 0 0 100 20">
+<span class="ocrx_word" title="bbox 10 0 50 20; x_wconf 90">ab</span>
+<span class="ocrx_word" title="bbox 90 0 60 20; x_wconf 90">cd</span></span></p></div></body></html>
+''')
+    converter = _converter([str(tmp_path / 'page.hocr')])
+    converter.export_format(tmp_path / 'page.xml')
+
+    root = ElementTree.parse(tmp_path / 'page.xml').getroot()
+    widths = {element.get('ID'): int(element.get('WIDTH')) for element in root.iter() if element.get('WIDTH')}
+
+    assert min(widths.values()) >= 0
+    assert widths['word_3_5'] == 0
+
+
+def test_word_with_space(tmp_path):
+    (tmp_path / 'page.hocr').write_text(spaced_word_hocr)
+    converter = _converter([str(tmp_path / 'page.hocr')])
+    converter.export(tmp_path / 'page.eocr', structure_file = tmp_path / 'page.eocrs')
+    words = [(0, 8, 'New York'), (9, 13, 'City'), (15, 19, 'Hall')]
+
+    # The converter's structure keeps the words as they were in the hOCR
+    converter.export_format(tmp_path / 'converted.jsonl', granularity = 'word')
+    assert _read_words(tmp_path / 'converted.jsonl') == words
+
+    # So does the structure file of an .eocr
+    document = eocr_helper.load_eocr(tmp_path / 'page.eocr')
+    eocr_formats.write_document(document, tmp_path / 'loaded.jsonl', granularity = 'word',
+                                structure = eocr_structure.StructureIndex.read(tmp_path / 'page.eocrs'))
+    assert _read_words(tmp_path / 'loaded.jsonl') == words
+
+    # Without it, the words are told apart by the spaces between them
+    eocr_formats.write_document(document, tmp_path / 'spaces.jsonl', granularity = 'word')
+    assert _read_words(tmp_path / 'spaces.jsonl') == [(0, 3, 'New'), (4, 8, 'York')] + words[1:]
+
+
+def test_page_blocks_with_structure(sample_converter, sample_hocr_files, tmp_path):
+    sample_converter.export_format(tmp_path / 'document.hocr')
+    converter = HOCRToEOCRConverter()
+    converter.set_hocr_manifest(sample_hocr_files[:4])
+
+    # Pages written one at a time, with the structure of each page, are the same as the whole document
+    with eocr_formats.HOCRWriter(tmp_path / 'blocks.hocr') as writer:
+        for block in converter.iter_pages():
+            assert block.structure.count('words')
+            writer.write_page_block(block)
+
+    assert (tmp_path / 'blocks.hocr').read_text() == (tmp_path / 'document.hocr').read_text()
+
+
+def test_incomplete_writer(tmp_path):
+    class PageCountWriter(eocr_formats.LayoutWriter):
+        pass
+
+    with pytest.raises(TypeError, match = 'abstract'):
+        PageCountWriter(tmp_path / 'pages.txt')
@@ -0,0 +1,131 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import hashlib
+import struct
+import zlib
+
+import pytest
+
+from recognition_results_pb2 import Document
+import eocr_helper
+import eocr_index
+
+
+def _deflate(data, level, mode):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(mode)
+
+
+def _eocr_with_stored_blocks(serialized) -> bytes:
+    """
+    Compresses a serialized Document with a run of stored (level 0) blocks in the middle of the deflate stream,
+    between compressed ones that do not end on a byte boundary.
+    """
+    a, b = len(serialized) // 3, 2 * len(serialized) // 3
+    deflated = _deflate(serialized[:a], 9, zlib.Z_SYNC_FLUSH) + \
+        _deflate(serialized[a:b], 0, zlib.Z_SYNC_FLUSH) + \
+        _deflate(serialized[b:], 9, zlib.Z_FINISH)
+    body = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff' + deflated + \
+        struct.pack('<II', zlib.crc32(serialized), len(serialized) & 0xffffffff)
+
+    return eocr_helper.eocr_header + hashlib.sha1(body).digest() + body
+
+
+def _body(content) -> bytes:
+    return content[len(eocr_helper.eocr_header) + 20:]
+
+
+@pytest.fixture
+def sample_serialized(sample_eocr_content) -> bytes:
+    return zlib.decompress(_body(sample_eocr_content), 16 + zlib.MAX_WBITS)
+
+
+@pytest.mark.parametrize('span', [1, 1 << 30])
+def test_read_across_stored_blocks(sample_serialized, tmp_path, span):
+    # The first pages of the sample
+    document = Document.FromString(sample_serialized)
+    del document.pages[6:]
+    del document.characters[document.pages[-1].range.end:]
+
+    content = _eocr_with_stored_blocks(document.SerializeToString())
+    (tmp_path / 'stored.eocr').write_bytes(content)
+    eocr_index.write_index(content, tmp_path / 'stored.eocrx', span = span)
+
+    with eocr_index.EOCRReader(tmp_path / 'stored.eocr', tmp_path / 'stored.eocrx') as reader:
+        if span == 1:
+            # Some of the checkpoints before the stored blocks start part way into a byte
+            assert any(checkpoint.bit_offset % 8 for checkpoint in reader.index.checkpoints)
+
+        for number, expected in enumerate(document.pages):
+            page, characters = reader.read_page(number)
+            assert page == expected
+            assert characters == list(document.characters[page.range.start:page.range.end])
+
+        # From the start of the document to its end, across all the blocks
+        assert reader.read_characters(0, len(document.characters)) == list(document.characters)
+
+
+def test_read_from_every_block(sample_eocr_content, sample_serialized, tmp_path):
+    (tmp_path / 'sample.eocr').write_bytes(sample_eocr_content)
+    eocr_index.write_index(sample_eocr_content, tmp_path / 'sample.eocrx', span = 1)
+
+    with eocr_index.EOCRReader(tmp_path / 'sample.eocr', tmp_path / 'sample.eocrx') as reader:
+        checkpoints = reader.index.checkpoints
+
+        # A checkpoint at every block, most of which start part way into a byte
+        assert len(checkpoints) == len(eocr_index.get_deflate_blocks(_body(sample_eocr_content)))
+        assert {checkpoint.bit_offset % 8 for checkpoint in checkpoints} == set(range(8))
+
+        for checkpoint in checkpoints:
+            start = checkpoint.out_offset
+            assert reader.read_uncompressed(start, start + 100) == sample_serialized[start:start + 100]
+
+
+@pytest.mark.parametrize('span', [64 * 1024, eocr_index.checkpoint_span])
+def test_checkpoint_spacing(sample_eocr_content, span):
+    blocks = eocr_index.get_deflate_blocks(_body(sample_eocr_content))
+    largest_block = max(b[1] - a[1] for a, b in zip(blocks, blocks[1:]))
+    offsets = [checkpoint.out_offset for checkpoint in eocr_index.build_index(sample_eocr_content, span).checkpoints]
+
+    # Checkpoints are span apart, plus at most one deflate block
+    assert offsets[0] == 0
+    assert all(span <= b - a < span + largest_block for a, b in zip(offsets, offsets[1:]))
+    assert blocks[-1][1] - offsets[-1] < span + largest_block
+
+
+def test_index_round_trip(sample_eocr_content):
+    index = eocr_index.build_index(sample_eocr_content)
+    loaded = eocr_index.EOCRIndex.from_bytes(index.to_bytes())
+
+    assert loaded.digest == sample_eocr_content[len(eocr_helper.eocr_header):len(eocr_helper.eocr_header) + 20]
+    assert [(c.bit_offset, c.out_offset, c.window) for c in loaded.checkpoints] == \
+        [(c.bit_offset, c.out_offset, c.window) for c in index.checkpoints]
+    assert [(e.wire_start, e.wire_end, e.page) for e in loaded.pages] == \
+        [(e.wire_start, e.wire_end, e.page) for e in index.pages]
+
+
+def test_index_versions(sample_eocr_content):
+    content = eocr_index.build_index(sample_eocr_content).to_bytes()
+
+    # Version 1 indexes have the same layout
+    version_1 = eocr_index.EOCRIndex.from_bytes(b'eocrx 1\n' + content[len(eocr_index.index_header):])
+    assert len(version_1.checkpoints) == len(eocr_index.EOCRIndex.from_bytes(content).checkpoints)
+
+    with pytest.raises(Exception, match = 'Unsupported eOCR index version 3'):
+        eocr_index.EOCRIndex.from_bytes(b'eocrx 3\n' + content[len(eocr_index.index_header):])
+
+    with pytest.raises(Exception, match = 'Not an eOCR index file'):
+        eocr_index.EOCRIndex.from_bytes(b'PK\x03\x04')
@@ -0,0 +1,184 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import json
+import os
+import sqlite3
+
+import pytest
+
+import eocr_queue
+
+# The schema of the queues written before the tasks had a cost (schema version 0)
+schema_0 = """
+CREATE TABLE tasks (
+    id INTEGER PRIMARY KEY,
+    document TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    shard INTEGER NOT NULL,
+    shard_count INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_expires REAL,
+    error TEXT,
+    UNIQUE (document, kind, shard)
+);
+CREATE INDEX tasks_state ON tasks (state, kind, id);
+"""
+
+
+def _user_version(database) -> int:
+    connection = sqlite3.connect(database)
+    try:
+        return connection.execute('PRAGMA user_version').fetchone()[0]
+    finally:
+        connection.close()
+
+
+def test_new_queue(tmp_path):
+    with eocr_queue.WorkQueue(tmp_path / 'queue.db'):
+        pass
+
+    assert _user_version(tmp_path / 'queue.db') == eocr_queue.schema_version
+
+
+def test_migrate_schema_0(sample_hocr_files, tmp_path):
+    connection = sqlite3.connect(tmp_path / 'queue.db')
+    connection.executescript(schema_0)
+    connection.execute("INSERT INTO tasks (document, kind, shard, shard_count, payload) VALUES (?, 'convert', 0, 1, ?)",
+                       ('old', json.dumps({'hocr_files': sample_hocr_files[:1]})))
+    connection.commit()
+    connection.close()
+
+    with eocr_queue.WorkQueue(tmp_path / 'queue.db') as work_queue:
+        assert work_queue.counts()['pending'] == 1
+        work_queue.add_document('new', sample_hocr_files[:2], 'ab' * 16, tmp_path / 'new.eocr')
+
+        # The old task has a cost of 0, so the new (larger) one is claimed first
+        assert work_queue.claim('worker', 60).document == 'new'
+        assert work_queue.claim('worker', 60).document == 'old'
+
+    assert _user_version(tmp_path / 'queue.db') == eocr_queue.schema_version
+
+    # Opening the migrated queue again leaves it as it is
+    with eocr_queue.WorkQueue(tmp_path / 'queue.db') as work_queue:
+        assert work_queue.counts()['leased'] == 2
+
+
+def test_newer_schema_is_refused(tmp_path):
+    connection = sqlite3.connect(tmp_path / 'queue.db')
+    connection.execute(f'PRAGMA user_version = {eocr_queue.schema_version + 1}')
+    connection.close()
+
+    with pytest.raises(Exception, match = 'newer version'):
+        eocr_queue.WorkQueue(tmp_path / 'queue.db')
+
+
+@pytest.fixture
+def work_queue(tmp_path):
+    with eocr_queue.WorkQueue(tmp_path / 'queue.db', max_attempts = 2) as work_queue:
+        yield work_queue
+
+
+def test_expired_lease(work_queue, sample_hocr_files, tmp_path):
+    work_queue.add_document('sample', sample_hocr_files[:2], 'ab' * 16, tmp_path / 'sample.eocr')
+
+    # A lease that has expired is claimed again by another worker
+    lost = work_queue.claim('a', -1)
+    task = work_queue.claim('b', 60)
+    assert (task.id, task.worker, task.attempts) == (lost.id, 'b', 2)
+
+    # The first worker can no longer renew, complete or fail the task
+    assert not work_queue.heartbeat(lost, 60)
+    assert not work_queue.complete(lost)
+    assert not work_queue.fail(lost, 'error')
+    assert work_queue.counts()['leased'] == 1
+
+    assert work_queue.complete(task)
+    assert work_queue.counts()['done'] == 1
+
+
+def test_expired_last_attempt(work_queue, sample_hocr_files, tmp_path):
+    work_queue.add_document('sample', sample_hocr_files[:2], 'ab' * 16, tmp_path / 'sample.eocr')
+    work_queue.claim('a', -1)
+    work_queue.claim('b', -1)
+
+    # The lease of the last attempt expired, so the task is failed instead of claimed again
+    assert work_queue.claim('c', 60) is None
+    assert work_queue.failures() == [('sample', 'convert', 0, 2, 'lease expired on its last attempt, by b')]
+
+
+def test_heartbeat(work_queue, sample_hocr_files, tmp_path):
+    work_queue.add_document('sample', sample_hocr_files[:2], 'ab' * 16, tmp_path / 'sample.eocr')
+    task = work_queue.claim('a', -1)
+
+    # A renewed lease is not claimed by another worker
+    assert work_queue.heartbeat(task, 60)
+    assert work_queue.claim('b', 60) is None
+    assert work_queue.complete(task)
+
+
+def test_merge_after_last_shard(work_queue, sample_hocr_files, tmp_path):
+    assert work_queue.add_document('sample', sample_hocr_files[:3], 'ab' * 16, tmp_path / 'sample.eocr',
+                                   shard_pages = 1) == 3
+    tasks = [work_queue.claim('worker', 60) for _ in range(3)]
+    assert sorted(task.shard for task in tasks) == [0, 1, 2]
+
+    # The merge is only added once every shard is done
+    for task in tasks[:2]:
+        assert work_queue.complete(task)
+        assert work_queue.claim('worker', 60) is None
+
+    assert work_queue.complete(tasks[2])
+    merge = work_queue.claim('worker', 60)
+    assert (merge.kind, merge.document) == ('merge', 'sample')
+    assert merge.payload['part_files'] == [eocr_queue.get_part_file(str(tmp_path / 'sample.eocr'), shard)
+                                           for shard in range(3)]
+
+
+def test_publish_after_lost_lease(sample_hocr_files, tmp_path):
+    worker = eocr_queue.QueueWorker(tmp_path / 'queue.db', worker_id = 'a')
+    worker.queue.add_document('sample', sample_hocr_files[:2], 'ab' * 16, tmp_path / 'sample.eocr')
+    task = worker.queue.claim('a', -1)
+    heartbeat = eocr_queue._Heartbeat(worker.database, task, 60, 20)
+
+    def write(temporary_file):
+        with open(temporary_file, 'wb') as output:
+            output.write(b'eocr')
+
+    # Another worker claimed the task: the result is not published
+    with eocr_queue.WorkQueue(tmp_path / 'queue.db') as other_queue:
+        other_queue.claim('b', 60)
+
+    with pytest.raises(Exception, match = 'Lost the lease'):
+        worker._publish(task, heartbeat, str(tmp_path / 'sample.eocr'), write)
+    assert os.listdir(tmp_path) == ['queue.db']
+
+    # Nor is it when the heartbeat found the lease lost
+    worker.queue.add_document('other', sample_hocr_files[:1], 'ab' * 16, tmp_path / 'other.eocr')
+    task = worker.queue.claim('a', 60)
+    heartbeat = eocr_queue._Heartbeat(worker.database, task, 60, 20)
+    heartbeat.lost.set()
+    with pytest.raises(Exception, match = 'Lost the lease'):
+        worker._publish(task, heartbeat, str(tmp_path / 'other.eocr'), write)
+    assert os.listdir(tmp_path) == ['queue.db']
+
+    # A worker that holds the lease publishes the result
+    heartbeat.lost.clear()
+    worker._publish(task, heartbeat, str(tmp_path / 'other.eocr'), write)
+    assert (tmp_path / 'other.eocr').read_bytes() == b'eocr'
+    worker.queue.close()
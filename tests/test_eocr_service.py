@@ -0,0 +1,183 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import asyncio
+import gzip
+import io
+import json
+import os
+import tarfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from recognition_results_pb2 import Document
+import eocr_helper
+import eocr_service
+
+# A boundary with upper case letters, which are significant
+boundary = 'Boundary-AbCdEf123'
+
+
+def _multipart(pages) -> bytes:
+    parts = [f'--{boundary}\r\nContent-Disposition: form-data; name="pages"; filename="{name}"\r\n'
+             f'Content-Type: text/html\r\n\r\n'.encode() + content + b'\r\n' for name, content in pages]
+    return b''.join(parts) + f'--{boundary}--\r\n'.encode()
+
+
+async def _send(address, request) -> tuple:
+    """
+    Sends a raw HTTP request to a running service.
+
+    :return: A tuple of (status code, body)
+    """
+    reader, writer = await asyncio.open_connection(*address)
+    writer.write(request)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b'\r\n\r\n')
+    return int(head.split()[1]), body
+
+
+def _request(service, request) -> tuple:
+    """
+    Starts the service and sends a raw HTTP request to it.
+
+    :return: A tuple of (status code, body)
+    """
+    async def run():
+        server = await asyncio.start_server(service.handle, '127.0.0.1', 0)
+        async with server:
+            return await _send(server.sockets[0].getsockname()[:2], request)
+
+    return asyncio.run(run())
+
+
+def _convert_request(body, content_type = 'application/octet-stream') -> bytes:
+    return (f'POST /convert?md5=00ff HTTP/1.1\r\nContent-Type: {content_type}\r\n'
+            f'Content-Length: {len(body)}\r\n\r\n'.encode() + body)
+
+
+@pytest.fixture
+def sample_pages(sample_hocr_files) -> list:
+    pages = []
+    for hocr_file in sample_hocr_files[:2]:
+        with open(hocr_file, 'rb') as hocr:
+            pages.append((os.path.basename(hocr_file), hocr.read()))
+    return pages
+
+
+def test_read_multipart_upload(sample_pages):
+    content_type = f'Multipart/Form-Data; boundary={boundary}'
+
+    assert eocr_service.read_upload(content_type, _multipart(sample_pages)) == sample_pages
+
+
+@pytest.mark.parametrize('content_length', ['abc', '-1', '1e3', ''])
+def test_invalid_content_length(content_length):
+    status, body = _request(eocr_service.ConversionService(workers = 1),
+                            f'POST /convert?md5=00 HTTP/1.1\r\nContent-Length: {content_length}\r\n\r\n'.encode())
+
+    assert status == 400
+    assert 'Content-Length' in json.loads(body)['error']
+
+
+def test_convert_multipart_upload(sample_pages):
+    service = eocr_service.ConversionService(workers = 1)
+    service.start_pool()
+
+    try:
+        body = _multipart(sample_pages)
+        status, content = _request(service, _convert_request(body, f'multipart/form-data; boundary={boundary}'))
+    finally:
+        service.pool.shutdown()
+
+    assert status == 200
+    document = Document.FromString(eocr_helper.get_eocr_document_bytes(content))
+    assert len(document.pages) == 2
+    assert document.md5 == b'\x00\xff'
+
+
+def test_read_gzipped_page(sample_pages):
+    _, content = sample_pages[0]
+
+    assert eocr_service.read_upload(None, gzip.compress(content)) == [('page.hocr', content)]
+
+
+def test_read_gzipped_tar_upload(sample_pages):
+    archive_file = io.BytesIO()
+    with tarfile.open(fileobj = archive_file, mode = 'w:gz') as archive:
+        for name, content in sample_pages:
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            archive.addfile(info, io.BytesIO(content))
+
+    assert eocr_service.read_upload(None, archive_file.getvalue()) == sample_pages
+
+
+@pytest.mark.parametrize('body', [b'PK\x03\x04 not a zip file', gzip.compress(b'<html></html>', mtime = 0)[:-4]],
+                         ids = ['zip', 'gzip'])
+def test_read_invalid_archive(body):
+    with pytest.raises(ValueError):
+        eocr_service.read_upload('application/zip', body)
+
+
+def test_convert_gzipped_page_and_invalid_archive(sample_pages):
+    service = eocr_service.ConversionService(workers = 1)
+    service.start_pool()
+
+    try:
+        status, content = _request(service, _convert_request(gzip.compress(sample_pages[0][1]), 'application/gzip'))
+        invalid_status, invalid_content = _request(service, _convert_request(b'PK\x03\x04 not a zip file'))
+    finally:
+        service.pool.shutdown()
+
+    assert status == 200
+    assert len(Document.FromString(eocr_helper.get_eocr_document_bytes(content)).pages) == 1
+    assert invalid_status == 400
+    assert 'archive' in json.loads(invalid_content)['error']
+
+
+def test_upload_is_read_off_the_event_loop(sample_pages, monkeypatch):
+    read_upload = eocr_service.read_upload
+
+    def slow_read_upload(content_type, body):
+        time.sleep(1)
+        return read_upload(content_type, body)
+
+    monkeypatch.setattr(eocr_service, 'read_upload', slow_read_upload)
+    service = eocr_service.ConversionService(workers = 1)
+    service.pool = ThreadPoolExecutor(max_workers = 1)
+
+    async def run():
+        server = await asyncio.start_server(service.handle, '127.0.0.1', 0)
+        address = server.sockets[0].getsockname()[:2]
+        async with server:
+            conversion = asyncio.ensure_future(_send(address, _convert_request(gzip.compress(sample_pages[0][1]))))
+            await asyncio.sleep(0.1)
+            started = time.monotonic()
+            health = await _send(address, b'GET /health HTTP/1.1\r\n\r\n')
+            return health, time.monotonic() - started, await conversion
+
+    try:
+        (health_status, _), health_time, (status, _) = asyncio.run(run())
+    finally:
+        service.pool.shutdown()
+
+    assert health_status == 200
+    assert health_time < 0.5
+    assert status == 200
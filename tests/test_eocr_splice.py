@@ -0,0 +1,112 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import hashlib
+
+import pytest
+
+from recognition_results_pb2 import Document
+import eocr_helper
+import eocr_index
+import eocr_splice
+
+
+@pytest.fixture
+def sample_serialized(sample_eocr_content) -> bytes:
+    return eocr_helper.get_eocr_document_bytes(sample_eocr_content)
+
+
+def _document() -> eocr_splice.DocumentParts:
+    """
+    Three pages of four characters, with a font size and a header that cross page boundaries, and a table on the
+    first and the last page.
+    """
+    document = eocr_helper.new_document()
+
+    for n, text in enumerate(['abcd', 'efgh', 'ijkl']):
+        for c in text:
+            document.characters.append(eocr_helper.new_character(c, 0, 0, 10, 10, 0))
+        document.pages.append(eocr_helper.new_page(4 * n, 4 * n + 4, 100, 100))
+
+    document.font_sizes.append(eocr_helper.new_font_size(2, 10, 11))
+    document.headers.append(eocr_helper.new_header(4, 6))
+    document.tables.add(id = 0, page_number = 0)
+    document.tables.add(id = 1, page_number = 2)
+    document.table_cells.add(id = 0, left_border_width = 1)
+    document.table_cells.add(id = 1, left_border_width = 2)
+    document.md5 = hashlib.md5(b'source').digest()
+
+    return eocr_splice.split_document(document.SerializeToString())
+
+
+def _ranges(layer):
+    return [(item.range.start, item.range.end) for item in layer]
+
+
+def _text(parts: eocr_splice.DocumentParts):
+    document = Document.FromString(eocr_splice.to_serialized(parts))
+    return ''.join(chr(c.unicode) for c in document.characters)
+
+
+@pytest.mark.parametrize('cuts', [[33], [1, 33], [10, 20, 33], list(range(1, 34))])
+def test_slice_and_concatenate(sample_serialized, cuts):
+    parts = eocr_splice.split_document(sample_serialized)
+    slices = [eocr_splice.slice_pages(parts, start, end) for start, end in zip([0] + cuts, cuts)]
+
+    assert eocr_splice.to_serialized(eocr_splice.concatenate(slices)) == sample_serialized
+
+
+def test_read_page_range(sample_eocr_content, sample_serialized, tmp_path):
+    (tmp_path / 'sample.eocr').write_bytes(sample_eocr_content)
+    eocr_index.write_index(sample_eocr_content, tmp_path / 'sample.eocrx', span = 4096)
+    parts = eocr_splice.split_document(sample_serialized)
+
+    with eocr_index.EOCRReader(tmp_path / 'sample.eocr', tmp_path / 'sample.eocrx') as reader:
+        for start, end in [(0, 1), (5, 9), (32, 33), (0, 33)]:
+            read = eocr_splice.read_page_range(reader, start, end)
+            sliced = eocr_splice.slice_pages(parts, start, end)
+
+            assert read.characters == sliced.characters
+            assert read.offsets == sliced.offsets
+            assert list(read.document.pages) == list(sliced.document.pages)
+
+
+def test_slice_layers_and_tables():
+    sliced = eocr_splice.slice_pages(_document(), 1, 3)
+
+    assert _text(sliced) == 'efghijkl'
+    assert _ranges(sliced.document.pages) == [(0, 4), (4, 8)]
+    assert _ranges(sliced.document.font_sizes) == [(0, 6)]
+    assert _ranges(sliced.document.headers) == [(0, 2)]
+    assert [(t.id, t.page_number) for t in sliced.document.tables] == [(1, 1)]
+    assert [(c.id, c.left_border_width) for c in sliced.document.table_cells] == [(1, 2)]
+
+
+def test_concatenate_layers_and_tables():
+    parts = _document()
+    joined = eocr_splice.concatenate([parts, eocr_splice.slice_pages(parts, 0, 1), parts])
+
+    assert _text(joined) == 'abcdefghijkl' + 'abcd' + 'abcdefghijkl'
+    assert _ranges(joined.document.pages) == [(0, 4), (4, 8), (8, 12), (12, 16), (16, 20), (20, 24), (24, 28)]
+    assert _ranges(joined.document.font_sizes) == [(2, 10), (14, 16), (18, 26)]
+    assert _ranges(joined.document.headers) == [(4, 6), (20, 22)]
+    assert [(t.id, t.page_number) for t in joined.document.tables] == [(0, 0), (1, 2), (2, 3), (3, 4), (4, 6)]
+    assert [(c.id, c.left_border_width) for c in joined.document.table_cells] == [(0, 1), (1, 2), (2, 1), (3, 1),
+                                                                                   (4, 2)]
+
+
+def test_empty_page_range():
+    with pytest.raises(Exception, match = 'empty'):
+        eocr_splice.slice_pages(_document(), 3, 4)
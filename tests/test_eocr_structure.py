@@ -0,0 +1,112 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import hashlib
+
+import pytest
+
+from HOCRToEOCRConverter import HOCRToEOCRConverter
+import eocr_structure
+import hocr_helper
+
+
+def _structure() -> eocr_structure.StructureIndex:
+    """
+    One page of ten characters: "ab cd" on one line and "ef" on the next, in a single paragraph.
+    """
+    structure = eocr_structure.StructureIndex()
+    for start, end in [(0, 2), (3, 5), (6, 8)]:
+        structure.add('words', start, end)
+    structure.add('lines', 0, 5)
+    structure.add('lines', 6, 8)
+    structure.add('paragraphs', 0, 8)
+    structure.add('pages', 0, 10)
+    return structure
+
+
+def _spans(structure, level) -> list:
+    return [structure.span(level, i) for i in range(structure.count(level))]
+
+
+def test_children_and_parent():
+    structure = _structure()
+
+    assert structure.children('lines', 0) == range(0, 2)
+    assert structure.children('lines', 1) == range(2, 3)
+    assert structure.children('paragraphs', 0) == range(0, 2)
+    assert [structure.parent('words', i) for i in range(3)] == [0, 0, 1]
+    assert structure.parent('lines', 1) == 0
+
+
+def test_find_and_expand():
+    structure = _structure()
+
+    assert structure.find('words', 3) == 1
+    assert structure.find('words', 2) is None
+    assert structure.find('lines', 7) == 1
+    assert structure.expand(1, 4) == (0, 5)
+    assert structure.expand(4, 7) == (0, 8)
+    assert structure.expand(1, 4, level = 'words') == (0, 5)
+    assert structure.expand(5, 6, level = 'words') is None
+
+
+def test_extend():
+    structure = _structure()
+    structure.extend(_structure(), offset = 10)
+
+    assert _spans(structure, 'words') == [(0, 2), (3, 5), (6, 8), (10, 12), (13, 15), (16, 18)]
+    assert _spans(structure, 'pages') == [(0, 10), (10, 20)]
+    assert structure.children('lines', 2) == range(3, 5)
+    assert structure.children('paragraphs', 1) == range(2, 4)
+    assert structure.children('pages', 1) == range(1, 2)
+    assert structure.parent('words', 5) == 3
+    assert structure.parent('lines', 3) == 1
+
+
+def test_round_trip(tmp_path):
+    structure = _structure()
+    structure.extend(_structure(), offset = 10)
+    structure.write(tmp_path / 'structure')
+    read = eocr_structure.StructureIndex.read(tmp_path / 'structure')
+
+    assert read.to_bytes() == structure.to_bytes()
+    for level in eocr_structure.levels:
+        assert _spans(read, level) == _spans(structure, level)
+    assert read.children('lines', 2) == range(3, 5)
+
+    with pytest.raises(Exception, match = 'missing header'):
+        eocr_structure.StructureIndex.from_bytes(b'eocr' + structure.to_bytes())
+
+
+def test_converted_structure(sample_hocr_files):
+    converter = HOCRToEOCRConverter()
+    converter.set_hocr_manifest(sample_hocr_files[:2])
+    converter.set_document_md5(hashlib.md5(b'source').digest())
+    converter.start()
+
+    document = converter.zuva_document.to_document()
+    structure = converter.zuva_document.structure
+    text = ''.join(chr(c.unicode) for c in document.characters)
+    hocr_words = [word.text for hocr in sample_hocr_files[:2]
+                  for word in hocr_helper.get_words(hocr_helper.to_bs4(hocr))]
+
+    assert [text[start:end] for start, end in _spans(structure, 'words')] == hocr_words
+    assert _spans(structure, 'pages') == [(page.range.start, page.range.end) for page in document.pages]
+
+    # Each line runs from its first word to its last one
+    for line in range(structure.count('lines')):
+        words = structure.children('lines', line)
+        assert structure.span('lines', line) == (structure.span('words', words[0])[0],
+                                                 structure.span('words', words[-1])[1])
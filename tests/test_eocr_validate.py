@@ -0,0 +1,118 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from array import array
+
+import pytest
+
+from recognition_results_pb2 import Document
+import eocr_buffer
+import eocr_helper
+import eocr_validate
+
+with_numpy = pytest.param(True, marks = pytest.mark.skipif(eocr_validate.numpy is None,
+                                                           reason = 'numpy is not installed'))
+
+
+@pytest.fixture(params = [with_numpy, False], ids = ['numpy', 'builtins'])
+def numpy_mode(request, monkeypatch):
+    # Without numpy, the same checks run on the array.array columns
+    if not request.param:
+        monkeypatch.setattr(eocr_validate, 'numpy', None)
+        monkeypatch.setattr(eocr_buffer, 'numpy', None)
+    return request.param
+
+
+def _invalid_document() -> Document:
+    """
+    A document whose characters have unpaired surrogates, an error over 100 and an inverted box.
+    """
+    document = eocr_helper.new_document()
+    document.md5 = b'md5'
+    units = [ord('a'), 0xd800, ord('b'), 0xdc00, 0xd83d, 0xde00, ord('c'), 0xdbff]
+    document.characters.extend([eocr_helper.new_utf16_character(unit, i * 10, 0, i * 10 + 9, 20, 10)
+                                for i, unit in enumerate(units)])
+    document.characters[2].error = 101
+    document.characters[6].bounding_box.x1 = 90
+    document.pages.append(eocr_helper.new_page(0, len(units), 1000, 1000))
+    return document
+
+
+def _issues(issues) -> list:
+    return [(issue.check, issue.message, issue.page, issue.position) for issue in issues]
+
+
+def test_unpaired_surrogates(numpy_mode):
+    units = array(eocr_buffer.unicode_typecode, [0x61, 0xd800, 0x62, 0xdc00, 0xd83d, 0xde00, 0xd800, 0xd801, 0xdc37,
+                                                 0xdbff])
+
+    # Every one is found, not only the first; a high surrogate followed by a pair is unpaired
+    assert eocr_validate._get_unpaired_surrogates(units) == [1, 3, 6, 9]
+    assert eocr_validate._get_unpaired_surrogates(array(eocr_buffer.unicode_typecode)) == []
+
+
+def test_validate_content(numpy_mode):
+    document = _invalid_document()
+    issues = _issues(eocr_validate.validate_eocr_content(eocr_helper.get_eocr_file_content(document)))
+
+    assert issues == _issues(eocr_validate.validate_document(document))
+    assert [(check, position) for check, _, _, position in issues] == \
+        [('unicode', 1), ('unicode', 3), ('unicode', 7), ('error', 2), ('bounding_box', 6)]
+
+
+def test_validate_sample_without_messages(sample_eocr_content, monkeypatch):
+    if eocr_validate.numpy is None:
+        pytest.skip('numpy is not installed')
+
+    expected = _issues(eocr_validate.validate_document(
+        Document.FromString(eocr_helper.get_eocr_document_bytes(sample_eocr_content))))
+
+    # The characters of a file are decoded into columns, not parsed as Character messages
+    def append_character(self, character):
+        raise AssertionError('a Character message was parsed')
+
+    monkeypatch.setattr(eocr_buffer.CharacterBuffer, 'append_character', append_character)
+
+    # (The bundled .eocr was converted before the spaces between overlapping words were fixed)
+    assert _issues(eocr_validate.validate_eocr_content(sample_eocr_content)) == expected == \
+        [('bounding_box', 'x1 is greater than x2 for 6 character(s)', None, expected[0][3])]
+
+
+def test_characters_from_serialized(sample_eocr_content, numpy_mode):
+    document = Document.FromString(eocr_helper.get_eocr_document_bytes(sample_eocr_content))
+    # Fields that are 0 are not serialized, and large values take more bytes than the sample's
+    del document.characters[1000:]
+    document.characters.add(unicode = 0x20)
+    document.characters.add(unicode = 0xffff, error = 0, bounding_box = {'x1': 1 << 20, 'x2': (1 << 32) - 1})
+    expected = eocr_buffer.CharacterBuffer()
+    for character in document.characters:
+        expected.append_character(character)
+
+    serialized = Document(characters = document.characters).SerializeToString()
+    characters = eocr_buffer.CharacterBuffer.from_serialized(serialized)
+
+    if numpy_mode:
+        assert eocr_buffer._decode_characters(serialized) is not None
+
+    assert [getattr(characters, name) for name in eocr_buffer.columns] == \
+        [getattr(expected, name) for name in eocr_buffer.columns]
+
+
+def test_repeated_field():
+    # The last value of a repeated field is the one protobuf keeps, which the columns leave to it
+    serialized = b'\x12\x04\x08\x61\x08\x62'
+
+    assert eocr_buffer._decode_characters(serialized) is None
+    assert list(eocr_buffer.CharacterBuffer.from_serialized(serialized).unicode) == [0x62]
@@ -0,0 +1,107 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import hashlib
+import os
+
+import pytest
+
+from recognition_results_pb2 import Document
+from HOCRToEOCRConverter import HOCRToEOCRConverter
+import eocr_helper
+import eocr_index
+import eocr_writer
+
+# A page with an empty word, which fails to convert
+malformed_hocr = '''<html><body><div class="ocr_page" title="bbox 0 0 100 100">
+<p class="ocr_par" title="bbox 0 0 100 100"><span class="ocr_line" title="bbox 0 0 100 100">
+<span class="ocrx_word" title="x_wconf 90"></span></span></p></div></body></html>
+'''
+
+source_md5 = hashlib.md5(b'source').digest()
+
+
+def _converter(hocr_files) -> HOCRToEOCRConverter:
+    converter = HOCRToEOCRConverter()
+    converter.set_hocr_manifest(hocr_files)
+    converter.set_document_md5(source_md5)
+    return converter
+
+
+def test_index_over_parallel_output(sample_hocr_files, tmp_path, monkeypatch):
+    # Small blocks, so that the sample is compressed in many of them
+    monkeypatch.setattr(eocr_writer, 'parallel_block_size', 16 * 1024)
+
+    converter = _converter(sample_hocr_files)
+    converter.start()
+    converter.export(tmp_path / 'parallel.eocr', index_file = tmp_path / 'parallel.eocrx', workers = 2)
+
+    with open(tmp_path / 'parallel.eocr', 'rb') as eocr:
+        serialized = eocr_helper.get_eocr_document_bytes(eocr.read())
+    document = Document.FromString(serialized)
+
+    with eocr_index.EOCRReader(tmp_path / 'parallel.eocr', tmp_path / 'parallel.eocrx') as reader:
+        # The checkpoints are in the blocks compressed by the threads, one every span of the body
+        offsets = [checkpoint.out_offset for checkpoint in reader.index.checkpoints]
+        assert all(eocr_index.checkpoint_span <= b - a < 2 * eocr_index.checkpoint_span
+                   for a, b in zip(offsets, offsets[1:]))
+
+        for number, expected in enumerate(document.pages):
+            page, characters = reader.read_page(number)
+            assert page == expected
+            assert characters == list(document.characters[page.range.start:page.range.end])
+
+
+def test_stream_export(sample_hocr_files, tmp_path):
+    converter = _converter(sample_hocr_files[:4])
+    converter.start()
+    converter.export(tmp_path / 'export.eocr')
+    _converter(sample_hocr_files[:4]).stream_export(tmp_path / 'stream.eocr')
+
+    with open(tmp_path / 'export.eocr', 'rb') as eocr:
+        content = eocr.read()
+    with open(tmp_path / 'stream.eocr', 'rb') as eocr:
+        assert eocr.read() == content
+
+    # The same file as the one built in memory from the whole Document
+    document = Document.FromString(eocr_helper.get_eocr_document_bytes(content))
+    assert eocr_helper.get_eocr_file_content(document) == content
+    assert sorted(os.listdir(tmp_path)) == ['export.eocr', 'stream.eocr']
+
+
+def test_failed_export_keeps_output_file(sample_hocr_files, tmp_path):
+    (tmp_path / 'malformed.hocr').write_text(malformed_hocr)
+    (tmp_path / 'document.eocr').write_bytes(b'previous')
+    converter = _converter(sample_hocr_files[:2] + [str(tmp_path / 'malformed.hocr')])
+
+    with pytest.raises(ZeroDivisionError):
+        converter.stream_export(tmp_path / 'document.eocr')
+
+    # The previous file is left as it was, and the incomplete one is deleted
+    assert (tmp_path / 'document.eocr').read_bytes() == b'previous'
+    assert sorted(os.listdir(tmp_path)) == ['document.eocr', 'malformed.hocr']
+
+
+@pytest.mark.parametrize('workers', [None, 2])
+def test_writer_error(sample_hocr_files, tmp_path, workers):
+    converter = _converter(sample_hocr_files[:1])
+    block = next(converter.iter_pages())
+
+    with pytest.raises(Exception, match = 'The page starts at character 0'):
+        with eocr_writer.EOCRWriter(tmp_path / 'document.eocr', source_md5, workers = workers) as writer:
+            writer.write_page_block(block)
+            writer.write_page_block(block)
+
+    assert os.listdir(tmp_path) == []
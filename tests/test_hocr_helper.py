@@ -0,0 +1,156 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import tarfile
+import zipfile
+
+import pytest
+
+from HOCRToEOCRConverter import HOCRToEOCRConverter
+import hocr_helper
+
+
+def _converter(**kwargs) -> HOCRToEOCRConverter:
+    converter = HOCRToEOCRConverter()
+    for name, value in kwargs.items():
+        setattr(converter, name, value)
+    converter.set_document_md5(hashlib.md5(b'source').digest())
+    converter.start()
+    return converter
+
+
+def _text(converter) -> str:
+    return ''.join(chr(c.unicode) for c in converter.zuva_document.to_document().characters)
+
+
+def test_natural_sort_key():
+    names = ['doc2-page-10.hocr', 'doc10-page-1.hocr', 'doc2-page-9.hocr', 'doc2-page-0.hocr']
+
+    assert sorted(names, key = hocr_helper.natural_sort_key) == \
+        ['doc2-page-0.hocr', 'doc2-page-9.hocr', 'doc2-page-10.hocr', 'doc10-page-1.hocr']
+
+
+def test_get_page_number():
+    assert hocr_helper.get_page_number('page-0012.hocr') == 12
+    assert hocr_helper.get_page_number('doc2-page-0012.hocr') == 12
+
+
+@pytest.mark.parametrize('content', [json.dumps(['b.hocr', 'pages/a.hocr']),
+                                     json.dumps({'pages': ['b.hocr', 'pages/a.hocr']}),
+                                     'b.hocr\n\n  pages/a.hocr  \n'], ids = ['json', 'json-object', 'lines'])
+def test_read_manifest(tmp_path, content):
+    (tmp_path / 'manifest').write_text(content)
+
+    assert hocr_helper.read_manifest(str(tmp_path / 'manifest')) == \
+        [os.path.join(str(tmp_path), 'b.hocr'), os.path.join(str(tmp_path), 'pages/a.hocr')]
+
+
+def test_folder_order(sample_hocr_files, tmp_path):
+    # Sorted as text, page-10 would come before page-9
+    shutil.copy(sample_hocr_files[0], tmp_path / 'page-9.hocr')
+    shutil.copy(sample_hocr_files[1], tmp_path / 'page-10.hocr')
+    (tmp_path / 'notes.txt').write_text('not a page')
+    (tmp_path / 'folder.hocr').mkdir()
+
+    converter = _converter(hocr_folder = str(tmp_path))
+
+    assert converter.get_hocr_files() == ['page-9.hocr', 'page-10.hocr']
+    assert _text(converter) == _text(_converter(hocr_manifest = sample_hocr_files[:2]))
+
+
+def test_manifest_order(sample_hocr_files, tmp_path):
+    # The manifest's order is kept, and the hocr_folder is not scanned
+    (tmp_path / 'manifest.json').write_text(json.dumps([sample_hocr_files[1], sample_hocr_files[0]]))
+
+    converter = HOCRToEOCRConverter()
+    converter.hocr_folder = str(tmp_path / 'missing')
+    converter.set_hocr_manifest(str(tmp_path / 'manifest.json'))
+    converter.set_document_md5(hashlib.md5(b'source').digest())
+    converter.start()
+
+    first = _converter(hocr_manifest = sample_hocr_files[1:2])
+    second = _converter(hocr_manifest = sample_hocr_files[0:1])
+
+    assert len(converter.zuva_document.pages) == 2
+    assert _text(converter) == _text(first) + _text(second)
+
+
+def _archive_members(hocr_files, compress) -> list:
+    """
+    The pages as archive members named page-<n>.hocr (or .hocr.gz), stored out of order, with a member that is
+    not a page.
+    """
+    members = [('readme.txt', b'not a page')]
+    for n, hocr in enumerate(hocr_files):
+        with open(hocr, 'rb') as page:
+            content = page.read()
+        if compress:
+            members.append((f'pages/page-{n + 8}.hocr.gz', gzip.compress(content, mtime = 0)))
+        else:
+            members.append((f'pages/page-{n + 8}.hocr', content))
+
+    return list(reversed(members))
+
+
+def _write_archive(archive_file, members, mode):
+    if mode == 'zip':
+        with zipfile.ZipFile(archive_file, 'w') as archive:
+            for name, content in members:
+                archive.writestr(name, content)
+        return
+
+    with tarfile.open(archive_file, mode) as archive:
+        for name, content in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            archive.addfile(info, io.BytesIO(content))
+
+
+@pytest.mark.parametrize('mode, compress', [('zip', False), ('w:gz', False), ('w', True)],
+                         ids = ['zip', 'tar.gz', 'tar-of-hocr.gz'])
+def test_archive(sample_hocr_files, tmp_path, mode, compress):
+    hocr_files = sample_hocr_files[:3]
+    _write_archive(tmp_path / 'pages', _archive_members(hocr_files, compress), mode)
+
+    names = [name for name, _ in hocr_helper.iter_archive(str(tmp_path / 'pages'))]
+    assert [os.path.basename(name) for name in names] == \
+        [f'page-{n}.hocr.gz' if compress else f'page-{n}.hocr' for n in (8, 9, 10)]
+
+    expected = _converter(hocr_manifest = hocr_files).zuva_document.SerializeToString()
+    with open(tmp_path / 'pages', 'rb') as archive:
+        for source in [str(tmp_path / 'pages'), archive]:
+            converter = HOCRToEOCRConverter()
+            converter.set_hocr_archive(source)
+            converter.set_document_md5(hashlib.md5(b'source').digest())
+            converter.start()
+
+            assert converter.zuva_document.SerializeToString() == expected
+
+
+def test_gzipped_folder(sample_hocr_files, tmp_path):
+    for name, content in _archive_members(sample_hocr_files[:3], compress = True):
+        (tmp_path / os.path.basename(name)).write_bytes(content)
+
+    converter = _converter(hocr_folder = str(tmp_path))
+
+    assert converter.get_hocr_files() == ['page-8.hocr.gz', 'page-9.hocr.gz', 'page-10.hocr.gz']
+    assert converter.zuva_document.SerializeToString() == \
+        _converter(hocr_manifest = sample_hocr_files[:3]).zuva_document.SerializeToString()
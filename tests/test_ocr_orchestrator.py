@@ -0,0 +1,155 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import hashlib
+import os
+import shutil
+import threading
+import time
+
+import pytest
+
+from HOCRToEOCRConverter import HOCRToEOCRConverter
+from ocr_orchestrator import FakeOCREngine, FakeRasterizer, OCREngine, OCROrchestrator, Rasterizer
+
+page_count = 6
+
+
+class ReversedOCREngine(FakeOCREngine):
+    """
+    Replays the .hocr files, the later pages faster than the earlier ones, so that they are OCR'd out of order. It
+    also records the page images that exist while each page is OCR'd.
+    """
+    def __init__(self, hocr_folder):
+        super().__init__(hocr_folder)
+        self.finished = []
+        self.images = []
+        self._lock = threading.Lock()
+
+    def ocr(self, image_file) -> str:
+        with open(image_file) as image:
+            page_number = int(image.read())
+
+        with self._lock:
+            self.images.append(len(os.listdir(os.path.dirname(image_file))))
+
+        time.sleep(0.02 * (page_count - page_number))
+        with self._lock:
+            self.finished.append(page_number)
+
+        return super().ocr(image_file)
+
+
+class FailingOCREngine(FakeOCREngine):
+    def __init__(self, hocr_folder, failing_page):
+        super().__init__(hocr_folder)
+        self.failing_page = failing_page
+
+    def ocr(self, image_file) -> str:
+        with open(image_file) as image:
+            if int(image.read()) == self.failing_page:
+                raise RuntimeError(f'OCR failed on page {self.failing_page}')
+
+        return super().ocr(image_file)
+
+
+@pytest.fixture
+def hocr_folder(sample_hocr_files, tmp_path) -> str:
+    """
+    A folder of the sample's first pages, which the fake OCR engines replay.
+    """
+    folder = tmp_path / 'hocr'
+    folder.mkdir()
+    for hocr_file in sample_hocr_files[:page_count]:
+        shutil.copy(hocr_file, folder)
+    return str(folder)
+
+
+@pytest.fixture
+def source_file(tmp_path) -> str:
+    (tmp_path / 'source.pdf').write_bytes(b'%PDF-1.4 placeholder')
+    return str(tmp_path / 'source.pdf')
+
+
+def _export(converter, eocr_file) -> bytes:
+    converter.export(eocr_file)
+    with open(eocr_file, 'rb') as eocr:
+        return eocr.read()
+
+
+def _start(hocr_folder, source_file, eocr_file) -> bytes:
+    """
+    Converts the .hocr files with start(), as if they had been OCR'd by doOcr.sh, and returns the .eocr.
+    """
+    converter = HOCRToEOCRConverter()
+    converter.hocr_folder = hocr_folder
+    with open(source_file, 'rb') as source:
+        converter.set_document_md5(hashlib.md5(source.read()).digest())
+    converter.start()
+    return _export(converter, eocr_file)
+
+
+def test_run(hocr_folder, source_file, tmp_path):
+    orchestrator = OCROrchestrator(FakeRasterizer(page_count), FakeOCREngine(hocr_folder, delay = 0.01), workers = 3,
+                                   hocr_folder = str(tmp_path / 'out'))
+    converter = orchestrator.run(source_file)
+
+    # The md5 is the source file's, and the .hocr of each page is kept in hocr_folder
+    assert _export(converter, tmp_path / 'run.eocr') == _start(hocr_folder, source_file, tmp_path / 'start.eocr')
+    assert sorted(os.listdir(tmp_path / 'out')) == [f'page-{page:04d}.hocr' for page in range(page_count)]
+
+
+def test_run_out_of_order(hocr_folder, source_file, tmp_path):
+    engine = ReversedOCREngine(hocr_folder)
+    orchestrator = OCROrchestrator(FakeRasterizer(page_count), engine, workers = 3)
+    converter = orchestrator.run(source_file)
+
+    # The pages are OCR'd out of order, but converted in page order
+    assert engine.finished != sorted(engine.finished)
+    assert _export(converter, tmp_path / 'run.eocr') == _start(hocr_folder, source_file, tmp_path / 'start.eocr')
+
+    # Each image is deleted once its page is OCR'd, so there are never more images than workers
+    assert max(engine.images) <= 3
+
+
+def test_run_max_pending(hocr_folder, source_file, tmp_path):
+    # Only one page is OCR'd ahead of the conversion
+    orchestrator = OCROrchestrator(FakeRasterizer(page_count), FakeOCREngine(hocr_folder), workers = 2,
+                                   max_pending = 1)
+    converter = orchestrator.run(source_file)
+
+    assert _export(converter, tmp_path / 'run.eocr') == _start(hocr_folder, source_file, tmp_path / 'start.eocr')
+
+
+def test_engine_failure(hocr_folder, source_file):
+    orchestrator = OCROrchestrator(FakeRasterizer(page_count), FailingOCREngine(hocr_folder, 3), workers = 2)
+    converter = HOCRToEOCRConverter()
+
+    with pytest.raises(RuntimeError, match = 'OCR failed on page 3'):
+        orchestrator.run(source_file, converter)
+
+    # The pages before the failing one were converted
+    assert len(converter.zuva_document.pages) == 3
+
+
+def test_incomplete_backends():
+    class PageCountRasterizer(Rasterizer):
+        def get_page_count(self, source_file) -> int:
+            return 1
+
+    # A rasterizer or engine that does not implement every method cannot be created
+    for backend in [Rasterizer, OCREngine, PageCountRasterizer]:
+        with pytest.raises(TypeError, match = 'abstract'):
+            backend()
@@ -0,0 +1,126 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import hashlib
+import os
+import queue
+import shutil
+import threading
+import time
+
+import pytest
+
+from HOCRToEOCRConverter import HOCRToEOCRConverter
+
+page_count = 8
+
+# The order the fake OCR finishes the pages in: not in page order, like parallel OCR
+ocr_order = [1, 0, 3, 2, 6, 4, 7, 5]
+
+source_md5 = hashlib.md5(b'source').digest()
+
+
+class FakeOCR(threading.Thread):
+    """
+    Writes the sample's .hocr files to a folder one by one, in ocr_order, as an OCR process would: each file is
+    first written in part, and completed a little later. The file paths are also put on page_queue once complete.
+    """
+    def __init__(self, hocr_files, folder, page_queue = None, delay = 0.01):
+        super().__init__(daemon = True)
+        self.hocr_files = hocr_files
+        self.folder = folder
+        self.page_queue = page_queue
+        self.delay = delay
+
+    def run(self):
+        for page in ocr_order:
+            with open(self.hocr_files[page], 'rb') as hocr:
+                content = hocr.read()
+
+            hocr_file = os.path.join(self.folder, os.path.basename(self.hocr_files[page]))
+            with open(hocr_file, 'wb') as output:
+                output.write(content[:len(content) // 2])
+                output.flush()
+                time.sleep(self.delay)
+                output.write(content[len(content) // 2:])
+
+            if self.page_queue is not None:
+                self.page_queue.put(hocr_file)
+            time.sleep(self.delay)
+
+        if self.page_queue is not None:
+            self.page_queue.put(None)
+
+
+@pytest.mark.parametrize('mode', ['queue', 'watch'])
+def test_start_pipelined(sample_hocr_files, tmp_path, mode):
+    # The same pages, converted with start() once they are all OCR'd
+    expected_folder = tmp_path / 'expected'
+    expected_folder.mkdir()
+    for hocr_file in sample_hocr_files[:page_count]:
+        shutil.copy(hocr_file, expected_folder)
+
+    expected = HOCRToEOCRConverter()
+    expected.hocr_folder = str(expected_folder)
+    expected.set_document_md5(source_md5)
+    expected.start()
+    expected.export(tmp_path / 'expected.eocr')
+
+    ocr_folder = tmp_path / 'ocr'
+    ocr_folder.mkdir()
+    page_queue = queue.Queue() if mode == 'queue' else None
+    ocr = FakeOCR(sample_hocr_files, ocr_folder, page_queue)
+
+    converter = HOCRToEOCRConverter()
+    converter.hocr_folder = str(ocr_folder)
+    converter.set_document_md5(source_md5)
+    ocr.start()
+    converter.start_pipelined(page_count, page_queue = page_queue, poll_interval = 0.005, timeout = 30)
+    ocr.join()
+    converter.export(tmp_path / 'pipelined.eocr')
+
+    assert (tmp_path / 'pipelined.eocr').read_bytes() == (tmp_path / 'expected.eocr').read_bytes()
+
+
+def test_start_pipelined_queue_ends_early(sample_hocr_files):
+    page_queue = queue.Queue()
+    page_queue.put(sample_hocr_files[0])
+    page_queue.put(None)
+
+    converter = HOCRToEOCRConverter()
+    converter.set_document_md5(source_md5)
+
+    with pytest.raises(Exception, match = 'ended after 1 of 2'):
+        converter.start_pipelined(2, page_queue = page_queue)
+
+
+def test_start_pipelined_timeout(sample_hocr_files, tmp_path):
+    # Page 1 never comes
+    shutil.copy(sample_hocr_files[0], tmp_path / 'page-0.hocr')
+
+    converter = HOCRToEOCRConverter()
+    converter.hocr_folder = str(tmp_path)
+    converter.set_document_md5(source_md5)
+
+    with pytest.raises(Exception, match = 'Timed out waiting for page 1'):
+        converter.start_pipelined(2, poll_interval = 0.01, timeout = 0.2)
+
+
+def test_start_pipelined_needs_md5(tmp_path):
+    converter = HOCRToEOCRConverter()
+    converter.hocr_folder = str(tmp_path)
+
+    with pytest.raises(Exception, match = 'source_hash must be provided'):
+        converter.start_pipelined(1)
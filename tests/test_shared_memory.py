@@ -0,0 +1,93 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# The pages converted by worker processes are handed back in shared memory segments, which must be freed even when
+# the conversion stops early.
+
+
+import os
+
+import pytest
+
+from HOCRToEOCRConverter import HOCRToEOCRConverter
+import eocr_batch
+
+# A page with an empty word, which fails to convert
+malformed_hocr = '''<html><body><div class="ocr_page" title="bbox 0 0 100 100">
+<p class="ocr_par" title="bbox 0 0 100 100"><span class="ocr_line" title="bbox 0 0 100 100">
+<span class="ocrx_word" title="x_wconf 90"></span></span></p></div></body></html>
+'''
+
+
+def _segments() -> set:
+    return {name for name in os.listdir('/dev/shm') if name.startswith('psm_')}
+
+
+def _converter(hocr_files, **kwargs) -> HOCRToEOCRConverter:
+    converter = HOCRToEOCRConverter(**kwargs)
+    converter.set_hocr_manifest(hocr_files)
+    converter.set_document_md5(b'test')
+    return converter
+
+
+@pytest.fixture
+def malformed_file(tmp_path):
+    hocr_file = tmp_path / 'malformed.hocr'
+    hocr_file.write_text(malformed_hocr)
+    return str(hocr_file)
+
+
+pytestmark = pytest.mark.skipif(not os.path.isdir('/dev/shm'), reason = 'the segments are listed in /dev/shm')
+
+
+def test_error_frees_converted_files(sample_hocr_files, malformed_file):
+    before = _segments()
+    converter = _converter([malformed_file] + sample_hocr_files[:6])
+
+    with pytest.raises(ZeroDivisionError):
+        converter.start(workers = 2, mode = 'process')
+
+    assert _segments() == before
+
+
+def test_stopping_frees_converted_files(sample_hocr_files):
+    before = _segments()
+    converter = _converter(sample_hocr_files[:6])
+
+    converted = converter._iter_converted_files(2, 'process')
+    next(converted)
+    converted.close()
+
+    assert _segments() == before
+
+
+def test_timeout_frees_converted_files(sample_hocr_files):
+    before = _segments()
+    # Every file times out, with the files converted ahead of it (if any) on the replaced pools
+    converter = _converter(sample_hocr_files[:4], on_error = 'skip', page_timeout = 0.001)
+    converter.start(workers = 2, mode = 'process')
+
+    assert _segments() == before
+
+
+def test_batch_error_frees_converted_shards(sample_hocr_files, malformed_file, tmp_path):
+    before = _segments()
+    documents = [eocr_batch.BatchDocument('sample', sample_hocr_files[:6], b'test', tmp_path / 'sample.eocr'),
+                 eocr_batch.BatchDocument('malformed', [malformed_file], b'test', tmp_path / 'malformed.eocr')]
+
+    # The malformed document is the smallest, so it is converted last
+    with pytest.raises(ZeroDivisionError):
+        eocr_batch.convert_batch(documents, workers = 2, mode = 'process', order = 'fifo', shard_bytes = 1)
+
+    assert _segments() == before
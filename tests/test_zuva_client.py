@@ -0,0 +1,224 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+import asyncio
+import time
+
+import pytest
+
+import zuva_client
+from zuva_mock_server import MockZuvaServer
+
+
+class DroppingServer(MockZuvaServer):
+    """
+    A mock server that handles the first request of drop_method, and then closes its connection without responding.
+    """
+    def __init__(self, drop_method, **kwargs):
+        super().__init__(**kwargs)
+        self.drop_method = drop_method
+        self._dropping = False
+
+    def _route(self, method, path, body):
+        self._dropping = method == self.drop_method and self.drop_method is not None
+        return super()._route(method, path, body)
+
+    async def _respond(self, writer, status, content, headers = None):
+        if self._dropping:
+            self.drop_method = self._dropping = None
+            writer.close()
+            raise ConnectionResetError('dropped')
+
+        await super()._respond(writer, status, content, headers)
+
+
+class FlakyServer(MockZuvaServer):
+    """
+    A mock server that answers the first errors job polls with a 500, and the first busy requests with a 429 and
+    retry_after.
+    """
+    def __init__(self, errors = 0, busy = 0, **kwargs):
+        super().__init__(**kwargs)
+        self.errors = errors
+        self.busy = busy
+        self.polls = 0
+
+    def _route(self, method, path, body):
+        if method == 'GET' and path.strip('/').split('/')[0] in zuva_client.job_kinds:
+            self.polls += 1
+            if self.errors:
+                self.errors -= 1
+                return 500, {'error': 'Internal error'}
+
+        return super()._route(method, path, body)
+
+    async def _respond(self, writer, status, content, headers = None):
+        if self.busy:
+            self.busy -= 1
+            status, content, headers = 429, {'error': 'Too many requests'}, {'Retry-After': self.retry_after}
+
+        await super()._respond(writer, status, content, headers)
+
+
+def _run(test, server):
+    async def run():
+        url = await server.start()
+        client = zuva_client.ZuvaClient(url, max_in_flight = 4, max_retries = 3)
+        try:
+            return await test(client)
+        finally:
+            await client.close()
+            await server.close()
+
+    return asyncio.run(run())
+
+
+def test_poll_jobs():
+    server = MockZuvaServer(job_duration = 0.05)
+
+    async def test(client):
+        file_ids = [await client.create_file(b'eocr') for _ in range(3)]
+        poller = zuva_client.JobPoller(client, initial_interval = 0.01, max_interval = 0.05)
+        poller.add_all(await client.create_jobs('classification', file_ids))
+        poller.add_all(await client.create_jobs('extraction', file_ids[:1]))
+        return await poller.wait()
+
+    jobs = _run(test, server)
+
+    assert len(jobs) == 4
+    assert all(job.status == 'complete' and job.error is None for job in jobs)
+    assert [job.result['results'][0]['field_id'] for job in jobs if job.kind == 'extraction'] == ['title']
+
+
+@pytest.mark.parametrize('asynchronous', [False, True])
+def test_callback_error(asynchronous):
+    server = MockZuvaServer(job_duration = 0.01)
+
+    def callback(job):
+        raise ValueError(f'callback of {job.request_id}')
+
+    async def async_callback(job):
+        callback(job)
+
+    async def test(client):
+        file_ids = [await client.create_file(b'eocr') for _ in range(3)]
+        poller = zuva_client.JobPoller(client, async_callback if asynchronous else callback, initial_interval = 0.01)
+        poller.add_all(await client.create_jobs('language', file_ids))
+        return await asyncio.wait_for(poller.wait(), 10)
+
+    jobs = _run(test, server)
+
+    # Every job is finished, with the error of its callback
+    assert len(jobs) == 3
+    assert all(job.status == 'complete' for job in jobs)
+    assert [str(job.callback_error) for job in jobs] == [f'callback of {job.request_id}' for job in jobs]
+
+
+def test_closed_idle_connections():
+    # The server closes each connection after one request, while the client keeps it as idle
+    server = MockZuvaServer(max_requests_per_connection = 1)
+
+    async def test(client):
+        for _ in range(3):
+            await client.create_file(b'eocr')
+            await asyncio.sleep(0.05)
+        return client.pool.opened
+
+    assert _run(test, server) == 3
+    assert len(server.files) == 3
+
+
+def test_post_is_not_sent_again():
+    server = DroppingServer('POST')
+
+    async def test(client):
+        await client.request('GET', '/metrics')
+        # The upload is handled on the reused connection, which is then lost
+        with pytest.raises(ConnectionError):
+            await client.create_file(b'eocr')
+
+    _run(test, server)
+    assert len(server.files) == 1
+
+
+def test_get_is_sent_again():
+    server = DroppingServer('GET')
+
+    async def test(client):
+        file_id = await client.create_file(b'eocr')
+        return file_id, await client.request('GET', '/metrics')
+
+    file_id, metrics = _run(test, server)
+    assert file_id == 'file-00000000'
+    assert metrics['files'] == 1
+
+
+def test_get_retry_after():
+    in_a_minute = format_datetime(datetime.now(timezone.utc) + timedelta(seconds = 60), usegmt = True)
+
+    assert zuva_client.get_retry_after('120') == 120
+    assert zuva_client.get_retry_after('0.5') == 0.5
+    assert 55 < zuva_client.get_retry_after(in_a_minute) <= 60
+    assert zuva_client.get_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0
+    assert zuva_client.get_retry_after('-5') == 0
+    assert zuva_client.get_retry_after('soon') is None
+    assert zuva_client.get_retry_after('nan') is None
+
+
+@pytest.mark.parametrize('retry_after', ['Fri, 31 Dec 2100 23:59:59 GMT', '86400'])
+def test_retry_after_is_capped(retry_after):
+    server = FlakyServer(busy = 2, retry_after = retry_after)
+
+    async def test(client):
+        client.max_retry_delay = 0.05
+        started = time.monotonic()
+        await asyncio.wait_for(client.request('GET', '/metrics'), 5)
+        return time.monotonic() - started
+
+    assert _run(test, server) < 2
+    assert server.requests == 3
+
+
+def test_poll_errors():
+    # The job is polled through the errors
+    server = FlakyServer(errors = 3, job_duration = 0.01)
+
+    async def test(client):
+        poller = zuva_client.JobPoller(client, initial_interval = 0.01, max_interval = 0.02, max_errors = 4)
+        poller.add_all(await client.create_jobs('language', [await client.create_file(b'eocr')]))
+        return await asyncio.wait_for(poller.wait(), 10)
+
+    job, = _run(test, server)
+
+    assert job.status == 'complete' and job.error is None
+    assert server.polls == 4
+
+
+def test_poll_errors_give_up():
+    # The job is given up after max_errors failed polls in a row
+    server = FlakyServer(errors = 100, job_duration = 0.01)
+
+    async def test(client):
+        poller = zuva_client.JobPoller(client, initial_interval = 0.01, max_interval = 0.02, max_errors = 3)
+        poller.add_all(await client.create_jobs('language', [await client.create_file(b'eocr')]))
+        return await asyncio.wait_for(poller.wait(), 10)
+
+    job, = _run(test, server)
+
+    assert isinstance(job.error, zuva_client.ZuvaHTTPError) and job.error.status == 500
+    assert job.status is None
+    assert server.polls == 3
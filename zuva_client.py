@@ -0,0 +1,426 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# An asyncio client for submitting .eocr files to Zuva and polling many jobs (classification, language,
+# extraction) at the same time. HTTP connections are kept alive and reused, the number of requests in flight is
+# capped, and each job is polled with its own backoff, so that thousands of jobs can be followed from one process.
+# See zuva_mock_server.py to run it offline.
+
+
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+import asyncio
+import json
+import math
+import random
+import ssl
+import time
+
+# The kinds of jobs, which are also their API paths
+job_kinds = ('classification', 'language', 'extraction')
+
+# The job statuses after which a job is not polled anymore
+done_statuses = ('complete', 'failed')
+
+# The methods whose requests are sent again when their connection fails after they were sent: the server may have
+# handled the request already, which only does no harm for these
+idempotent_methods = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+
+def get_retry_after(value):
+    """
+    Returns the number of seconds a Retry-After header asks to wait before sending a request again: the header is
+    either a number of seconds or an HTTP-date (e.g. 'Wed, 21 Oct 2026 07:28:00 GMT').
+
+    :return: The number of seconds (0 for a date that has passed), or None if the header is neither
+    """
+    try:
+        delay = float(value)
+    except ValueError:
+        try:
+            date = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if date.tzinfo is None:
+            date = date.replace(tzinfo = timezone.utc)
+        delay = (date - datetime.now(timezone.utc)).total_seconds()
+
+    return max(delay, 0.0) if not math.isnan(delay) else None
+
+
+class ZuvaHTTPError(Exception):
+    def __init__(self, status, content):
+        super().__init__(f'HTTP {status}: {content!r}')
+        self.status = status
+        self.content = content
+
+
+class ConnectError(ConnectionError):
+    """
+    A connection to the host could not be opened, so the request was not sent.
+    """
+
+
+class _Connection(object):
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @property
+    def is_closed(self) -> bool:
+        return self.reader.at_eof() or self.writer.is_closing()
+
+    def close(self):
+        self.writer.close()
+
+
+class ConnectionPool(object):
+    """
+    Keeps HTTP/1.1 connections to one host alive between requests.
+
+    :param url: The base URL of the host (http or https)
+    :param size: The maximum number of open connections
+    """
+    def __init__(self, url, size = 8):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.secure = parts.scheme == 'https'
+        self.port = parts.port or (443 if self.secure else 80)
+        self.prefix = parts.path.rstrip('/')
+        self.size = size
+        self.opened = 0
+        self._idle = []
+        self._slots = asyncio.Semaphore(size)
+
+    async def _connect(self) -> _Connection:
+        try:
+            reader, writer = await asyncio.open_connection(self.host, self.port,
+                                                           ssl = ssl.create_default_context() if self.secure else None)
+        except OSError as e:
+            raise ConnectError(f'Could not connect to {self.host}:{self.port}: {e}') from e
+
+        self.opened += 1
+        return _Connection(reader, writer)
+
+    def _pop_idle(self):
+        """
+        Returns an idle connection that the server has not closed (closing the ones it has), or None.
+        """
+        while self._idle:
+            connection = self._idle.pop()
+            if not connection.is_closed:
+                return connection
+            connection.close()
+
+        return None
+
+    async def _read_response(self, connection):
+        status_line = await connection.reader.readline()
+        if not status_line:
+            raise ConnectionError('The connection was closed by the server')
+
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = (await connection.reader.readline()).decode('latin-1')
+            if line in ('\r\n', '\n', ''):
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = bytearray()
+            while True:
+                size = int((await connection.reader.readline()).split(b';')[0], 16)
+                body += await connection.reader.readexactly(size + 2)
+                del body[-2:]
+                if size == 0:
+                    await connection.reader.readline()
+                    break
+            body = bytes(body)
+        else:
+            body = await connection.reader.readexactly(int(headers.get('content-length', 0)))
+
+        return status, headers, body
+
+    async def request(self, method, path, body = b'', headers = None):
+        """
+        Sends a request on an idle connection (or a new one) and reads the response.
+
+        :return: A tuple of (status, response headers, response body)
+        """
+        request = [f'{method} {self.prefix}{path} HTTP/1.1', f'Host: {self.host}', f'Content-Length: {len(body)}']
+        request.extend(f'{name}: {value}' for name, value in (headers or {}).items())
+        request = ('\r\n'.join(request) + '\r\n\r\n').encode('latin-1') + body
+
+        async with self._slots:
+            # An idle connection may have been closed by the server just as the request was sent on it. The request
+            # of an idempotent method is then sent again on the next one (or a new one); others may have been handled
+            # by the server, so their failure is raised like the failure of a new connection.
+            while True:
+                connection = self._pop_idle()
+                reused = connection is not None
+                if not reused:
+                    connection = await self._connect()
+
+                try:
+                    connection.writer.write(request)
+                    await connection.writer.drain()
+                    status, response_headers, response_body = await self._read_response(connection)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    connection.close()
+                    if reused and method in idempotent_methods:
+                        continue
+                    raise
+
+                if response_headers.get('connection', '').lower() == 'close':
+                    connection.close()
+                else:
+                    self._idle.append(connection)
+
+                return status, response_headers, response_body
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+        for connection in idle:
+            await connection.writer.wait_closed()
+
+
+class ZuvaClient(object):
+    """
+    :param url: The base URL of the Zuva API (e.g. https://us.app.zuva.ai/api/v2)
+    :param token: The API token
+    :param max_in_flight: The maximum number of requests sent at the same time (also the number of connections)
+    :param max_retries: The number of times a request is retried after a 429/502/503/504, or after a connection
+                        error (for the requests of idempotent_methods, or that could not be sent)
+    :param max_retry_delay: The maximum number of seconds to wait before retrying a request, whatever the server's
+                            Retry-After
+    """
+    def __init__(self, url, token = None, max_in_flight = 8, max_retries = 5, max_retry_delay = 60.0):
+        self.pool = ConnectionPool(url, size = max_in_flight)
+        self.token = token
+        self.max_retries = max_retries
+        self.max_retry_delay = max_retry_delay
+        self.requests = 0
+
+    async def request(self, method, path, content = None, body = b'', content_type = None):
+        """
+        Sends a request, retrying it (after the server's Retry-After, or with backoff) when the server is busy.
+
+        :param content: Optional JSON content of the request
+        :param body: The raw body of the request (when content is not set)
+        :return: The JSON content of the response (or its raw body if it is not JSON)
+        """
+        headers = {'Accept': 'application/json'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        if content is not None:
+            body = json.dumps(content).encode()
+            content_type = 'application/json'
+        if content_type:
+            headers['Content-Type'] = content_type
+
+        delay = 0.5
+        for attempt in range(self.max_retries + 1):
+            self.requests += 1
+            try:
+                status, response_headers, response_body = await self.pool.request(method, path, body, headers)
+            except (ConnectionError, asyncio.IncompleteReadError, OSError) as e:
+                if attempt == self.max_retries or not (method in idempotent_methods or isinstance(e, ConnectError)):
+                    raise
+            else:
+                if status not in (429, 502, 503, 504) or attempt == self.max_retries:
+                    break
+                retry_after = get_retry_after(response_headers.get('retry-after', ''))
+                if retry_after is not None:
+                    delay = retry_after
+
+            delay = min(delay, self.max_retry_delay)
+            await asyncio.sleep(delay * random.uniform(1, 1.25))
+            delay *= 2
+
+        if status >= 400:
+            raise ZuvaHTTPError(status, response_body)
+
+        if response_headers.get('content-type', '').startswith('application/json'):
+            return json.loads(response_body)
+        return response_body
+
+    async def create_file(self, content) -> str:
+        """
+        Uploads a file (e.g. .eocr content).
+
+        :return: The file id
+        """
+        return (await self.request('POST', '/files', body = content,
+                                   content_type = 'application/octet-stream'))['file_id']
+
+    async def create_jobs(self, kind, file_ids, field_ids = None) -> list:
+        """
+        Starts a job of the given kind (see job_kinds) for each file.
+
+        :return: A list of Job
+        """
+        content = {'file_ids': file_ids}
+        if field_ids is not None:
+            content['field_ids'] = field_ids
+
+        response = await self.request('POST', f'/{kind}', content = content)
+        return [Job(kind, job['request_id'], job.get('file_id')) for job in response['file_ids']]
+
+    async def get_job(self, job) -> dict:
+        return await self.request('GET', f'/{job.kind}/{job.request_id}')
+
+    async def get_result(self, job) -> dict:
+        """
+        Returns the result of a complete job: the job's status for classification and language jobs, and the
+        extracted text of extraction jobs.
+        """
+        if job.kind == 'extraction':
+            return await self.request('GET', f'/extraction/{job.request_id}/results/text')
+        return job.status_content
+
+    async def close(self):
+        await self.pool.close()
+
+
+class Job(object):
+    """
+    :param kind: The kind of job (see job_kinds)
+    :param request_id: The request id of the job
+    :param file_id: The file the job is for
+    """
+    def __init__(self, kind, request_id, file_id = None):
+        self.kind = kind
+        self.request_id = request_id
+        self.file_id = file_id
+        self.status = None
+        self.status_content = None
+        self.result = None
+        self.error = None
+        self.callback_error = None
+        self.polls = 0
+        self.started = time.monotonic()
+        self.finished = None
+
+    @property
+    def is_done(self) -> bool:
+        return self.status in done_statuses or self.error is not None
+
+
+class JobPoller(object):
+    """
+    Polls many jobs at the same time. Each job waits initial_interval before its first poll, and its interval grows
+    by backoff (with jitter) after every poll that finds it still running, or that fails (a connection error, or an
+    HTTP error after the client's retries), up to max_interval. Finished jobs are delivered to the callback and/or
+    through the async iterator.
+
+    :param client: The ZuvaClient, whose max_in_flight caps the requests of all the jobs
+    :param callback: Optional function (or coroutine function) called with each finished Job. An exception it
+                     raises is kept in the Job's callback_error.
+    :param initial_interval: The number of seconds before a job's first poll
+    :param max_interval: The maximum number of seconds between two polls of a job
+    :param backoff: The factor the interval grows by after each poll
+    :param max_errors: The number of polls of a job in a row that can fail before the job is given up (with the
+                       error of the last one)
+    """
+    def __init__(self, client, callback = None, initial_interval = 1.0, max_interval = 30.0, backoff = 1.5,
+                 max_errors = 5):
+        self.client = client
+        self.callback = callback
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.max_errors = max_errors
+        self._tasks = set()
+        self._finished = asyncio.Queue()
+        self._pending = 0
+
+    def add(self, job):
+        """
+        Starts polling a job. Must be called from a running event loop.
+        """
+        self._pending += 1
+        task = asyncio.get_running_loop().create_task(self._poll(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def add_all(self, jobs):
+        for job in jobs:
+            self.add(job)
+
+    async def _poll(self, job):
+        interval = self.initial_interval
+        errors = 0
+
+        try:
+            while True:
+                await asyncio.sleep(interval * random.uniform(0.9, 1.1))
+                interval = min(interval * self.backoff, self.max_interval)
+
+                try:
+                    job.status_content = await self.client.get_job(job)
+                except (ZuvaHTTPError, ConnectionError, asyncio.IncompleteReadError, OSError):
+                    # The job may still be running: it is polled again, unless its polls keep failing
+                    errors += 1
+                    if errors >= self.max_errors:
+                        raise
+                    continue
+
+                errors = 0
+                job.status = job.status_content.get('status')
+                job.polls += 1
+
+                if job.is_done:
+                    break
+
+            if job.status == 'complete':
+                job.result = await self.client.get_result(job)
+        except Exception as e:
+            job.error = e
+
+        job.finished = time.monotonic()
+        await self._finish(job)
+
+    async def _finish(self, job):
+        # An error of the callback is kept on the job, which is finished all the same (so that wait() returns)
+        try:
+            if self.callback is not None:
+                result = self.callback(job)
+                if asyncio.iscoroutine(result):
+                    await result
+        except Exception as e:
+            job.callback_error = e
+        finally:
+            await self._finished.put(job)
+
+    async def __aiter__(self):
+        """
+        Yields each Job as soon as it is finished (complete, failed or errored), until every added job is.
+        """
+        while self._pending:
+            job = await self._finished.get()
+            self._pending -= 1
+            yield job
+
+    async def wait(self) -> list:
+        """
+        Waits for every added job to finish.
+
+        :return: The list of finished Job, in the order they finished
+        """
+        return [job async for job in self]
@@ -0,0 +1,232 @@
+# Copyright 2021 Zuva Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# A local stand-in for the Zuva API, for running zuva_client.py (and its benchmark) offline. Uploaded files are
+# only counted, and jobs complete after a random duration:
+#
+#   python3 zuva_mock_server.py [--port 8090] [--job-duration 2] [--failure-rate 0] [--max-concurrent 0]
+#                               [--max-requests-per-connection 0]
+#
+#   POST /files                                  -> {"file_id"}
+#   POST /{classification,language,extraction}   -> {"file_ids": [{"file_id", "request_id", "status"}]}
+#   GET  /{kind}/{request_id}                    -> {"request_id", "status", ...}
+#   GET  /extraction/{request_id}/results/text   -> {"file_id", "request_id", "results": [...]}
+#   GET  /metrics                                -> the request and connection counts
+
+
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+
+import zuva_client
+
+
+class MockJob(object):
+    def __init__(self, kind, request_id, file_id, ready_at, failed):
+        self.kind = kind
+        self.request_id = request_id
+        self.file_id = file_id
+        self.ready_at = ready_at
+        self.failed = failed
+
+    @property
+    def status(self) -> str:
+        if time.monotonic() < self.ready_at:
+            return 'processing'
+        return 'failed' if self.failed else 'complete'
+
+    def to_dict(self) -> dict:
+        content = {'request_id': self.request_id, 'file_id': self.file_id, 'status': self.status}
+
+        if content['status'] == 'complete' and self.kind == 'classification':
+            content.update(classification = 'Agreement', is_contract = True)
+        elif content['status'] == 'complete' and self.kind == 'language':
+            content.update(language = 'English')
+
+        return content
+
+
+class MockZuvaServer(object):
+    """
+    :param job_duration: The mean number of seconds a job takes (each job takes 0.5 to 1.5 times as long)
+    :param failure_rate: The fraction of jobs that fail
+    :param max_concurrent: Optional number of requests handled at the same time, past which the server answers
+                           429 (with a Retry-After), like a rate-limited API
+    :param retry_after: The Retry-After (in seconds) of the 429 responses
+    :param max_requests_per_connection: Optional number of requests after which the server closes a connection
+                                        (without telling the client), like a server's keep-alive limit
+    """
+    def __init__(self, job_duration = 2.0, failure_rate = 0.0, max_concurrent = None, retry_after = 0.1,
+                 max_requests_per_connection = None):
+        self.job_duration = job_duration
+        self.failure_rate = failure_rate
+        self.max_concurrent = max_concurrent
+        self.retry_after = retry_after
+        self.max_requests_per_connection = max_requests_per_connection
+        self.files = {}
+        self.jobs = {}
+        self.requests = 0
+        self.connections = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self._ids = itertools.count()
+        self._server = None
+        self._handlers = set()
+
+    def _new_id(self, prefix) -> str:
+        return f'{prefix}-{next(self._ids):08d}'
+
+    def _route(self, method, path, body):
+        parts = path.strip('/').split('/')
+
+        if method == 'POST' and parts == ['files']:
+            file_id = self._new_id('file')
+            self.files[file_id] = len(body)
+            return 201, {'file_id': file_id, 'expiration': '2099-01-01T00:00:00Z'}
+
+        if method == 'POST' and len(parts) == 1 and parts[0] in zuva_client.job_kinds:
+            content = json.loads(body)
+            jobs = []
+            for file_id in content['file_ids']:
+                if file_id not in self.files:
+                    return 404, {'error': f'{file_id} does not exist'}
+                job = MockJob(parts[0], self._new_id(parts[0]), file_id,
+                              time.monotonic() + self.job_duration * random.uniform(0.5, 1.5),
+                              random.random() < self.failure_rate)
+                self.jobs[job.request_id] = job
+                jobs.append({'file_id': file_id, 'request_id': job.request_id, 'status': 'queued'})
+            return 202, {'file_ids': jobs}
+
+        if method == 'GET' and parts == ['metrics']:
+            return 200, {'requests': self.requests, 'connections': self.connections, 'rejected': self.rejected,
+                         'files': len(self.files), 'jobs': len(self.jobs)}
+
+        if method == 'GET' and len(parts) >= 2 and parts[0] in zuva_client.job_kinds:
+            job = self.jobs.get(parts[1])
+            if job is None or job.kind != parts[0]:
+                return 404, {'error': f'{parts[1]} does not exist'}
+
+            if parts[2:] == ['results', 'text'] and job.kind == 'extraction':
+                if job.status != 'complete':
+                    return 409, {'error': f'{job.request_id} is {job.status}'}
+                return 200, {'file_id': job.file_id, 'request_id': job.request_id,
+                             'results': [{'field_id': 'title', 'extractions': [{'text': 'Agreement',
+                                                                               'spans': [{'start': 0,
+                                                                                          'end': 9}]}]}]}
+            if not parts[2:]:
+                return 200, job.to_dict()
+
+        return 404, {'error': f'{method} {path} is not supported'}
+
+    async def _respond(self, writer, status, content, headers = None):
+        body = json.dumps(content).encode()
+        head = [f'HTTP/1.1 {status} Mock', 'Content-Type: application/json', f'Content-Length: {len(body)}']
+        head.extend(f'{name}: {value}' for name, value in (headers or {}).items())
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode() + body)
+        await writer.drain()
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        self._handlers.add(asyncio.current_task())
+
+        try:
+            # Connections are kept alive until the client closes them (or max_requests_per_connection)
+            requests = 0
+            while not self.max_requests_per_connection or requests < self.max_requests_per_connection:
+                request_line = (await reader.readline()).decode('latin-1').split()
+                if len(request_line) < 2:
+                    break
+
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode('latin-1')
+                    if line in ('\r\n', '\n', ''):
+                        break
+                    name, _, value = line.partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                self.requests += 1
+                requests += 1
+
+                if self.max_concurrent and self.in_flight >= self.max_concurrent:
+                    self.rejected += 1
+                    await self._respond(writer, 429, {'error': 'Too many requests'},
+                                        {'Retry-After': self.retry_after})
+                    continue
+
+                self.in_flight += 1
+                try:
+                    # Let other requests in, so that max_concurrent has something to count
+                    await asyncio.sleep(0)
+                    status, content = self._route(request_line[0], request_line[1].split('?')[0], body)
+                    await self._respond(writer, status, content)
+                finally:
+                    self.in_flight -= 1
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
+
+    async def start(self, host = '127.0.0.1', port = 0) -> str:
+        """
+        Starts listening (on a free port by default).
+
+        :return: The base URL of the server
+        """
+        self._server = await asyncio.start_server(self.handle, host, port)
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f'http://{host}:{port}'
+
+    async def serve_forever(self):
+        await self._server.serve_forever()
+
+    async def close(self):
+        """
+        Stops listening and waits for the open connections to be closed by their clients.
+        """
+        self._server.close()
+        if self._handlers:
+            await asyncio.wait(self._handlers, timeout = 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Serves a mock Zuva API')
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 8090)
+    parser.add_argument('--job-duration', type = float, default = 2.0, help = 'Mean seconds a job takes')
+    parser.add_argument('--failure-rate', type = float, default = 0.0, help = 'Fraction of jobs that fail')
+    parser.add_argument('--max-concurrent', type = int, help = 'Requests handled at once before answering 429')
+    parser.add_argument('--max-requests-per-connection', type = int,
+                        help = 'Close a connection after this many requests')
+    args = parser.parse_args()
+
+    async def serve():
+        server = MockZuvaServer(args.job_duration, args.failure_rate, args.max_concurrent,
+                                max_requests_per_connection = args.max_requests_per_connection)
+        print(f'Listening on {await server.start(args.host, args.port)}')
+        await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()